@@ -0,0 +1,152 @@
+import sys
+import time
+import yaml
+import shutil
+import tempfile
+import tracemalloc
+from optparse import OptionParser
+
+from benchmark.repository import SyntheticRepository
+from benchmark.server import MockDataverseServer
+from benchmark.database import MockDataverseDatabase
+
+from run import load_config, load_logger, ensure_directory_exists, create_fieldnames, create_report_context, close_report_context, create_excel_report
+
+
+def main():
+    parser = OptionParser(usage="python -m benchmark [options]")
+
+    parser.add_option("-c", "--config", dest="config_file", default="config/application.yml.sample", help="Configuration file for the report settings. The API, database, work directory and logging settings are replaced.")
+    parser.add_option("-r", "--report(s)", dest="reports", default='dataverse,dataset,user,all', help="Comma separated report types to benchmark. Options = dataverse, dataset, user, all.")
+    parser.add_option("-i", "--identifier", dest="identifier", default='root', help="Dataverse to generate the reports for.")
+    parser.add_option("-w", "--workers", type="int", dest="workers", default=1, help="Number of concurrent API workers used to crawl dataverses.")
+    parser.add_option("-a", "--async", action="store_true", dest="use_async", default=False, help="Crawl dataverses with the asyncio API client instead of worker threads?")
+    parser.add_option("-s", "--set", action="append", dest="settings", default=[], help="Configuration setting to override as key=value, e.g. tree_source=database. Can be repeated.")
+    parser.add_option("--dataverses", type="int", dest="dataverses", default=500, help="Number of dataverses in the synthetic repository.")
+    parser.add_option("--datasets", type="int", dest="datasets", default=100000, help="Number of datasets in the synthetic repository.")
+    parser.add_option("--users", type="int", dest="users", default=50000, help="Number of users in the synthetic repository.")
+    parser.add_option("--seed", type="int", dest="seed", default=0, help="Seed the synthetic repository is generated from.")
+    parser.add_option("--latency", type="float", dest="latency", default=0.0, help="Seconds the mock server waits before answering each API request.")
+    parser.add_option("--no-trace-memory", action="store_false", dest="trace_memory", default=True, help="Skip measuring peak memory, which slows down the reports?")
+    parser.add_option("-o", "--output_dir", dest="output_dir", help="Directory to keep the report files in. A temporary directory is used and removed if not given.")
+    parser.add_option("--log-level", dest="log_level", default='WARNING', help="Log level of the reports. Options = DEBUG, INFO, WARNING, ERROR.")
+
+    (options, args) = parser.parse_args()
+
+    report_types = [report_type.strip() for report_type in options.reports.split(',') if report_type.strip()]
+    if len(report_types) == 0 or any(report_type not in ['dataverse', 'dataset', 'user', 'all'] for report_type in report_types):
+        parser.print_help()
+        parser.error("Must specify report type(s) from the following options: dataverse, dataset, user, all.")
+
+    if options.workers < 1:
+        parser.print_help()
+        parser.error("Number of workers must be at least 1.")
+
+    if options.dataverses < 1 or options.datasets < 0 or options.users < 0:
+        parser.print_help()
+        parser.error("Synthetic repository needs at least 1 dataverse and cannot have a negative number of datasets or users.")
+
+    if options.latency < 0:
+        parser.print_help()
+        parser.error("Latency cannot be negative.")
+
+    settings = {}
+    for setting in options.settings:
+        key, separator, value = setting.partition('=')
+        if not separator:
+            parser.print_help()
+            parser.error("Settings must be given as key=value.")
+        settings[key.strip()] = yaml.safe_load(value)
+
+    # Load the report settings
+    config = load_config(options.config_file)
+    if not config:
+        print("Unable to load configuration.")
+        sys.exit(0)
+    config.update(settings)
+
+    # Report files go to a temporary work directory unless they should be kept
+    work_dir = options.output_dir or tempfile.mkdtemp(prefix='dataverse-reports-benchmark-')
+    if work_dir[len(work_dir)-1] != '/':
+        work_dir = work_dir + '/'
+    ensure_directory_exists(work_dir)
+
+    # Results are printed, so only log problems by default
+    config.update({'work_dir': work_dir, 'log_path': work_dir, 'log_file': 'dataverse-reports.log', 'log_level': options.log_level.upper(), 'response_cache': False, 'dataverse_api_key': 'benchmark'})
+    load_logger(config=config)
+
+    repository_options = {'dataverses': options.dataverses, 'datasets': options.datasets, 'users': options.users, 'seed': options.seed}
+    print("Generating synthetic repository with %s dataverses, %s datasets and %s users (seed %s)..." % (options.dataverses, options.datasets, options.users, options.seed))
+
+    # The server builds its own copy of the repository from the same seed in a separate process
+    server = MockDataverseServer(repository_options=repository_options, latency=options.latency)
+    config['dataverse_api_host'] = server.start()
+    repository = SyntheticRepository(**repository_options)
+
+    results = []
+    try:
+        fieldnames, verified_dataset_fieldnames = create_fieldnames(config=config)
+        for report_type in report_types:
+            print("Benchmarking %s report..." % report_type)
+            results.append(benchmark_report(report_type=report_type, identifier=options.identifier, config=config, options=options, work_dir=work_dir, repository=repository, server=server, fieldnames=fieldnames))
+    finally:
+        server.stop()
+        if options.output_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_results(results, latency=options.latency)
+
+def benchmark_report(report_type=None, identifier=None, config=None, options=None, work_dir=None, repository=None, server=None, fieldnames={}):
+    # Wall time, API requests per endpoint, database queries and peak traced memory of one report type
+    # Each report type gets new connections and caches, so earlier report types do not warm it up
+    dataverse_database = MockDataverseDatabase(repository=repository)
+    context = create_report_context(config=config, options=options, work_dir=work_dir, dataverse_database=dataverse_database)
+    if not context:
+        print("Unable to connect to the mock Dataverse server.")
+        sys.exit(1)
+
+    server.reset_request_counts()
+    dataverse_database.reset_query_counts()
+    if options.trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    excel_report_file = create_excel_report(context=context, report_type=report_type, dataverse_identifier=identifier, file_path_prefix=work_dir + report_type + '-', output_file_path=work_dir + report_type + '-dataverse-reports.xlsx', fieldnames=fieldnames, save_csv=config.get('save_csv_reports', True))
+    wall_time = time.perf_counter() - start
+
+    peak_memory = None
+    if options.trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    requests = server.reset_request_counts()
+    queries = dataverse_database.reset_query_counts()
+    close_report_context(context)
+
+    return {'report': report_type, 'saved': bool(excel_report_file), 'wall_time': wall_time, 'requests': requests, 'queries': queries, 'peak_memory': peak_memory}
+
+def print_results(results=[], latency=0.0):
+    # One row per report type, with a column per API endpoint
+    endpoints = ['info', 'dataverses', 'contents', 'storagesize', 'sword', 'datasets', 'makeDataCount', 'list-users']
+    endpoints = endpoints + sorted(set(endpoint for result in results for endpoint in result['requests']) - set(endpoints))
+
+    print()
+    print("Mock server latency: %.3f seconds per request" % latency)
+    if any(result['peak_memory'] is not None for result in results):
+        print("Peak memory is traced with tracemalloc, which slows down the reports; use --no-trace-memory to compare wall times.")
+    headers = ['report', 'wall time (s)', 'peak memory (MB)', 'requests'] + endpoints + ['db queries']
+    rows = []
+    for result in results:
+        row = [result['report'] + ('' if result['saved'] else ' (failed)'), '%.2f' % result['wall_time'],
+               '-' if result['peak_memory'] is None else '%.1f' % (result['peak_memory'] / 1048576), str(sum(result['requests'].values()))]
+        row += [str(result['requests'].get(endpoint, 0)) for endpoint in endpoints]
+        row.append(str(sum(result['queries'].values())))
+        rows.append(row)
+
+    widths = [max(len(header), max([len(row[c]) for row in rows] or [0])) for c, header in enumerate(headers)]
+    print('  '.join(header.rjust(widths[c]) for c, header in enumerate(headers)))
+    for row in rows:
+        print('  '.join(value.rjust(widths[c]) for c, value in enumerate(row)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import logging
+import datetime
+
+
+class MockDataverseDatabase(object):
+    # Answers the DataverseDatabase queries from the synthetic repository the mock server serves, without PostgreSQL
+
+    def __init__(self, repository=None):
+        self.repository = repository
+        self.queries = {}
+
+        self.logger = logging.getLogger('dataverse-reports')
+
+    def count_query(self, name):
+        self.queries[name] = self.queries.get(name, 0) + 1
+
+    def reset_query_counts(self):
+        # Returns the counts since the last reset
+        queries = self.queries
+        self.queries = {}
+        return queries
+
+    def create_connection(self):
+        self.logger.info("Using the synthetic repository instead of the Dataverse database.")
+        return True
+
+    def get_download_count(self, dataset_id=None):
+        if dataset_id is None:
+            print("Dataset ID is required.")
+            return
+
+        self.count_query('download_count')
+        return self.repository.get_download_count(int(dataset_id))
+
+    def get_download_counts(self, dataset_ids=[]):
+        counts = {}
+        if len(dataset_ids) == 0:
+            return counts
+
+        self.count_query('download_counts')
+        for dataset_id in dataset_ids:
+            counts[dataset_id] = self.repository.get_download_count(dataset_id)
+        return counts
+
+    def get_dataset_metrics(self, dataset_ids=[], month=None):
+        metrics = {}
+        if len(dataset_ids) == 0:
+            return metrics
+
+        # Same values the mock server's makeDataCount endpoint returns
+        self.count_query('dataset_metrics')
+        for dataset_id in dataset_ids:
+            metrics[dataset_id] = {'total': self.repository.get_metrics(dataset_id), 'month': self.repository.get_metrics(dataset_id, month)}
+        return metrics
+
+    def get_dataset_sizes(self, dataset_ids=[]):
+        sizes = {}
+        if len(dataset_ids) == 0:
+            return sizes
+
+        self.count_query('dataset_sizes')
+        for dataset_id in dataset_ids:
+            sizes[dataset_id] = self.repository.dataset_sizes.get(dataset_id, 0)
+        return sizes
+
+    def get_release_statuses(self, dvobject_ids=[]):
+        statuses = {}
+        if len(dvobject_ids) == 0:
+            return statuses
+
+        self.count_query('release_statuses')
+        for dvobject_id in dvobject_ids:
+            if dvobject_id in self.repository.owners:
+                statuses[dvobject_id] = self.repository.is_released(dvobject_id)
+        return statuses
+
+    def get_dataset_versions(self, dataset_ids=[]):
+        versions = {}
+        if len(dataset_ids) == 0:
+            return versions
+
+        self.count_query('dataset_versions')
+        for dataset_id in dataset_ids:
+            if self.repository.is_dataset(dataset_id):
+                latest_version = self.repository.get_dataset(dataset_id, files=False)['latestVersion']
+                last_update_time = datetime.datetime.strptime(latest_version['lastUpdateTime'], '%Y-%m-%dT%H:%M:%SZ')
+                versions[dataset_id] = {'lastUpdateTime': str(last_update_time), 'versionState': latest_version['versionState']}
+        return versions
+
+    def get_subtree(self, dataverse_identifier=None):
+        if dataverse_identifier is None:
+            print("Dataverse identifier is required.")
+            return
+
+        self.count_query('subtree')
+        subtree = []
+        dataverse_id = self.repository.find_dataverse(str(dataverse_identifier))
+        if dataverse_id is None:
+            return subtree
+
+        for dvobject_id, depth in self.repository.get_subtree(dataverse_id):
+            owner_id = self.repository.owners[dvobject_id]
+            if self.repository.is_dataset(dvobject_id):
+                subtree.append({'id': dvobject_id, 'type': 'dataset', 'ownerId': owner_id, 'parentAlias': self.repository.aliases[owner_id], 'depth': depth, 'identifier': self.repository.get_identifier(dvobject_id)})
+            else:
+                subtree.append({'id': dvobject_id, 'type': 'dataverse', 'ownerId': owner_id, 'parentAlias': self.repository.aliases.get(owner_id), 'depth': depth, 'identifier': None})
+        return subtree
+
+    def get_dataset_metadata(self, dataset_ids=[]):
+        datasets = {}
+        if len(dataset_ids) == 0:
+            return datasets
+
+        self.count_query('dataset_metadata')
+        for dataset_id in dataset_ids:
+            if self.repository.is_dataset(dataset_id):
+                # The latest version's JSON without its files, with the file summary the database query adds
+                files = self.repository.get_files(dataset_id)
+                dataset = self.repository.get_dataset(dataset_id, files=False)
+                dataset['fileSummary'] = {'contentSize': sum(size for restricted, size in files), 'totalFiles': len(files), 'totalRestrictedFiles': sum(1 for restricted, size in files if restricted)}
+                datasets[dataset_id] = dataset
+        return datasets
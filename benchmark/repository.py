@@ -0,0 +1,200 @@
+import random
+import datetime
+
+
+class SyntheticRepository(object):
+    def __init__(self, dataverses=500, datasets=100000, users=50000, seed=0, users_per_page=25, max_files=5):
+        # Every object is derived from the seed, so the mock server and database stub build the same repository
+        self.seed = seed
+        self.users_per_page = users_per_page
+        self.max_files = max_files
+        self.installation_name = 'Synthetic Dataverse'
+
+        rng = random.Random(str(seed) + '-tree')
+
+        # Dataverse 1 is the root; every other dataverse hangs off an earlier one, so the tree is a few levels deep
+        self.dataverse_ids = list(range(1, max(dataverses, 1) + 1))
+        self.owners = {1: None}
+        self.aliases = {1: 'root'}
+        self.children = {1: []}
+        for dataverse_id in self.dataverse_ids[1:]:
+            owner_id = rng.choice(self.dataverse_ids[:dataverse_id - 1])
+            self.owners[dataverse_id] = owner_id
+            self.aliases[dataverse_id] = 'dv' + str(dataverse_id)
+            self.children[dataverse_id] = []
+            self.children[owner_id].append(dataverse_id)
+        self.dataverses_by_alias = {alias: dataverse_id for dataverse_id, alias in self.aliases.items()}
+
+        # Datasets get the ids after the dataverses and are spread over all dataverses
+        self.dataset_ids = list(range(len(self.dataverse_ids) + 1, len(self.dataverse_ids) + datasets + 1))
+        self.datasets = {dataverse_id: [] for dataverse_id in self.dataverse_ids}
+        for dataset_id in self.dataset_ids:
+            owner_id = rng.choice(self.dataverse_ids)
+            self.owners[dataset_id] = owner_id
+            self.datasets[owner_id].append(dataset_id)
+
+        self.user_count = users
+
+        # Per-dataset file sizes are needed for every storagesize call, so sum them once
+        self.dataset_sizes = {dataset_id: sum(size for restricted, size in self.get_files(dataset_id)) for dataset_id in self.dataset_ids}
+        self.subtree_sizes = {}
+        for dataverse_id in reversed(self.dataverse_ids):
+            self.subtree_sizes[dataverse_id] = sum(self.dataset_sizes[dataset_id] for dataset_id in self.datasets[dataverse_id]) + sum(self.subtree_sizes[child_id] for child_id in self.children[dataverse_id])
+
+    def get_rng(self, *keys):
+        return random.Random('-'.join(str(key) for key in (self.seed,) + keys))
+
+    def find_dataverse(self, identifier):
+        # Dataverse id for an alias or id, or None
+        if identifier in self.dataverses_by_alias:
+            return self.dataverses_by_alias[identifier]
+        if identifier.isdigit() and int(identifier) in self.aliases:
+            return int(identifier)
+
+    def is_dataset(self, dataset_id):
+        return dataset_id in self.owners and dataset_id not in self.aliases
+
+    def is_released(self, dvobject_id):
+        # The root and most other objects are published
+        return dvobject_id == 1 or self.get_rng('released', dvobject_id).random() < 0.9
+
+    def get_date(self, rng, start_year=2015):
+        return datetime.datetime(start_year, 1, 1) + datetime.timedelta(seconds=rng.randint(0, 8 * 365 * 86400))
+
+    def get_files(self, dataset_id):
+        # (restricted, size in bytes) of each file of the dataset
+        rng = self.get_rng('files', dataset_id)
+        return [(rng.random() < 0.1, rng.randint(1024, 50 * 1048576)) for i in range(rng.randint(0, self.max_files))]
+
+    def get_identifier(self, dataset_id):
+        return 'FK2/' + format(dataset_id, '06X')
+
+    def get_user(self, index):
+        rng = self.get_rng('user', index)
+        user = {'id': index + 1, 'userIdentifier': 'user' + str(index + 1), 'lastName': 'Last' + str(index + 1), 'firstName': 'First' + str(index + 1),
+                'email': 'user' + str(index + 1) + '@example.edu', 'affiliation': 'University ' + str(rng.randint(1, 30)), 'isSuperuser': index == 0,
+                'deactivated': False, 'createdTime': self.get_date(rng).strftime('%Y-%m-%d %H:%M:%S.0')}
+        if rng.random() < 0.8:
+            user['lastLoginTime'] = self.get_date(rng, start_year=2020).strftime('%Y-%m-%d %H:%M:%S.0')
+        return user
+
+    def get_contact_email(self, dataverse_id):
+        return 'user' + str(self.get_rng('contact', dataverse_id).randint(1, max(self.user_count, 1))) + '@example.edu'
+
+    def get_dataverse(self, dataverse_id):
+        rng = self.get_rng('dataverse', dataverse_id)
+        dataverse = {'id': dataverse_id, 'alias': self.aliases[dataverse_id], 'name': self.get_dataverse_name(dataverse_id), 'affiliation': 'University ' + str(rng.randint(1, 30)),
+                     'dataverseContacts': [{'displayOrder': 0, 'contactEmail': self.get_contact_email(dataverse_id)}], 'permissionRoot': True,
+                     'description': 'Synthetic dataverse ' + str(dataverse_id), 'dataverseType': rng.choice(['RESEARCH_PROJECTS', 'LABORATORY', 'DEPARTMENT', 'UNCATEGORIZED']),
+                     'creationDate': self.get_date(rng).strftime('%Y-%m-%dT%H:%M:%SZ')}
+        if self.owners[dataverse_id] is not None:
+            dataverse['ownerId'] = self.owners[dataverse_id]
+        return dataverse
+
+    def get_dataverse_name(self, dataverse_id):
+        return 'Dataverse ' + str(dataverse_id)
+
+    def get_child_ids(self, dataverse_id):
+        # Datasets, then dataverses by name (so "Dataverse 10" comes before "Dataverse 2"), as Dataverse lists a dataverse's contents
+        return self.datasets[dataverse_id] + sorted(self.children[dataverse_id], key=self.get_dataverse_name)
+
+    def get_contents(self, dataverse_id):
+        contents = []
+        for child_id in self.get_child_ids(dataverse_id):
+            if child_id in self.aliases:
+                contents.append({'type': 'dataverse', 'id': child_id, 'title': self.get_dataverse_name(child_id)})
+                continue
+
+            identifier = self.get_identifier(child_id)
+            contents.append({'type': 'dataset', 'id': child_id, 'identifier': identifier, 'persistentUrl': 'https://doi.org/10.5072/' + identifier, 'protocol': 'doi', 'authority': '10.5072',
+                             'publisher': self.installation_name, 'storageIdentifier': 'file://10.5072/' + identifier})
+        return contents
+
+    def get_dataset(self, dataset_id, files=True):
+        # The native API's dataset JSON, with the citation fields the reports use
+        rng = self.get_rng('dataset', dataset_id)
+        identifier = self.get_identifier(dataset_id)
+        released = self.is_released(dataset_id)
+        create_time = self.get_date(rng)
+        last_update_time = create_time + datetime.timedelta(days=rng.randint(0, 365))
+
+        dataset = {'id': dataset_id, 'identifier': identifier, 'persistentUrl': 'https://doi.org/10.5072/' + identifier, 'protocol': 'doi', 'authority': '10.5072', 'publisher': self.installation_name}
+        if released:
+            dataset['publicationDate'] = last_update_time.strftime('%Y-%m-%d')
+
+        fields = [self.primitive('title', 'Synthetic dataset ' + str(dataset_id)),
+                  self.compound('author', [{'authorName': self.primitive('authorName', 'Last' + str(rng.randint(1, 9999)) + ', First'), 'authorAffiliation': self.primitive('authorAffiliation', 'University ' + str(rng.randint(1, 30)))} for i in range(rng.randint(1, 4))]),
+                  self.compound('datasetContact', [{'datasetContactName': self.primitive('datasetContactName', 'Last' + str(dataset_id) + ', First'), 'datasetContactEmail': self.primitive('datasetContactEmail', 'contact' + str(dataset_id) + '@example.edu')}]),
+                  self.compound('dsDescription', [{'dsDescriptionValue': self.primitive('dsDescriptionValue', 'Description of synthetic dataset ' + str(dataset_id) + '. ' * rng.randint(1, 20))}]),
+                  {'typeName': 'subject', 'multiple': True, 'typeClass': 'controlledVocabulary', 'value': rng.sample(['Agricultural Sciences', 'Arts and Humanities', 'Chemistry', 'Computer and Information Science', 'Earth and Environmental Sciences', 'Law', 'Medicine, Health and Life Sciences', 'Social Sciences', 'Other'], rng.randint(1, 3))},
+                  self.primitive('depositor', 'Last' + str(rng.randint(1, 9999)) + ', First'),
+                  self.primitive('dateOfDeposit', create_time.strftime('%Y-%m-%d'))]
+        if rng.random() < 0.3:
+            fields.insert(4, self.primitive('notesText', 'Notes for dataset ' + str(dataset_id)))
+
+        latest_version = {'id': 1000000 + dataset_id, 'datasetId': dataset_id, 'datasetPersistentId': 'doi:10.5072/' + identifier, 'storageIdentifier': 'file://10.5072/' + identifier,
+                          'versionState': 'RELEASED' if released else 'DRAFT', 'lastUpdateTime': last_update_time.strftime('%Y-%m-%dT%H:%M:%SZ'), 'createTime': create_time.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                          'license': {'name': 'CC0 1.0', 'uri': 'http://creativecommons.org/publicdomain/zero/1.0'},
+                          'metadataBlocks': {'citation': {'displayName': 'Citation Metadata', 'name': 'citation', 'fields': fields}}}
+        if released:
+            latest_version['releaseTime'] = last_update_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        if files:
+            latest_version['files'] = [{'label': 'file' + str(n) + '.csv', 'restricted': restricted, 'version': 1, 'datasetVersionId': latest_version['id'],
+                                        'dataFile': {'id': dataset_id * 100 + n, 'filename': 'file' + str(n) + '.csv', 'contentType': 'text/csv', 'filesize': size, 'storageIdentifier': 'file://' + format(dataset_id * 100 + n, 'x'), 'md5': format(size, '032x')}}
+                                       for n, (restricted, size) in enumerate(self.get_files(dataset_id))]
+
+        dataset['latestVersion'] = latest_version
+        return dataset
+
+    def primitive(self, type_name, value):
+        return {'typeName': type_name, 'multiple': False, 'typeClass': 'primitive', 'value': value}
+
+    def compound(self, type_name, values):
+        return {'typeName': type_name, 'multiple': True, 'typeClass': 'compound', 'value': values}
+
+    def get_metrics(self, dataset_id, month=None):
+        # viewsUnique, viewsTotal, downloadsUnique and downloadsTotal of a dataset, all time or for one month (YYYY-MM)
+        rng = self.get_rng('metrics', dataset_id, month)
+        if rng.random() < 0.3:
+            return {'viewsUnique': 0, 'viewsTotal': 0, 'downloadsUnique': 0, 'downloadsTotal': 0}
+
+        views_total = rng.randint(1, 50 if month else 500)
+        downloads_total = rng.randint(0, 20 if month else 200)
+        return {'viewsUnique': rng.randint(1, views_total), 'viewsTotal': views_total, 'downloadsUnique': rng.randint(0, downloads_total), 'downloadsTotal': downloads_total}
+
+    def get_download_count(self, dataset_id):
+        return self.get_rng('downloads', dataset_id).randint(0, 100)
+
+    def get_subtree(self, dataverse_id):
+        # dvobjects below a dataverse, parents before children and each dataverse's children in contents order, as (id, depth)
+        subtree = [(dataverse_id, 0)]
+        level = [dataverse_id]
+        depth = 1
+        while level:
+            child_ids = [child_id for owner_id in level for child_id in self.get_child_ids(owner_id)]
+            subtree.extend((child_id, depth) for child_id in child_ids)
+            level = [child_id for child_id in child_ids if child_id in self.aliases]
+            depth += 1
+        return subtree
+
+    def get_users_page(self, page):
+        page_count = max((self.user_count + self.users_per_page - 1) // self.users_per_page, 1)
+        start = (page - 1) * self.users_per_page
+        users = [self.get_user(index) for index in range(start, min(start + self.users_per_page, self.user_count))]
+        return {'userCount': self.user_count, 'selectedPage': page, 'pagination': {'pageNumber': page, 'pageCount': page_count, 'numResults': self.user_count}, 'users': users}
+
+    def get_sword_feed(self, dataverse_id):
+        # Atom feed of the collection: an entry per dataset, with the release status after the entries as Dataverse writes it
+        entries = []
+        for dataset_id in self.datasets[dataverse_id]:
+            identifier = self.get_identifier(dataset_id)
+            entries.append('<entry><id>https://localhost/dvn/api/data-deposit/v1.1/swordv2/edit/study/doi:10.5072/' + identifier + '</id>'
+                           '<link href="https://localhost/dvn/api/data-deposit/v1.1/swordv2/edit/study/doi:10.5072/' + identifier + '" rel="edit"/>'
+                           '<title type="text">Synthetic dataset ' + str(dataset_id) + '</title><content src="https://localhost/dvn/api/data-deposit/v1.1/swordv2/edit/study/doi:10.5072/' + identifier + '" type="application/xml"/></entry>')
+
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<feed xmlns="http://www.w3.org/2005/Atom"><id>https://localhost/dvn/api/data-deposit/v1.1/swordv2/collection/dataverse/' + self.aliases[dataverse_id] + '</id>'
+                '<title type="text">Dataverse ' + str(dataverse_id) + '</title>' + ''.join(entries) +
+                '<sword:dataverseHasBeenReleased xmlns:sword="http://purl.org/net/sword/terms/state">' + ('true' if self.is_released(dataverse_id) else 'false') + '</sword:dataverseHasBeenReleased>'
+                '</feed>').encode('utf-8')
@@ -0,0 +1,183 @@
+import re
+import json
+import time
+import threading
+import multiprocessing
+import urllib.request
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmark.repository import SyntheticRepository
+
+
+class MockDataverseRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so connection pooling in the API client is measured too
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body are written separately, which Nagle's algorithm would hold back on a kept-alive connection
+    disable_nagle_algorithm = True
+
+    routes = [('info', re.compile(r'/api/info/version/?$')),
+              ('contents', re.compile(r'/api/v1/dataverses/([^/]+)/contents/?$')),
+              ('storagesize', re.compile(r'/api/v1/dataverses/([^/]+)/storagesize/?$')),
+              ('dataverses', re.compile(r'/api/v1/dataverses/([^/]+)/?$')),
+              ('makeDataCount', re.compile(r'/api/v1/datasets/(\d+)/makeDataCount/([^/]+)(?:/([^/]+))?/?$')),
+              ('datasets', re.compile(r'/api/v1/datasets/(\d+)/?$')),
+              ('list-users', re.compile(r'/api/v1/admin/list-users/?$')),
+              ('sword', re.compile(r'/swordv2/collection/dataverse/([^/]+)/?$'))]
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+
+        if path == '/_benchmark/requests':
+            return self.send_json(self.server.get_request_counts())
+        if path == '/_benchmark/reset':
+            return self.send_json(self.server.reset_request_counts())
+
+        for endpoint, pattern in self.routes:
+            match = pattern.search(path)
+            if match is not None:
+                self.server.count_request(endpoint)
+                if self.server.latency > 0:
+                    time.sleep(self.server.latency)
+                return getattr(self, 'get_' + endpoint.replace('-', '_'))(match, query)
+
+        self.send_json({'status': 'ERROR', 'message': 'Endpoint not found.'}, status=404)
+
+    def get_info(self, match, query):
+        self.send_json({'status': 'OK', 'data': {'version': '5.12', 'build': 'synthetic'}})
+
+    def get_dataverse_id(self, match):
+        dataverse_id = self.server.repository.find_dataverse(match.group(1))
+        if dataverse_id is None:
+            self.send_json({'status': 'ERROR', 'message': "Can't find dataverse with identifier='" + match.group(1) + "'"}, status=404)
+        return dataverse_id
+
+    def get_dataverses(self, match, query):
+        dataverse_id = self.get_dataverse_id(match)
+        if dataverse_id is not None:
+            self.send_json({'status': 'OK', 'data': self.server.repository.get_dataverse(dataverse_id)})
+
+    def get_contents(self, match, query):
+        dataverse_id = self.get_dataverse_id(match)
+        if dataverse_id is not None:
+            self.send_json({'status': 'OK', 'data': self.server.repository.get_contents(dataverse_id)})
+
+    def get_storagesize(self, match, query):
+        dataverse_id = self.get_dataverse_id(match)
+        if dataverse_id is not None:
+            self.send_json({'status': 'OK', 'data': {'message': 'Total size of the files stored in this dataverse: ' + format(self.server.repository.subtree_sizes[dataverse_id], ',') + ' bytes'}})
+
+    def get_sword(self, match, query):
+        dataverse_id = self.server.repository.find_dataverse(match.group(1))
+        if dataverse_id is None:
+            return self.send_body(b'<error/>', 'application/xml', status=404)
+        self.send_body(self.server.repository.get_sword_feed(dataverse_id), 'application/atom+xml;type=feed;charset=UTF-8')
+
+    def get_datasets(self, match, query):
+        dataset_id = int(match.group(1))
+        if not self.server.repository.is_dataset(dataset_id):
+            return self.send_json({'status': 'ERROR', 'message': 'Dataset with ID ' + str(dataset_id) + ' not found.'}, status=404)
+        self.send_json({'status': 'OK', 'data': self.server.repository.get_dataset(dataset_id)})
+
+    def get_makeDataCount(self, match, query):
+        dataset_id = int(match.group(1))
+        option = match.group(2)
+        month = match.group(3)
+        if not self.server.repository.is_dataset(dataset_id):
+            return self.send_json({'status': 'ERROR', 'message': 'Dataset with ID ' + str(dataset_id) + ' not found.'}, status=404)
+
+        metrics = self.server.repository.get_metrics(dataset_id, month)
+        if option not in metrics:
+            return self.send_json({'status': 'ERROR', 'message': 'Unsupported metric: ' + option}, status=400)
+        if metrics['viewsTotal'] + metrics['downloadsTotal'] == 0:
+            return self.send_json({'status': 'ERROR', 'message': 'No metrics available for dataset ' + str(dataset_id)}, status=404)
+        self.send_json({'status': 'OK', 'data': {option: metrics[option]}})
+
+    def get_list_users(self, match, query):
+        match = re.search(r'selectedPage=(\d+)', query)
+        page = int(match.group(1)) if match is not None else 1
+        self.send_json({'status': 'OK', 'data': self.server.repository.get_users_page(page)})
+
+    def send_json(self, data, status=200):
+        self.send_body(json.dumps(data).encode('utf-8'), 'application/json', status=status)
+
+    def send_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockDataverseHTTPServer(ThreadingHTTPServer):
+    # Room for the connections of many concurrent workers and the async client's request budget
+    request_queue_size = 1024
+    daemon_threads = True
+
+    def __init__(self, address, repository=None, latency=0.0):
+        ThreadingHTTPServer.__init__(self, address, MockDataverseRequestHandler)
+        self.repository = repository
+        self.latency = latency
+        self.request_counts = {}
+        self.lock = threading.Lock()
+
+    def count_request(self, endpoint):
+        with self.lock:
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+    def get_request_counts(self):
+        with self.lock:
+            return dict(self.request_counts)
+
+    def reset_request_counts(self):
+        with self.lock:
+            request_counts = self.request_counts
+            self.request_counts = {}
+        return request_counts
+
+
+def serve(repository_options, latency, host, port, connection):
+    # Runs in its own process, so serving requests does not compete with the reports for the GIL
+    server = MockDataverseHTTPServer((host, port), repository=SyntheticRepository(**repository_options), latency=latency)
+    connection.send(server.server_address[1])
+    connection.close()
+    server.serve_forever()
+
+
+class MockDataverseServer(object):
+    def __init__(self, repository_options={}, latency=0.0, host='127.0.0.1', port=0):
+        self.repository_options = repository_options
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.process = None
+
+    def start(self):
+        parent_connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve, args=(self.repository_options, self.latency, self.host, self.port, child_connection), daemon=True)
+        self.process.start()
+        self.port = parent_connection.recv()
+        parent_connection.close()
+        return self.get_url()
+
+    def get_url(self):
+        return 'http://' + self.host + ':' + str(self.port)
+
+    def get_request_counts(self):
+        with urllib.request.urlopen(self.get_url() + '/_benchmark/requests') as response:
+            return json.loads(response.read())
+
+    def reset_request_counts(self):
+        # Returns the counts since the last reset
+        with urllib.request.urlopen(self.get_url() + '/_benchmark/reset') as response:
+            return json.loads(response.read())
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
@@ -0,0 +1,48 @@
+import sys
+from optparse import OptionParser
+
+from lib.outbox import Outbox, OutboxDelivery
+
+from run import load_config, load_logger
+
+
+def main():
+    parser = OptionParser()
+
+    parser.add_option("-c", "--config", dest="config_file", default="config/application.yml", help="Configuration file")
+    parser.add_option("-w", "--workers", type="int", dest="workers", help="Number of emails to send at the same time.")
+    parser.add_option("--once", action="store_true", dest="once", default=False, help="Send the emails that are due and exit instead of waiting to retry failed ones?")
+
+    (options, args) = parser.parse_args()
+
+    if options.workers is not None and options.workers < 1:
+        parser.print_help()
+        parser.error("Number of workers must be at least 1.")
+
+    # Load config
+    print("Loading configuration from file: %s", options.config_file)
+    config = load_config(options.config_file)
+    if not config:
+        print("Unable to load configuration.")
+        sys.exit(0)
+
+    # Set up logging
+    logger = load_logger(config=config)
+
+    # Ensure work_dir has trailing slash
+    work_dir = config['work_dir']
+    if work_dir[len(work_dir)-1] != '/':
+        work_dir = work_dir + '/'
+
+    # Drain the outbox that run.py queued report emails in
+    outbox = Outbox(path=work_dir + 'dataverse-reports-outbox.sqlite')
+    delivery = OutboxDelivery(outbox=outbox, config=config, workers=options.workers or config.get('email_outbox_workers', 4), max_attempts=config.get('email_outbox_max_attempts', 5), retry_delay=config.get('email_outbox_retry_delay', 60))
+    results = delivery.deliver(wait=not options.once)
+    outbox.close()
+
+    logger.info("Finished delivering emails.")
+    if results['failed'] > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
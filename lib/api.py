@@ -1,11 +1,20 @@
+import io
+import json
 import requests
 import logging
 
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from xml.etree import ElementTree
 
+from lib.cache import LRUCache
+
+# Element of a SWORD collection feed that tells whether the dataverse has been released
+SWORD_RELEASED_TAG = '{http://purl.org/net/sword/terms/state}dataverseHasBeenReleased'
+
+
 class DataverseApi(object):
-    def __init__(self, host=None, token=None):
+    def __init__(self, host=None, token=None, pool_size=10, connect_timeout=10, read_timeout=300, cache_size=1000, response_cache=None):
         if host[len(host)-1] != '/':
             self.host = host + '/'
         else:
@@ -20,10 +29,71 @@ class DataverseApi(object):
 
         self.headers = {'X-Dataverse-key': self.token}
 
+        # Share one keep-alive session (and its connection pool) across all API calls
+        self.timeout = (connect_timeout, read_timeout)
+        self.logger.debug("Setting Dataverse API pool size %s and timeouts %s.", str(pool_size), str(self.timeout))
+        self.session = requests.Session()
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+        for prefix in ['http://', 'https://']:
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            adapter.poolmanager.pools.dispose_func = self.get_pool_dispose_func(adapter.poolmanager.pools.dispose_func)
+            self.session.mount(prefix, adapter)
+
+        # Connections opened and requests sent by the pools of hosts evicted from the session's pool managers
+        self.evicted_pool_stats = {'opened': 0, 'requests': 0}
+
+        # Dataverse metadata is looked up repeatedly (e.g. for each dataset's alias), so keep recent responses
+        self.dataverse_cache = LRUCache(name='dataverses', maxsize=cache_size)
+
+        # Optional on-disk cache of responses shared between runs
+        self.response_cache = response_cache
+
+    def get(self, url, endpoint=None, headers=None, auth=None):
+        if self.response_cache is None or not self.response_cache.is_cached_endpoint(endpoint):
+            return self.session.get(url, headers=headers, auth=auth, timeout=self.timeout)
+
+        # Serve fresh cached responses, otherwise revalidate with ETag/Last-Modified when possible
+        conditional_headers = dict(headers or {})
+        cached = self.response_cache.get(url)
+        if cached is not None:
+            status, content, etag, last_modified, expired = cached
+            if not expired:
+                self.logger.debug("Using cached response: %s", url)
+                return self.build_response(url, status, content)
+            if etag:
+                conditional_headers['If-None-Match'] = etag
+            if last_modified:
+                conditional_headers['If-Modified-Since'] = last_modified
+
+        response = self.session.get(url, headers=conditional_headers, auth=auth, timeout=self.timeout)
+        if response.status_code == 304 and cached is not None:
+            self.logger.debug("Cached response not modified: %s", url)
+            self.response_cache.touch(url, self.get_cache_endpoint(endpoint, cached[1]))
+            return self.build_response(url, cached[0], cached[1])
+
+        if response.status_code == 200:
+            self.response_cache.put(url, self.get_cache_endpoint(endpoint, response.content), response.status_code, response.content, etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'))
+        return response
+
+    def get_cache_endpoint(self, endpoint, content):
+        # Draft dataset versions can change at any time, so they get their own TTL
+        if endpoint == 'datasets':
+            response_json = json.loads(content)
+            if 'data' in response_json and response_json['data'].get('latestVersion', {}).get('versionState') != 'RELEASED':
+                return 'datasets-draft'
+        return endpoint
+
+    def build_response(self, url, status, content):
+        response = requests.Response()
+        response.url = url
+        response.status_code = status
+        response._content = content
+        return response
+
     def test_connection(self):
         url = self.host + 'api/info/version/'
         self.logger.debug("Testing API connection: %s.", url)
-        response = requests.get(url)
+        response = self.session.get(url, timeout=self.timeout)
         if response.status_code == 200:
             return True
         else:
@@ -40,7 +110,7 @@ class DataverseApi(object):
             url = self.host + 'api/' + self.version + '/search?q=' + term
 
         self.logger.debug("Searching Dataverse: %s.", url)
-        response = requests.get(url)
+        response = self.session.get(url, timeout=self.timeout)
         self.logger.debug("Return status: %s", str(response.status_code))
         return response
 
@@ -49,12 +119,31 @@ class DataverseApi(object):
             self.logger.error("Must specify identifer.")
             return
 
+        response = self.dataverse_cache.get(str(identifier))
+        if response is not None:
+            self.logger.debug("Retrieving cached dataverse: %s.", identifier)
+            return response
+
         url = self.host + 'api/' + self.version + '/dataverses/' + str(identifier)
         self.logger.debug("Retrieving dataverse: %s.", url)
-        response = requests.get(url, headers=self.headers)
+        response = self.get(url, endpoint='dataverses', headers=self.headers)
         self.logger.debug("Return status: %s.", str(response.status_code))
+        if response.status_code == 200:
+            self.cache_dataverse(identifier, response)
         return response
 
+    def cache_dataverse(self, identifier, response):
+        # Cache under the requested identifier as well as the dataverse's id and alias
+        keys = [str(identifier)]
+        response_json = response.json()
+        if 'data' in response_json:
+            dataverse = response_json['data']
+            if 'id' in dataverse:
+                keys.append(str(dataverse['id']))
+            if 'alias' in dataverse:
+                keys.append(dataverse['alias'])
+        self.dataverse_cache.put(keys, response)
+
     def get_dataverse_contents(self, identifier=''):
         if identifier is None:
             self.logger.error("Must specify identifer.")
@@ -62,7 +151,7 @@ class DataverseApi(object):
 
         url = self.host + 'api/' + self.version + '/dataverses/' + str(identifier) + '/contents'
         self.logger.debug("Retrieving dataverse contents: %s", url)
-        response = requests.get(url, headers=self.headers)
+        response = self.get(url, endpoint='contents', headers=self.headers)
         self.logger.debug("Return status: %s", str(response.status_code))
 
         response_json = response.json()
@@ -77,7 +166,7 @@ class DataverseApi(object):
         if includeCached is True:
             url += '?includeCache=true'
         self.logger.debug("Retrieving dataverse storage size: %s", url)
-        response = requests.get(url, headers=self.headers)
+        response = self.get(url, endpoint='storagesize', headers=self.headers)
         self.logger.debug("Return status: %s", str(response.status_code))
         return response
 
@@ -88,12 +177,53 @@ class DataverseApi(object):
 
         url = self.host + '/dvn/api/data-deposit/' + self.version + '/swordv2/collection/dataverse/' + alias
         self.logger.debug("Retrieving SWORD dataverse: %s", url)
-        response = requests.get(url, auth=HTTPBasicAuth(self.token, ''))
+        response = self.get(url, endpoint='sword', auth=HTTPBasicAuth(self.token, ''))
         self.logger.debug("Return status: %s", str(response.status_code))
 
         tree = ElementTree.fromstring(response.content)
         return tree
 
+    def sword_get_dataverse_released(self, alias=''):
+        if alias is None:
+            self.logger.error("Must specify an alias.")
+            return
+
+        # Stream the feed instead of loading it whole; Dataverse writes dataverseHasBeenReleased after the dataset entries,
+        # so the whole feed is still read and parsed, but only one entry at a time is kept in memory
+        url = self.host + '/dvn/api/data-deposit/' + self.version + '/swordv2/collection/dataverse/' + alias
+        self.logger.debug("Retrieving SWORD dataverse release status: %s", url)
+        if self.response_cache is not None and self.response_cache.is_cached_endpoint('sword'):
+            response = self.get(url, endpoint='sword', auth=HTTPBasicAuth(self.token, ''))
+            self.logger.debug("Return status: %s", str(response.status_code))
+            return self.find_sword_released(io.BytesIO(response.content))
+
+        response = self.session.get(url, auth=HTTPBasicAuth(self.token, ''), timeout=self.timeout, stream=True)
+        self.logger.debug("Return status: %s", str(response.status_code))
+        try:
+            response.raw.decode_content = True
+            return self.find_sword_released(response.raw)
+        finally:
+            response.close()
+
+    def find_sword_released(self, source):
+        # Text of the dataverseHasBeenReleased element ('true' or 'false'), or None if the feed has none
+        root = None
+        depth = 0
+        for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = element
+                depth += 1
+                continue
+
+            depth -= 1
+            if element.tag == SWORD_RELEASED_TAG:
+                return element.text
+
+            # Dataset entries are not needed, so drop each child of the feed once it has been parsed
+            if depth == 1:
+                root.clear()
+
     def get_dataset(self, identifier=''):
         if identifier is None:
             self.logger.error("Must specify an identifer.")
@@ -101,7 +231,7 @@ class DataverseApi(object):
 
         url = self.host + 'api/' + self.version + '/datasets/' + str(identifier)
         self.logger.debug("Retrieving dataset: %s", url)
-        response = requests.get(url, headers=self.headers)
+        response = self.get(url, endpoint='datasets', headers=self.headers)
         self.logger.debug("Return status: %s", str(response.status_code))
         return response
 
@@ -117,14 +247,14 @@ class DataverseApi(object):
             url = self.host + 'api/' + self.version + '/datasets/' + str(identifier) + '/makeDataCount/' + str(option) + '?persistentId=' + doi
 
         self.logger.debug("Retrieving dataset_metric: %s", url)
-        response = requests.get(url, headers=self.headers)
+        response = self.get(url, endpoint='makeDataCount', headers=self.headers)
         self.logger.debug("Return status: %s", str(response.status_code))        
         return response
 
     def get_admin_list_users(self, page=1):
         url = self.host + 'api/' + self.version + '/admin/list-users/?selectedPage=' + str(page)
         self.logger.debug("Retrieving users list: %s", url)
-        response = requests.get(url, headers=self.headers)
+        response = self.get(url, endpoint='list-users', headers=self.headers)
         self.logger.debug("Return status: %s", str(response.status_code))
         return response.json()
 
@@ -143,14 +273,45 @@ class DataverseApi(object):
 
     def make_call(self, type='GET', url=''):
         if type == 'GET':
-            r = requests.get(url, headers=self.headers)
+            r = self.session.get(url, headers=self.headers, timeout=self.timeout)
         elif type == 'POST':
-            r = requests.put(url, headers=self.headers)
+            r = self.session.put(url, headers=self.headers, timeout=self.timeout)
         else:
-            r = requests.get(url, headers=self.headers)
+            r = self.session.get(url, headers=self.headers, timeout=self.timeout)
 
         return r.json
 
     def set_token(self, new_token=''):
         if new_token:
             self.token = new_token
+
+    def get_pool_dispose_func(self, dispose_func):
+        # Pool managers only keep the pools of the most recently used hosts, so tally a pool's counts before it is dropped
+        def dispose(pool):
+            self.evicted_pool_stats['opened'] += pool.num_connections
+            self.evicted_pool_stats['requests'] += pool.num_requests
+            if dispose_func is not None:
+                dispose_func(pool)
+
+        return dispose
+
+    def get_connection_stats(self):
+        # Tally connections opened and requests sent by every pool in the session, including the evicted ones
+        stats = {'opened': self.evicted_pool_stats['opened'], 'reused': 0, 'requests': self.evicted_pool_stats['requests']}
+        for adapter in self.session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                stats['opened'] += pool.num_connections
+                stats['requests'] += pool.num_requests
+
+        stats['reused'] = max(stats['requests'] - stats['opened'], 0)
+        return stats
+
+    def close(self):
+        stats = self.get_connection_stats()
+        self.logger.info("Dataverse API connections opened: %s, reused: %s (%s requests).", str(stats['opened']), str(stats['reused']), str(stats['requests']))
+        self.dataverse_cache.log_stats()
+        if self.response_cache is not None:
+            self.response_cache.close()
+        self.session.close()
@@ -0,0 +1,194 @@
+import json
+import asyncio
+import logging
+import aiohttp
+
+from xml.etree import ElementTree
+
+from lib.api import SWORD_RELEASED_TAG
+from lib.cache import LRUCache
+
+
+class AsyncResponse(object):
+    # Body of an aiohttp response read into memory, with the parts of requests.Response the reports use
+    def __init__(self, status_code=None, content=b'', headers={}):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncDataverseApi(object):
+    def __init__(self, host=None, token=None, max_requests=100, connect_timeout=10, read_timeout=300, cache_size=1000):
+        if host[len(host)-1] != '/':
+            self.host = host + '/'
+        else:
+            self.host = host
+
+        self.token = token
+        self.version = 'v1'
+        self.max_requests = max_requests
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        self.logger = logging.getLogger('dataverse-reports')
+        self.logger.debug("Setting async Dataverse API host  %s.", self.host)
+        self.logger.debug("Setting async Dataverse API request budget %s.", str(self.max_requests))
+
+        self.headers = {'X-Dataverse-key': self.token}
+        self.dataverse_cache = LRUCache(name='async dataverses', maxsize=cache_size)
+
+        # Created in open() so they belong to the running event loop
+        self.session = None
+        self.semaphore = None
+
+    async def open(self):
+        timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+        connector = aiohttp.TCPConnector(limit=self.max_requests)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        self.semaphore = asyncio.Semaphore(self.max_requests)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        self.dataverse_cache.log_stats()
+
+    async def get(self, url, headers=None, auth=None):
+        # Never keep more than max_requests requests in flight
+        async with self.semaphore:
+            async with self.session.get(url, headers=headers, auth=auth) as response:
+                content = await response.read()
+                return AsyncResponse(status_code=response.status, content=content, headers=response.headers)
+
+    async def test_connection(self):
+        url = self.host + 'api/info/version/'
+        self.logger.debug("Testing API connection: %s.", url)
+        response = await self.get(url)
+        if response.status_code == 200:
+            return True
+        else:
+            return False
+
+    async def get_dataverse(self, identifier=''):
+        if identifier is None:
+            self.logger.error("Must specify identifer.")
+            return
+
+        response = self.dataverse_cache.get(str(identifier))
+        if response is not None:
+            self.logger.debug("Retrieving cached dataverse: %s.", identifier)
+            return response
+
+        url = self.host + 'api/' + self.version + '/dataverses/' + str(identifier)
+        self.logger.debug("Retrieving dataverse: %s.", url)
+        response = await self.get(url, headers=self.headers)
+        self.logger.debug("Return status: %s.", str(response.status_code))
+        if response.status_code == 200:
+            self.cache_dataverse(identifier, response)
+        return response
+
+    def cache_dataverse(self, identifier, response):
+        # Cache under the requested identifier as well as the dataverse's id and alias
+        keys = [str(identifier)]
+        response_json = response.json()
+        if 'data' in response_json:
+            dataverse = response_json['data']
+            if 'id' in dataverse:
+                keys.append(str(dataverse['id']))
+            if 'alias' in dataverse:
+                keys.append(dataverse['alias'])
+        self.dataverse_cache.put(keys, response)
+
+    async def get_dataverse_contents(self, identifier=''):
+        if identifier is None:
+            self.logger.error("Must specify identifer.")
+            return
+
+        url = self.host + 'api/' + self.version + '/dataverses/' + str(identifier) + '/contents'
+        self.logger.debug("Retrieving dataverse contents: %s", url)
+        response = await self.get(url, headers=self.headers)
+        self.logger.debug("Return status: %s", str(response.status_code))
+
+        response_json = response.json()
+        return response_json['data']
+
+    async def get_dataverse_size(self, identifier='', includeCached=False):
+        if identifier is None:
+            self.logger.error("Must specify identifer.")
+            return
+
+        url = self.host + 'api/' + self.version + '/dataverses/' + str(identifier) + '/storagesize'
+        if includeCached is True:
+            url += '?includeCache=true'
+        self.logger.debug("Retrieving dataverse storage size: %s", url)
+        response = await self.get(url, headers=self.headers)
+        self.logger.debug("Return status: %s", str(response.status_code))
+        return response
+
+    async def sword_get_dataverse(self, alias=''):
+        if alias is None:
+            self.logger.error("Must specify an alias.")
+            return
+
+        url = self.host + '/dvn/api/data-deposit/' + self.version + '/swordv2/collection/dataverse/' + alias
+        self.logger.debug("Retrieving SWORD dataverse: %s", url)
+        response = await self.get(url, auth=aiohttp.BasicAuth(self.token, ''))
+        self.logger.debug("Return status: %s", str(response.status_code))
+
+        tree = ElementTree.fromstring(response.content)
+        return tree
+
+    async def sword_get_dataverse_released(self, alias=''):
+        if alias is None:
+            self.logger.error("Must specify an alias.")
+            return
+
+        # Feed the body to a pull parser chunk by chunk and stop reading at dataverseHasBeenReleased
+        url = self.host + '/dvn/api/data-deposit/' + self.version + '/swordv2/collection/dataverse/' + alias
+        self.logger.debug("Retrieving SWORD dataverse release status: %s", url)
+        async with self.semaphore:
+            async with self.session.get(url, auth=aiohttp.BasicAuth(self.token, '')) as response:
+                self.logger.debug("Return status: %s", str(response.status))
+                parser = ElementTree.XMLPullParser(events=('end',))
+                async for chunk in response.content.iter_chunked(65536):
+                    parser.feed(chunk)
+                    for event, element in parser.read_events():
+                        if element.tag == SWORD_RELEASED_TAG:
+                            return element.text
+
+    async def get_dataset(self, identifier=''):
+        if identifier is None:
+            self.logger.error("Must specify an identifer.")
+            return
+
+        url = self.host + 'api/' + self.version + '/datasets/' + str(identifier)
+        self.logger.debug("Retrieving dataset: %s", url)
+        response = await self.get(url, headers=self.headers)
+        self.logger.debug("Return status: %s", str(response.status_code))
+        return response
+
+    async def get_dataset_metric(self, identifier='', option='', doi='', date=None):
+        if identifier is None or option is None or doi is None:
+            self.logger.error("Must specify an identifer, option and DOI.")
+            return
+
+        # Include date parameter if specified
+        if date is not None:
+            url = self.host + 'api/' + self.version + '/datasets/' + str(identifier) + '/makeDataCount/' + str(option) + '/' + date + '?persistentId=' + doi
+        else:
+            url = self.host + 'api/' + self.version + '/datasets/' + str(identifier) + '/makeDataCount/' + str(option) + '?persistentId=' + doi
+
+        self.logger.debug("Retrieving dataset_metric: %s", url)
+        response = await self.get(url, headers=self.headers)
+        self.logger.debug("Return status: %s", str(response.status_code))
+        return response
+
+    async def get_admin_list_users(self, page=1):
+        url = self.host + 'api/' + self.version + '/admin/list-users/?selectedPage=' + str(page)
+        self.logger.debug("Retrieving users list: %s", url)
+        response = await self.get(url, headers=self.headers)
+        self.logger.debug("Return status: %s", str(response.status_code))
+        return response.json()
@@ -0,0 +1,137 @@
+import time
+import sqlite3
+import logging
+import datetime
+import threading
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    # Holds up to maxsize values; a value stored under several keys counts once
+    def __init__(self, name='cache', maxsize=1000):
+        self.name = name
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        # Entries are (keys, value) in least recently used order, found through any of their keys
+        self.entries = OrderedDict()
+        self.keys = {}
+        self.lock = threading.Lock()
+
+        self.logger = logging.getLogger('dataverse-reports')
+
+    def get(self, key):
+        with self.lock:
+            if key in self.keys:
+                entry_id = self.keys[key]
+                self.entries.move_to_end(entry_id)
+                self.hits += 1
+                return self.entries[entry_id][1]
+
+            self.misses += 1
+            return None
+
+    def put(self, keys=[], value=None):
+        # Store one value under several keys (e.g. a dataverse id and its alias)
+        if self.maxsize <= 0 or len(keys) == 0:
+            return
+
+        with self.lock:
+            # Drop the entries the keys pointed to, so none of their keys is left on an old value
+            keys = list(dict.fromkeys(keys))
+            for key in keys:
+                if key in self.keys:
+                    self.remove_entry(self.keys[key])
+
+            entry_id = keys[0]
+            self.entries[entry_id] = (keys, value)
+            for key in keys:
+                self.keys[key] = entry_id
+
+            while len(self.entries) > self.maxsize:
+                self.remove_entry(next(iter(self.entries)))
+
+    def remove_entry(self, entry_id):
+        entry_keys, value = self.entries.pop(entry_id)
+        for key in entry_keys:
+            if self.keys.get(key) == entry_id:
+                del self.keys[key]
+
+    def log_stats(self):
+        self.logger.info("Cache %s hits: %s, misses: %s.", self.name, str(self.hits), str(self.misses))
+
+
+class ResponseCache(object):
+    def __init__(self, path=None, ttls={}):
+        self.path = path
+        self.ttls = ttls
+        self.hits = 0
+        self.expired = 0
+        self.revalidated = 0
+        self.misses = 0
+
+        self.logger = logging.getLogger('dataverse-reports')
+        self.logger.info("Using API response cache: %s.", self.path)
+
+        # Report workers share one connection, so serialize access with a lock
+        self.lock = threading.Lock()
+        # Account worker processes share the file, so wait for each other's writes
+        self.conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, endpoint TEXT, status INTEGER, content BLOB, etag TEXT, last_modified TEXT, expires_at REAL)")
+        self.conn.commit()
+
+    def is_cached_endpoint(self, endpoint):
+        return endpoint in self.ttls
+
+    def get(self, url):
+        # Returns (status, content, etag, last_modified, expired) or None
+        with self.lock:
+            row = self.conn.execute("SELECT status, content, etag, last_modified, expires_at FROM responses WHERE url = ?", [url]).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            status, content, etag, last_modified, expires_at = row
+            expired = time.time() >= expires_at
+            if expired:
+                self.expired += 1
+            else:
+                self.hits += 1
+
+        return status, content, etag, last_modified, expired
+
+    def put(self, url, endpoint, status, content, etag=None, last_modified=None):
+        expires_at = self.get_expiry(endpoint)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses (url, endpoint, status, content, etag, last_modified, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?)", [url, endpoint, status, content, etag, last_modified, expires_at])
+            self.conn.commit()
+
+    def touch(self, url, endpoint):
+        # Response was revalidated (304 Not Modified), so start a new TTL
+        with self.lock:
+            self.revalidated += 1
+            self.conn.execute("UPDATE responses SET expires_at = ? WHERE url = ?", [self.get_expiry(endpoint), url])
+            self.conn.commit()
+
+    def get_expiry(self, endpoint):
+        ttl = self.ttls.get(endpoint, 0)
+        if ttl == 'month':
+            # Monthly metrics only change once the month rolls over
+            now = datetime.datetime.now()
+            next_month = (now.replace(day=1) + datetime.timedelta(days=32)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            return next_month.timestamp()
+
+        return time.time() + int(ttl)
+
+    def log_stats(self):
+        self.logger.info("API response cache hits: %s, expired: %s (revalidated: %s), misses: %s.", str(self.hits), str(self.expired), str(self.revalidated), str(self.misses))
+
+    def close(self):
+        self.log_stats()
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class DataverseNode(object):
+    def __init__(self, identifier=None, parent=None, depth=0):
+        self.identifier = identifier
+        self.parent = parent
+        self.depth = depth
+
+        # Filled in by the crawler
+        self.dataverse = None
+        self.contents = []
+        self.children = []
+
+
+class DataverseCrawler(object):
+    def __init__(self, dataverse_api=None, workers=1, dataverse_database=None):
+        if dataverse_api is None:
+            print('Dataverse API required to crawl dataverses.')
+            return
+
+        self.dataverse_api = dataverse_api
+
+        # When set, the tree comes from the dvobject table and the API is only used for dataverse metadata
+        self.dataverse_database = dataverse_database
+        self.workers = max(int(workers), 1)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        self.logger = logging.getLogger('dataverse-reports')
+
+    def crawl(self, dataverse_identifier):
+        if self.dataverse_database is not None:
+            return self.crawl_database(dataverse_identifier)
+
+        # Explore the tree breadth-first, keeping up to self.workers nodes in flight
+        self.logger.info("Begin crawling dataverse tree for %s with %s worker(s).", dataverse_identifier, str(self.workers))
+        root = DataverseNode(identifier=dataverse_identifier)
+        pending = {self.executor.submit(self.load_node, root)}
+        total_nodes = 0
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = future.result()
+                total_nodes += 1
+                for dvObject in node.contents:
+                    if dvObject['type'] == 'dataverse':
+                        self.logger.info("Found new dataverse %s.", str(dvObject['id']))
+                        child = DataverseNode(identifier=dvObject['id'], parent=node, depth=node.depth + 1)
+                        node.children.append(child)
+                        pending.add(self.executor.submit(self.load_node, child))
+
+        self.logger.info("Finished crawling %s dataverses for %s.", str(total_nodes), dataverse_identifier)
+
+        # Children were attached in contents order, so a pre-order walk is deterministic
+        return self.walk(root)
+
+    def load_node(self, node):
+        self.logger.info("Loading dataverse: %s.", node.identifier)
+        dataverse_response = self.dataverse_api.get_dataverse(identifier=node.identifier)
+        response_json = dataverse_response.json()
+        if 'data' in response_json:
+            node.dataverse = response_json['data']
+            self.logger.info("Dataverse name: %s", node.dataverse['name'])
+
+            # Retrieve dvObjects for this dataverse
+            node.contents = self.dataverse_api.get_dataverse_contents(identifier=node.identifier)
+            self.logger.info('Total dvObjects in this dataverse: ' + str(len(node.contents)))
+        else:
+            self.logger.warn("Dataverse was empty.")
+
+        return node
+
+    def crawl_database(self, dataverse_identifier):
+        self.logger.info("Begin resolving dataverse tree for %s from the database.", dataverse_identifier)
+        nodes = self.build_database_tree(dataverse_identifier)
+        if len(nodes) == 0:
+            self.logger.warn("Dataverse %s not found in the database.", dataverse_identifier)
+            return [DataverseNode(identifier=dataverse_identifier)]
+
+        # Enrich each dataverse with its API metadata
+        self.map(self.load_node_metadata, nodes)
+
+        self.logger.info("Finished resolving %s dataverses for %s.", str(len(nodes)), dataverse_identifier)
+        return nodes
+
+    def build_database_tree(self, dataverse_identifier):
+        # Build the same node tree as an API crawl from one recursive dvobject query
+        subtree = self.dataverse_database.get_subtree(dataverse_identifier=dataverse_identifier)
+        if len(subtree) == 0:
+            return []
+
+        root = DataverseNode(identifier=dataverse_identifier)
+        nodes_by_id = {subtree[0]['id']: root}
+        for dvObject in subtree[1:]:
+            parent = nodes_by_id[dvObject['ownerId']]
+            parent.contents.append(dvObject)
+            if dvObject['type'] == 'dataverse':
+                child = DataverseNode(identifier=dvObject['id'], parent=parent, depth=dvObject['depth'])
+                parent.children.append(child)
+                nodes_by_id[dvObject['id']] = child
+
+        return self.walk(root)
+
+    def load_node_metadata(self, node):
+        self.logger.info("Loading dataverse: %s.", node.identifier)
+        dataverse_response = self.dataverse_api.get_dataverse(identifier=node.identifier)
+        response_json = dataverse_response.json()
+        if 'data' in response_json:
+            node.dataverse = response_json['data']
+            self.logger.info("Dataverse name: %s", node.dataverse['name'])
+        else:
+            self.logger.warn("Dataverse was empty.")
+
+        return node
+
+    def walk(self, root):
+        # Depth-first pre-order list of nodes, matching the order of the old recursive walkers
+        nodes = []
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(reversed(node.children))
+
+        return nodes
+
+    def walk_datasets(self, node):
+        # Yield (node, dvObject) for each dataset in the order a recursive walk of the contents would visit it
+        children = iter(node.children)
+        for dvObject in node.contents:
+            if dvObject['type'] == 'dataset':
+                yield node, dvObject
+            elif dvObject['type'] == 'dataverse':
+                yield from self.walk_datasets(next(children))
+
+    def map(self, function, items):
+        # Apply function to each item on the worker pool, returning results in input order
+        return list(self.executor.map(function, items))
+
+    def batches(self, items, batch_size=1000):
+        # Consecutive slices of items, so reports can build and hand off rows a batch at a time
+        batch_size = max(int(batch_size), 1)
+        for start in range(0, len(items), batch_size):
+            yield items[start:start + batch_size]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class AsyncDataverseCrawler(DataverseCrawler):
+    def __init__(self, dataverse_api=None, dataverse_database=None):
+        if dataverse_api is None:
+            print('Async Dataverse API required to crawl dataverses.')
+            return
+
+        # Concurrency is bounded by the API's request budget rather than a thread pool
+        self.dataverse_api = dataverse_api
+        self.dataverse_database = dataverse_database
+        self.workers = dataverse_api.max_requests
+
+        self.logger = logging.getLogger('dataverse-reports')
+
+    async def crawl(self, dataverse_identifier):
+        if self.dataverse_database is not None:
+            return await self.crawl_database(dataverse_identifier)
+
+        self.logger.info("Begin crawling dataverse tree for %s asynchronously.", dataverse_identifier)
+        root = DataverseNode(identifier=dataverse_identifier)
+        await self.crawl_node(root)
+
+        nodes = self.walk(root)
+        self.logger.info("Finished crawling %s dataverses for %s.", str(len(nodes)), dataverse_identifier)
+        return nodes
+
+    async def crawl_node(self, node):
+        # Children are awaited as soon as their parent is loaded; the API semaphore caps requests in flight
+        await self.load_node(node)
+        for dvObject in node.contents:
+            if dvObject['type'] == 'dataverse':
+                self.logger.info("Found new dataverse %s.", str(dvObject['id']))
+                node.children.append(DataverseNode(identifier=dvObject['id'], parent=node, depth=node.depth + 1))
+
+        await self.map(self.crawl_node, node.children)
+
+    async def load_node(self, node):
+        self.logger.info("Loading dataverse: %s.", node.identifier)
+        dataverse_response = await self.dataverse_api.get_dataverse(identifier=node.identifier)
+        response_json = dataverse_response.json()
+        if 'data' in response_json:
+            node.dataverse = response_json['data']
+            self.logger.info("Dataverse name: %s", node.dataverse['name'])
+
+            # Retrieve dvObjects for this dataverse
+            node.contents = await self.dataverse_api.get_dataverse_contents(identifier=node.identifier)
+            self.logger.info('Total dvObjects in this dataverse: ' + str(len(node.contents)))
+        else:
+            self.logger.warn("Dataverse was empty.")
+
+        return node
+
+    async def crawl_database(self, dataverse_identifier):
+        self.logger.info("Begin resolving dataverse tree for %s from the database.", dataverse_identifier)
+        nodes = self.build_database_tree(dataverse_identifier)
+        if len(nodes) == 0:
+            self.logger.warn("Dataverse %s not found in the database.", dataverse_identifier)
+            return [DataverseNode(identifier=dataverse_identifier)]
+
+        # Enrich each dataverse with its API metadata
+        await self.map(self.load_node_metadata, nodes)
+
+        self.logger.info("Finished resolving %s dataverses for %s.", str(len(nodes)), dataverse_identifier)
+        return nodes
+
+    async def load_node_metadata(self, node):
+        self.logger.info("Loading dataverse: %s.", node.identifier)
+        dataverse_response = await self.dataverse_api.get_dataverse(identifier=node.identifier)
+        response_json = dataverse_response.json()
+        if 'data' in response_json:
+            node.dataverse = response_json['data']
+            self.logger.info("Dataverse name: %s", node.dataverse['name'])
+        else:
+            self.logger.warn("Dataverse was empty.")
+
+        return node
+
+    async def map(self, function, items):
+        # Await function on every item concurrently, returning results in input order
+        return await asyncio.gather(*[function(item) for item in items])
+
+    def close(self):
+        pass
@@ -33,5 +33,253 @@ class DataverseDatabase(object):
         cursor = self.conn.cursor()
         cursor.execute("SELECT COUNT(g.id) FROM guestbookresponse g LEFT JOIN filedownload f on g.id = f.guestbookresponse_id WHERE g.dataset_id = %s;", [str(dataset_id)])
         result = cursor.fetchone()
+        cursor.close()
         count = result[0]
         return count
+
+    def get_download_counts(self, dataset_ids=[]):
+        # Download counts for many datasets from one grouped query: {dataset_id: count}
+        counts = {}
+        if len(dataset_ids) == 0:
+            return counts
+
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT g.dataset_id, COUNT(g.id) FROM guestbookresponse g LEFT JOIN filedownload f on g.id = f.guestbookresponse_id WHERE g.dataset_id = ANY(%s) GROUP BY g.dataset_id;", [list(dataset_ids)])
+        for dataset_id, count in cursor.fetchall():
+            counts[dataset_id] = count
+        cursor.close()
+
+        # Datasets without guestbook responses have no row
+        for dataset_id in dataset_ids:
+            counts.setdefault(dataset_id, 0)
+
+        return counts
+
+    def get_dataset_metrics(self, dataset_ids=[], month=None):
+        # Make Data Count metrics of many datasets from one aggregate query over datasetmetrics, summed over countries:
+        # {dataset_id: {'total': {...}, 'month': {...}}} with viewsUnique, viewsTotal, downloadsUnique and downloadsTotal
+        metrics = {}
+        if len(dataset_ids) == 0:
+            return metrics
+
+        cursor = self.conn.cursor()
+        cursor.execute("""SELECT m.dataset_id,
+                              COALESCE(SUM(COALESCE(m.viewsuniqueregular, 0) + COALESCE(m.viewsuniquemachine, 0)), 0),
+                              COALESCE(SUM(COALESCE(m.viewstotalregular, 0) + COALESCE(m.viewstotalmachine, 0)), 0),
+                              COALESCE(SUM(COALESCE(m.downloadsuniqueregular, 0) + COALESCE(m.downloadsuniquemachine, 0)), 0),
+                              COALESCE(SUM(COALESCE(m.downloadstotalregular, 0) + COALESCE(m.downloadstotalmachine, 0)), 0),
+                              COALESCE(SUM(COALESCE(m.viewsuniqueregular, 0) + COALESCE(m.viewsuniquemachine, 0)) FILTER (WHERE m.monthyear = %s), 0),
+                              COALESCE(SUM(COALESCE(m.viewstotalregular, 0) + COALESCE(m.viewstotalmachine, 0)) FILTER (WHERE m.monthyear = %s), 0),
+                              COALESCE(SUM(COALESCE(m.downloadsuniqueregular, 0) + COALESCE(m.downloadsuniquemachine, 0)) FILTER (WHERE m.monthyear = %s), 0),
+                              COALESCE(SUM(COALESCE(m.downloadstotalregular, 0) + COALESCE(m.downloadstotalmachine, 0)) FILTER (WHERE m.monthyear = %s), 0)
+                          FROM datasetmetrics m WHERE m.dataset_id = ANY(%s) GROUP BY m.dataset_id;""", [month, month, month, month, list(dataset_ids)])
+        for row in cursor.fetchall():
+            metrics[row[0]] = {'total': {'viewsUnique': int(row[1]), 'viewsTotal': int(row[2]), 'downloadsUnique': int(row[3]), 'downloadsTotal': int(row[4])},
+                               'month': {'viewsUnique': int(row[5]), 'viewsTotal': int(row[6]), 'downloadsUnique': int(row[7]), 'downloadsTotal': int(row[8])}}
+        cursor.close()
+
+        return metrics
+
+    def get_dataset_sizes(self, dataset_ids=[]):
+        # Total size in bytes of the files of many datasets (all versions) from one grouped query: {dataset_id: size}
+        sizes = {}
+        if len(dataset_ids) == 0:
+            return sizes
+
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT o.owner_id, COALESCE(SUM(f.filesize), 0) FROM datafile f JOIN dvobject o ON o.id = f.id WHERE o.owner_id = ANY(%s) GROUP BY o.owner_id;", [list(dataset_ids)])
+        for dataset_id, size in cursor.fetchall():
+            sizes[dataset_id] = int(size)
+        cursor.close()
+
+        # Datasets without files have no row
+        for dataset_id in dataset_ids:
+            sizes.setdefault(dataset_id, 0)
+
+        return sizes
+
+    def get_release_statuses(self, dvobject_ids=[]):
+        # Whether each dataverse (or dataset) has been published, from its publication date: {id: bool}
+        statuses = {}
+        if len(dvobject_ids) == 0:
+            return statuses
+
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT o.id, o.publicationdate IS NOT NULL FROM dvobject o WHERE o.id = ANY(%s);", [list(dvobject_ids)])
+        for dvobject_id, released in cursor.fetchall():
+            statuses[dvobject_id] = released
+        cursor.close()
+
+        return statuses
+
+    def get_dataset_versions(self, dataset_ids=[]):
+        # Latest version (drafts included) of each dataset: {dataset_id: {'lastUpdateTime': ..., 'versionState': ...}}
+        versions = {}
+        if len(dataset_ids) == 0:
+            return versions
+
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT DISTINCT ON (v.dataset_id) v.dataset_id, v.lastupdatetime, v.versionstate FROM datasetversion v WHERE v.dataset_id = ANY(%s) ORDER BY v.dataset_id, v.id DESC;", [list(dataset_ids)])
+        for dataset_id, last_update_time, version_state in cursor.fetchall():
+            versions[dataset_id] = {'lastUpdateTime': str(last_update_time), 'versionState': version_state}
+        cursor.close()
+
+        return versions
+
+    def get_subtree(self, dataverse_identifier=None):
+        # Every dataverse and dataset below a dataverse (alias or id) from one recursive query, parents before children
+        # Each dataverse's children are in the order of its /contents endpoint: datasets (by id, as the database returns them), then dataverses by name
+        if dataverse_identifier is None:
+            print("Dataverse identifier is required.")
+            return
+
+        subtree = []
+        cursor = self.conn.cursor()
+        cursor.execute("""WITH RECURSIVE subtree (id, dtype, owner_id, depth) AS (
+                              SELECT o.id, o.dtype, o.owner_id, 0 FROM dvobject o JOIN dataverse d ON d.id = o.id WHERE d.alias = %s OR CAST(d.id AS TEXT) = %s
+                              UNION ALL
+                              SELECT o.id, o.dtype, o.owner_id, s.depth + 1 FROM dvobject o JOIN subtree s ON o.owner_id = s.id WHERE s.dtype = 'Dataverse' AND o.dtype IN ('Dataverse', 'Dataset')
+                          )
+                          SELECT s.id, s.dtype, s.owner_id, p.alias, s.depth, o.identifier FROM subtree s JOIN dvobject o ON o.id = s.id LEFT JOIN dataverse p ON p.id = s.owner_id LEFT JOIN dataverse c ON c.id = s.id
+                          ORDER BY s.depth, s.owner_id, CASE WHEN s.dtype = 'Dataset' THEN 0 ELSE 1 END, c.name, s.id;""", [str(dataverse_identifier), str(dataverse_identifier)])
+        for dvobject_id, dtype, owner_id, parent_alias, depth, identifier in cursor.fetchall():
+            subtree.append({'id': dvobject_id, 'type': dtype.lower(), 'ownerId': owner_id, 'parentAlias': parent_alias, 'depth': depth, 'identifier': identifier})
+        cursor.close()
+
+        return subtree
+
+    def get_dataset_metadata(self, dataset_ids=[]):
+        # Latest version of many datasets in the shape of the native API's dataset JSON (citation block only): {dataset_id: dataset}
+        datasets = {}
+        if len(dataset_ids) == 0:
+            return datasets
+
+        cursor = self.conn.cursor()
+
+        # The API reports the installation name (or the root dataverse name) as every dataset's publisher
+        cursor.execute("SELECT COALESCE((SELECT s.content FROM setting s WHERE s.name = ':InstallationName' LIMIT 1), (SELECT d.name FROM dataverse d JOIN dvobject o ON o.id = d.id WHERE o.owner_id IS NULL LIMIT 1));")
+        publisher = cursor.fetchone()[0]
+
+        cursor.execute("SELECT o.id, o.identifier, o.protocol, o.authority, o.publicationdate FROM dvobject o WHERE o.id = ANY(%s);", [list(dataset_ids)])
+        for dataset_id, identifier, protocol, authority, publication_date in cursor.fetchall():
+            dataset = {'id': dataset_id, 'identifier': identifier, 'persistentUrl': self.get_persistent_url(protocol, authority, identifier), 'protocol': protocol, 'authority': authority, 'publisher': publisher}
+            if publication_date is not None:
+                dataset['publicationDate'] = publication_date.strftime('%Y-%m-%d')
+            dataset['fileSummary'] = {'contentSize': 0, 'totalFiles': 0, 'totalRestrictedFiles': 0}
+            datasets[dataset_id] = dataset
+
+        # Latest version (drafts included) of each dataset
+        versions = {}
+        cursor.execute("SELECT DISTINCT ON (v.dataset_id) v.dataset_id, v.id, v.versionstate, v.lastupdatetime, v.releasetime, v.createtime, t.termsofuse, l.name, l.uri, l.iconurl FROM datasetversion v LEFT JOIN termsofuseandaccess t ON t.id = v.termsofuseandaccess_id LEFT JOIN license l ON l.id = t.license_id WHERE v.dataset_id = ANY(%s) ORDER BY v.dataset_id, v.id DESC;", [list(dataset_ids)])
+        for dataset_id, version_id, version_state, last_update_time, release_time, create_time, terms_of_use, license_name, license_uri, license_icon_uri in cursor.fetchall():
+            # Null values are left out, as in the API's JSON
+            latest_version = {'id': version_id, 'datasetId': dataset_id, 'versionState': version_state}
+            if last_update_time is not None:
+                latest_version['lastUpdateTime'] = last_update_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+            if release_time is not None:
+                latest_version['releaseTime'] = release_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+            if create_time is not None:
+                latest_version['createTime'] = create_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+            if license_name is not None:
+                latest_version['license'] = {'name': license_name, 'uri': license_uri}
+                if license_icon_uri is not None:
+                    latest_version['license']['iconUri'] = license_icon_uri
+            if terms_of_use is not None:
+                latest_version['termsOfUse'] = terms_of_use
+            latest_version['metadataBlocks'] = {'citation': {'fields': []}}
+            if dataset_id in datasets:
+                datasets[dataset_id]['latestVersion'] = latest_version
+                versions[version_id] = latest_version
+
+        if len(versions) == 0:
+            cursor.close()
+            return datasets
+
+        # File size and counts of each version
+        cursor.execute("SELECT m.datasetversion_id, COALESCE(SUM(d.filesize), 0), COUNT(m.id), SUM(CASE WHEN m.restricted THEN 1 ELSE 0 END) FROM filemetadata m JOIN datafile d ON d.id = m.datafile_id WHERE m.datasetversion_id = ANY(%s) GROUP BY m.datasetversion_id;", [list(versions.keys())])
+        for version_id, content_size, total_files, total_restricted_files in cursor.fetchall():
+            datasets[versions[version_id]['datasetId']]['fileSummary'] = {'contentSize': int(content_size), 'totalFiles': total_files, 'totalRestrictedFiles': total_restricted_files}
+
+        # Citation fields of each version, then their compound values, child fields and values
+        fields = {}
+        version_fields = {}
+        cursor.execute("SELECT f.id, f.datasetversion_id, t.name, t.fieldtype, t.allowmultiples, t.allowcontrolledvocabulary FROM datasetfield f JOIN datasetfieldtype t ON t.id = f.datasetfieldtype_id JOIN metadatablock b ON b.id = t.metadatablock_id WHERE f.datasetversion_id = ANY(%s) AND b.name = 'citation' ORDER BY f.datasetversion_id, t.displayorder;", [list(versions.keys())])
+        for field_id, version_id, name, field_type, allow_multiples, allow_controlled_vocabulary in cursor.fetchall():
+            fields[field_id] = self.create_field(name, field_type, allow_multiples, allow_controlled_vocabulary)
+            version_fields.setdefault(version_id, []).append(field_id)
+
+        compound_values = {}
+        compound_field_ids = [field_id for field_id, field in fields.items() if field['typeClass'] == 'compound']
+        if len(compound_field_ids) > 0:
+            cursor.execute("SELECT c.id, c.parentdatasetfield_id FROM datasetfieldcompoundvalue c WHERE c.parentdatasetfield_id = ANY(%s) ORDER BY c.parentdatasetfield_id, c.displayorder;", [compound_field_ids])
+            for compound_value_id, field_id in cursor.fetchall():
+                compound_values.setdefault(field_id, []).append(compound_value_id)
+
+        child_fields = {}
+        compound_value_ids = [compound_value_id for ids in compound_values.values() for compound_value_id in ids]
+        if len(compound_value_ids) > 0:
+            cursor.execute("SELECT f.id, f.parentdatasetfieldcompoundvalue_id, t.name, t.fieldtype, t.allowmultiples, t.allowcontrolledvocabulary FROM datasetfield f JOIN datasetfieldtype t ON t.id = f.datasetfieldtype_id WHERE f.parentdatasetfieldcompoundvalue_id = ANY(%s) ORDER BY f.parentdatasetfieldcompoundvalue_id, t.displayorder;", [compound_value_ids])
+            for field_id, compound_value_id, name, field_type, allow_multiples, allow_controlled_vocabulary in cursor.fetchall():
+                fields[field_id] = self.create_field(name, field_type, allow_multiples, allow_controlled_vocabulary)
+                child_fields.setdefault(compound_value_id, []).append(field_id)
+
+        values = {}
+        cursor.execute("SELECT v.datasetfield_id, v.value FROM datasetfieldvalue v WHERE v.datasetfield_id = ANY(%s) ORDER BY v.datasetfield_id, v.displayorder;", [list(fields.keys())])
+        for field_id, value in cursor.fetchall():
+            values.setdefault(field_id, []).append(value)
+        cursor.execute("SELECT fc.datasetfield_id, cv.strvalue FROM datasetfield_controlledvocabularyvalue fc JOIN controlledvocabularyvalue cv ON cv.id = fc.controlledvocabularyvalues_id WHERE fc.datasetfield_id = ANY(%s) ORDER BY fc.datasetfield_id, cv.displayorder;", [list(fields.keys())])
+        for field_id, value in cursor.fetchall():
+            values.setdefault(field_id, []).append(value)
+        cursor.close()
+
+        for version_id, field_ids in version_fields.items():
+            citation_fields = versions[version_id]['metadataBlocks']['citation']['fields']
+            for field_id in field_ids:
+                field = self.build_field(field_id, fields, compound_values, child_fields, values)
+                if field is not None:
+                    citation_fields.append(field)
+
+        return datasets
+
+    def create_field(self, name, field_type, allow_multiples, allow_controlled_vocabulary):
+        if allow_controlled_vocabulary:
+            type_class = 'controlledVocabulary'
+        elif field_type == 'NONE':
+            type_class = 'compound'
+        else:
+            type_class = 'primitive'
+
+        return {'typeName': name, 'multiple': bool(allow_multiples), 'typeClass': type_class}
+
+    def build_field(self, field_id, fields, compound_values, child_fields, values):
+        # Field JSON as the API prints it, or None if the field has no value
+        field = dict(fields[field_id])
+        if field['typeClass'] == 'compound':
+            field_values = []
+            for compound_value_id in compound_values.get(field_id, []):
+                compound_value = {}
+                for child_field_id in child_fields.get(compound_value_id, []):
+                    child_field = self.build_field(child_field_id, fields, compound_values, child_fields, values)
+                    if child_field is not None:
+                        compound_value[child_field['typeName']] = child_field
+                if compound_value:
+                    field_values.append(compound_value)
+        else:
+            field_values = values.get(field_id, [])
+
+        if len(field_values) == 0:
+            return None
+
+        if field['multiple']:
+            field['value'] = field_values
+        else:
+            field['value'] = field_values[0]
+        return field
+
+    def get_persistent_url(self, protocol, authority, identifier):
+        if protocol == 'doi':
+            return 'https://doi.org/' + str(authority) + '/' + str(identifier)
+        elif protocol == 'hdl':
+            return 'https://hdl.handle.net/' + str(authority) + '/' + str(identifier)
+        else:
+            return None
@@ -1,4 +1,5 @@
 import os
+import time
 import smtplib
 import logging
 from email.mime.multipart import MIMEMultipart
@@ -8,8 +9,18 @@ from email import encoders
 
 
 class Email(object):
-    def __init__(self, config=None):
+    def __init__(self, config=None, outbox=None):
         self.config = config
+
+        # Messages are queued in the outbox for a delivery worker instead of being sent, if one is given
+        self.outbox = outbox
+
+        # SMTP session and encoded attachments reused by every message of the run
+        self.server = None
+        self.sessions = 0
+        self.attachments = {}
+        self.latencies = []
+
         self.logger = logging.getLogger('dataverse-reports')
 
     def email_report_institution(self, report_file_paths=[], account_info=[]):
@@ -23,9 +34,7 @@ class Email(object):
         body = "The report in Excel format is attached."
 
         # Send email(s) to contact(s)
-        for contact in account_info['contacts']:
-            self.logger.info("Sending report to %s.", contact)
-            self.email_report_internal(report_file_paths=report_file_paths, to_email=contact, from_email=from_email, subject=subject, body=body)
+        self.send_reports(report_file_paths=report_file_paths, to_emails=account_info['contacts'], from_email=from_email, subject=subject, body=body)
 
     def email_report_admin(self, report_file_paths=[]):
         if len(report_file_paths) == 0:
@@ -38,12 +47,18 @@ class Email(object):
         body = "The reports in Excel format are attached."
 
         # Send email(s) to admin email address(es)
-        for admin_email in self.config['admin_emails']:
-            self.logger.info("Sending reports to admin %s.", admin_email)
-            self.email_report_internal(report_file_paths=report_file_paths, to_email=admin_email, from_email=from_email, subject=subject, body=body)
+        self.send_reports(report_file_paths=report_file_paths, to_emails=self.config['admin_emails'], from_email=from_email, subject=subject, body=body)
+
+    def send_reports(self, report_file_paths=[], to_emails=[], from_email=None, subject=None, body=None):
+        # Queue one message per recipient in the outbox, or send them over one SMTP session with the report file(s) encoded once
+        if self.outbox is not None:
+            for to_email in to_emails:
+                self.outbox.add_message(report_file_paths=report_file_paths, to_email=to_email, from_email=from_email, subject=subject, body=body)
+            return
 
+        self.send_messages([self.create_message(report_file_paths=report_file_paths, to_email=to_email, from_email=from_email, subject=subject, body=body) for to_email in to_emails])
 
-    def email_report_internal(self, report_file_paths=[], to_email=None, from_email=None, subject=None, body=None):
+    def create_message(self, report_file_paths=[], to_email=None, from_email=None, subject=None, body=None):
         if len(report_file_paths) == 0:
             self.logger.error("At least one report file path is required.")
             return
@@ -58,22 +73,61 @@ class Email(object):
         message['From'] = from_email
         message.attach(MIMEText(body, 'plain'))
 
-        # Attach report file(s)
+        # Attach report file(s), and don't send a report email without its report
         for report_file_path in report_file_paths:
-            # Check that report file exists
-            if not os.path.isfile(report_file_path):
-                self.logger.warning("Report file doesn't exist: %s.", report_file_path)
-                continue
+            part = self.get_attachment(report_file_path)
+            if part is None:
+                self.logger.error("Not sending report email to %s without its report file(s).", to_email)
+                return
+            message.attach(part)
+
+        return message
+
+    def get_attachment(self, report_file_path):
+        # Check that report file exists
+        if not os.path.isfile(report_file_path):
+            self.logger.error("Report file doesn't exist: %s.", report_file_path)
+            return
 
-            path, report_file_name = os.path.split(report_file_path)
-            attachment = open(report_file_path, "rb")
+        # Every message of the run shares one encoded part per file, unless the file has changed since
+        modified = os.path.getmtime(report_file_path)
+        if report_file_path in self.attachments and self.attachments[report_file_path][0] == modified:
+            return self.attachments[report_file_path][1]
 
+        path, report_file_name = os.path.split(report_file_path)
+        with open(report_file_path, "rb") as attachment:
             part = MIMEBase('application', 'octet-stream')
-            part.set_payload((attachment).read())
-            encoders.encode_base64(part)
-            part.add_header('Content-Disposition', "attachment; filename= %s" % report_file_name)
-            message.attach(part)
+            part.set_payload(attachment.read())
+        encoders.encode_base64(part)
+        part.add_header('Content-Disposition', "attachment; filename= %s" % report_file_name)
+
+        self.attachments[report_file_path] = (modified, part)
+        return part
+
+    def send_messages(self, messages=[]):
+        for message in messages:
+            if message is None:
+                continue
 
+            # Send email
+            self.logger.info('Sending Dataverse report to {email}.'.format(email=message['To']))
+            start = time.monotonic()
+            try:
+                self.get_server().send_message(message)
+            except smtplib.SMTPServerDisconnected:
+                # The relay dropped the session while reports were being generated, so log in again
+                self.logger.info("SMTP session was closed by the server, reconnecting.")
+                self.server = None
+                self.get_server().send_message(message)
+            latency = time.monotonic() - start
+
+            self.latencies.append(latency)
+            self.logger.info("Sent Dataverse report to %s in %.1f ms.", message['To'], 1000 * latency)
+
+    def get_server(self):
+        # One authenticated SMTP session is shared by all messages until close()
+        if self.server is not None:
+            return self.server
 
         # Get SMTP configuration 
         smtp_host = self.config['smtp_host']
@@ -82,12 +136,27 @@ class Email(object):
         smtp_username = self.config['smtp_username']
         smtp_password = self.config['smtp_password']
 
-        # Send email
-        self.logger.info('Sending Dataverse report to {email}.'.format(email=to_email))
         server = smtplib.SMTP(smtp_host, smtp_port)
         if smtp_auth == 'tls':
             server.starttls()
         if smtp_username and smtp_password:
             server.login(smtp_username, smtp_password)
-        server.send_message(message)
-        server.quit()
+
+        self.sessions += 1
+        self.server = server
+        return server
+
+    def close_server(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                # The session is discarded either way
+                self.server.close()
+            self.server = None
+
+    def close(self):
+        self.close_server()
+
+        if len(self.latencies) > 0:
+            self.logger.info("Sent %s emails over %s SMTP sessions, mean %.1f ms, max %.1f ms per message.", str(len(self.latencies)), str(self.sessions), 1000 * sum(self.latencies) / len(self.latencies), 1000 * max(self.latencies))
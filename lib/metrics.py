@@ -0,0 +1,99 @@
+import time
+import asyncio
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TokenBucket(object):
+    def __init__(self, rate=0, capacity=None):
+        # rate is in requests per second; 0 disables rate limiting
+        self.rate = float(rate)
+        self.capacity = capacity or max(self.rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # Take a token, going into debt if none is left, and return how long the caller must wait for it
+        if self.rate <= 0:
+            return 0
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class DatasetMetricsFetcher(object):
+    def __init__(self, dataverse_api=None, workers=10, requests_per_second=0):
+        if dataverse_api is None:
+            print('Dataverse API required to fetch dataset metrics.')
+            return
+
+        self.dataverse_api = dataverse_api
+        self.workers = max(int(workers), 1)
+        self.bucket = TokenBucket(rate=requests_per_second)
+
+        # Seconds taken by each call, per report column
+        self.latencies = {}
+        self.lock = threading.Lock()
+
+        self.logger = logging.getLogger('dataverse-reports')
+
+    def fetch(self, requests):
+        # requests are (column, dataset_id, doi, option, date); returns the response JSON of each, in order
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(self.get_dataset_metric, requests))
+
+    def get_dataset_metric(self, request):
+        column, dataset_id, doi, option, date = request
+        self.bucket.acquire()
+
+        start = time.monotonic()
+        dataset_metrics_response = self.dataverse_api.get_dataset_metric(identifier=dataset_id, option=option, doi=doi, date=date)
+        self.add_latency(column, time.monotonic() - start)
+        return dataset_metrics_response.json()
+
+    async def fetch_async(self, dataverse_api, requests):
+        # Same as fetch, with the async API client's request budget bounding concurrency
+        return await asyncio.gather(*[self.get_dataset_metric_async(dataverse_api, request) for request in requests])
+
+    async def get_dataset_metric_async(self, dataverse_api, request):
+        column, dataset_id, doi, option, date = request
+        await self.bucket.acquire_async()
+
+        start = time.monotonic()
+        dataset_metrics_response = await dataverse_api.get_dataset_metric(identifier=dataset_id, option=option, doi=doi, date=date)
+        self.add_latency(column, time.monotonic() - start)
+        return dataset_metrics_response.json()
+
+    def add_latency(self, column, seconds):
+        with self.lock:
+            self.latencies.setdefault(column, []).append(seconds)
+
+    def log_stats(self):
+        # Log and reset the latency of the calls made since the last report
+        with self.lock:
+            latencies = self.latencies
+            self.latencies = {}
+
+        for column, seconds in latencies.items():
+            seconds = sorted(seconds)
+            count = len(seconds)
+            self.logger.info("MDC metric %s: %s calls, mean %.1f ms, p50 %.1f ms, p95 %.1f ms, max %.1f ms.", column, str(count), 1000 * sum(seconds) / count, 1000 * seconds[count // 2], 1000 * seconds[min(int(count * 0.95), count - 1)], 1000 * seconds[-1])
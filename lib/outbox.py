@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import sqlite3
+import smtplib
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.email import Email
+
+
+class Outbox(object):
+    # Messages claimed by a delivery worker that did not finish them are retried after this many seconds
+    claim_timeout = 3600
+
+    def __init__(self, path=None):
+        self.path = path
+
+        # Delivery workers share one connection, so serialize access with a lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, to_email TEXT, from_email TEXT, subject TEXT, body TEXT, report_file_paths TEXT, status TEXT, attempts INTEGER, next_attempt REAL, claimed_at REAL, last_error TEXT, created REAL, sent REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS messages_status ON messages (status, next_attempt)")
+        self.conn.commit()
+
+        self.logger = logging.getLogger('dataverse-reports')
+
+    def add_message(self, report_file_paths=[], to_email=None, from_email=None, subject=None, body=None):
+        # Report files are attached when the message is delivered, so the spool only keeps their paths,
+        # made absolute since deliver.py may be run from another directory
+        report_file_paths = [os.path.abspath(report_file_path) for report_file_path in report_file_paths]
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT INTO messages (to_email, from_email, subject, body, report_file_paths, status, attempts, next_attempt, created) VALUES (?, ?, ?, ?, ?, 'pending', 0, ?, ?)", [to_email, from_email, subject, body, json.dumps(report_file_paths), now, now])
+            self.conn.commit()
+        self.logger.info("Queued report email to %s in outbox %s.", to_email, self.path)
+
+    def claim_messages(self, limit=100):
+        # Returns messages that are due, marked as being sent so other delivery workers skip them
+        now = time.time()
+        with self.lock:
+            rows = self.conn.execute("SELECT id, to_email, from_email, subject, body, report_file_paths, attempts FROM messages WHERE (status = 'pending' AND next_attempt <= ?) OR (status = 'sending' AND claimed_at <= ?) ORDER BY id LIMIT ?", [now, now - self.claim_timeout, limit]).fetchall()
+            self.conn.executemany("UPDATE messages SET status = 'sending', claimed_at = ? WHERE id = ?", [[now, row[0]] for row in rows])
+            self.conn.commit()
+
+        return [{'id': row[0], 'to_email': row[1], 'from_email': row[2], 'subject': row[3], 'body': row[4], 'report_file_paths': json.loads(row[5]), 'attempts': row[6]} for row in rows]
+
+    def mark_sent(self, message_id):
+        with self.lock:
+            self.conn.execute("UPDATE messages SET status = 'sent', attempts = attempts + 1, sent = ?, last_error = NULL WHERE id = ?", [time.time(), message_id])
+            self.conn.commit()
+
+    def mark_failed(self, message_id, error=None, next_attempt=None):
+        # Without a next attempt the message is given up on
+        with self.lock:
+            if next_attempt is None:
+                self.conn.execute("UPDATE messages SET status = 'failed', attempts = attempts + 1, last_error = ? WHERE id = ?", [error, message_id])
+            else:
+                self.conn.execute("UPDATE messages SET status = 'pending', attempts = attempts + 1, last_error = ?, next_attempt = ? WHERE id = ?", [error, next_attempt, message_id])
+            self.conn.commit()
+
+    def get_next_attempt(self):
+        # Time of the earliest message still waiting to be sent, or None if there are none
+        with self.lock:
+            row = self.conn.execute("SELECT MIN(CASE WHEN status = 'pending' THEN next_attempt ELSE claimed_at + ? END) FROM messages WHERE status IN ('pending', 'sending')", [self.claim_timeout]).fetchone()
+        return row[0]
+
+    def get_counts(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM messages GROUP BY status").fetchall())
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class OutboxDelivery(object):
+    def __init__(self, outbox=None, config=None, workers=4, max_attempts=5, retry_delay=60):
+        if outbox is None:
+            print('Outbox required to deliver emails.')
+            return
+
+        self.outbox = outbox
+        self.config = config
+        self.workers = max(int(workers), 1)
+        self.max_attempts = max(int(max_attempts), 1)
+        self.retry_delay = retry_delay
+
+        # Each worker thread sends over its own SMTP session
+        self.worker = threading.local()
+        self.emails = []
+
+        self.logger = logging.getLogger('dataverse-reports')
+
+    def deliver(self, wait=True):
+        # Drains the due messages; with wait, keeps going until every message is sent or has failed for good
+        # Returns how many attempts of this delivery were sent, retried or failed
+        results = {'sent': 0, 'retried': 0, 'failed': 0}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                messages = self.outbox.claim_messages(limit=self.workers * 10)
+                if len(messages) > 0:
+                    for result in executor.map(self.deliver_message, messages):
+                        results[result] += 1
+                    continue
+
+                next_attempt = self.outbox.get_next_attempt()
+                if not wait or next_attempt is None:
+                    break
+
+                delay = next_attempt - time.time()
+                if delay > 0:
+                    self.logger.info("Waiting %.0f seconds to retry queued emails.", delay)
+                    time.sleep(delay)
+
+        for email in self.emails:
+            email.close()
+
+        counts = self.outbox.get_counts()
+        self.logger.info("Sent %s emails, retried %s and gave up on %s. Outbox has %s sent, %s pending and %s failed emails.", str(results['sent']), str(results['retried']), str(results['failed']), str(counts.get('sent', 0)), str(counts.get('pending', 0) + counts.get('sending', 0)), str(counts.get('failed', 0)))
+        return results
+
+    def deliver_message(self, message):
+        # A report file may still be copied into place, so a missing one is retried like a temporary SMTP error
+        missing_files = [report_file_path for report_file_path in message['report_file_paths'] if not os.path.isfile(report_file_path)]
+        if len(missing_files) > 0:
+            return self.retry_message(message, "Report file doesn't exist: " + ", ".join(missing_files))
+
+        email = self.get_email()
+        email_message = email.create_message(report_file_paths=message['report_file_paths'], to_email=message['to_email'], from_email=message['from_email'], subject=message['subject'], body=message['body'])
+        if email_message is None:
+            self.outbox.mark_failed(message['id'], error="Required email information is missing.")
+            return 'failed'
+
+        try:
+            email.send_messages([email_message])
+        except (smtplib.SMTPException, OSError) as error:
+            # Start the next message with a new session
+            email.close_server()
+            return self.retry_message(message, str(error), permanent=self.is_permanent_error(error))
+
+        self.outbox.mark_sent(message['id'])
+        return 'sent'
+
+    def retry_message(self, message, error, permanent=False):
+        attempts = message['attempts'] + 1
+        if attempts >= self.max_attempts or permanent:
+            self.logger.error("Giving up on email to %s after %s attempts: %s", message['to_email'], str(attempts), error)
+            self.outbox.mark_failed(message['id'], error=error)
+            return 'failed'
+
+        # Back off exponentially so a greylisting relay has time to accept the message
+        delay = self.retry_delay * 2 ** (attempts - 1)
+        self.logger.warning("Retrying email to %s in %s seconds: %s", message['to_email'], str(delay), error)
+        self.outbox.mark_failed(message['id'], error=error, next_attempt=time.time() + delay)
+        return 'retried'
+
+    def is_permanent_error(self, error):
+        # 5xx replies will not change on retry, unlike 4xx replies such as greylisting
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            return all(code >= 500 for code, response in error.recipients.values())
+        return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+    def get_email(self):
+        if getattr(self.worker, 'email', None) is None:
+            self.worker.email = Email(config=self.config)
+            self.emails.append(self.worker.email)
+        return self.worker.email
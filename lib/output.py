@@ -1,5 +1,8 @@
 import os
+import re
 import csv
+import sqlite3
+import datetime
 import xlsxwriter
 import logging
 
@@ -9,66 +12,118 @@ class Output(object):
         self.config = config
         self.logger = logging.getLogger('dataverse-reports')
 
-    def save_report_csv_file(self, output_file_path=None, headers=[], data=[]):
-        # Sanity checks
-        if output_file_path is None:
-            self.logger.error("Output file path is required.")
+    def save_report_file(self, output_file_path=None, headers=[], data=[], workbook=None, worksheet_name=None, parquet_file_path=None, report_store=None, account=None):
+        # Stream rows once into a CSV file (if output_file_path is set), a worksheet (if workbook is set), a Parquet file (if parquet_file_path is set)
+        # and the account's rows of a report store table (if report_store is set)
+        if output_file_path is None and workbook is None and parquet_file_path is None and report_store is None:
+            self.logger.error("Output file path or workbook is required.")
             return False
         if not headers:
             self.logger.error("Report headers are required.")
             return False
-        if not self.ensure_directory_exists(output_file_path):
+        if output_file_path is not None and not self.ensure_directory_exists(output_file_path):
             self.logger.error("Output directory doesn't exist and can't be created.")
             return False
 
-        with open(output_file_path, 'w', newline='', encoding='utf-8') as csvfile:
+        worksheet = None
+        if workbook is not None:
+            worksheet = workbook.add_worksheet(worksheet_name, headers)
+
+        table = None
+        if parquet_file_path is not None:
+            table = self.create_parquet_file(output_file_path=parquet_file_path, headers=headers)
+
+        store_table = None
+        if report_store is not None:
+            store_table = report_store.add_report(name=worksheet_name, account=account, headers=headers)
+
+        csvfile = None
+        writer = None
+        if output_file_path is not None:
+            csvfile = open(output_file_path, 'w', newline='', encoding='utf-8')
             writer = csv.DictWriter(csvfile, fieldnames=headers, extrasaction='ignore', dialect='excel', quoting=csv.QUOTE_NONNUMERIC)
             writer.writeheader()
-            for result in data:
-                writer.writerow(result)
 
-        self.logger.info("Saved report to CSV file %s.", output_file_path)
-        return output_file_path
+        try:
+            for r, result in enumerate(data, start=1):
+                if writer is not None:
+                    writer.writerow(result)
+                if worksheet is not None:
+                    workbook.write_row(worksheet, r, headers, result)
+                if table is not None:
+                    table.write_row(result)
+                if store_table is not None:
+                    store_table.write_row(result)
+        finally:
+            if csvfile is not None:
+                csvfile.close()
+
+        if table is not None:
+            table.close()
+            self.logger.info("Saved report to Parquet file %s.", parquet_file_path)
+
+        if store_table is not None:
+            store_table.close()
+            self.logger.info("Saved %s report of %s to report store %s.", worksheet_name, account, report_store.output_file_path)
 
-    def save_report_excel_file(self, output_file_path=None, worksheet_files=[]):
+        if output_file_path is not None:
+            self.logger.info("Saved report to CSV file %s.", output_file_path)
+            return output_file_path
+
+        self.logger.info("Saved report to worksheet %s.", worksheet_name)
+        return worksheet_name
+
+    def create_excel_file(self, output_file_path=None):
         # Sanity checks
         if output_file_path is None:
             self.logger.error("Output file path is required.")
             return False
-        if len(worksheet_files) == 0:
-            self.logger.error("Worksheets files list is empty.")
-            return False
         if not self.ensure_directory_exists(output_file_path):
             self.logger.error("Output directory doesn't exist and can't be created.")
             return False
 
-        # Create Excel workbook
         self.logger.info("Creating Excel file: %s", output_file_path)
-        workbook = xlsxwriter.Workbook(output_file_path, {'strings_to_numbers': True})
-
-        # Add worksheet(s)
-        for worksheet_file in worksheet_files:
-            # Get worksheet title from filename
-            filename_w_ext = os.path.basename(worksheet_file)
-            filename, file_extension = os.path.splitext(filename_w_ext)
-            filename_parts = filename.split("-")
-            if len(filename_parts) == 2:
-                workbook_name = filename_parts[1]
-            else:
-                workbook_name = filename
+        return ExcelWorkbook(output_file_path=output_file_path)
+
+    def create_parquet_file(self, output_file_path=None, headers=[]):
+        # Sanity checks
+        if output_file_path is None:
+            self.logger.error("Output file path is required.")
+            return False
+        if not self.ensure_directory_exists(output_file_path):
+            self.logger.error("Output directory doesn't exist and can't be created.")
+            return False
+
+        # Parquet output is optional, so pyarrow is only needed when it is configured
+        from lib.parquet import ParquetTable
 
-            worksheet = workbook.add_worksheet(workbook_name)
-            worksheet.freeze_panes(1, 0)
-            with open(worksheet_file, 'rt', encoding='utf8') as f:
-                reader = csv.reader(f)
-                for r, row in enumerate(reader):
-                    for c, col in enumerate(row):
-                        worksheet.write(r, c, col)
+        self.logger.info("Creating Parquet file: %s", output_file_path)
+        return ParquetTable(output_file_path=output_file_path, headers=headers, compression=self.config.get('parquet_compression', 'zstd'), row_group_size=self.config.get('parquet_row_group_size', 10000))
+
+    def create_report_store(self, output_file_path=None):
+        # Sanity checks
+        if output_file_path is None:
+            self.logger.error("Output file path is required.")
+            return False
+        if not self.ensure_directory_exists(output_file_path):
+            self.logger.error("Output directory doesn't exist and can't be created.")
+            return False
+
+        self.logger.info("Using report store: %s", output_file_path)
+        return ReportStore(output_file_path=output_file_path, batch_size=self.config.get('report_batch_size', 1000))
+
+    def close_excel_file(self, workbook=None):
+        if not workbook:
+            return False
+        if workbook.worksheets == 0:
+            self.logger.error("Excel file %s has no worksheets.", workbook.output_file_path)
+            workbook.close()
+            return False
 
         workbook.close()
 
-        self.logger.info("Saved report to Excel file %s.", output_file_path)
-        return output_file_path
+        self.logger.info("Saved report to Excel file %s.", workbook.output_file_path)
+        return workbook.output_file_path
 
     def ensure_directory_exists(self, output_file_path=None):
         if output_file_path is None:
@@ -82,3 +137,161 @@ class Output(object):
         else:
             os.mkdir(directory)
             return True
+
+
+class ExcelWorkbook(object):
+    # Dates from the API, e.g. 2020-01-31, 2020-01-31T12:00:00Z or 2020-01-31 12:00:00.123
+    date_pattern = re.compile(r'^(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2}):(\d{2})(?:\.\d+)?Z?)?$')
+
+    def __init__(self, output_file_path=None):
+        self.output_file_path = output_file_path
+        self.worksheets = 0
+
+        # Rows are flushed to disk as each one is finished, so they must be written in order
+        self.workbook = xlsxwriter.Workbook(output_file_path, {'constant_memory': True})
+        self.date_format = self.workbook.add_format({'num_format': 'yyyy-mm-dd'})
+        self.datetime_format = self.workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+
+    def add_worksheet(self, name, headers):
+        worksheet = self.workbook.add_worksheet(name)
+        worksheet.freeze_panes(1, 0)
+        for c, header in enumerate(headers):
+            worksheet.write_string(0, c, header)
+        self.worksheets += 1
+        return worksheet
+
+    def write_row(self, worksheet, r, headers, row):
+        for c, header in enumerate(headers):
+            if header in row:
+                self.write_cell(worksheet, r, c, row[header])
+
+    def write_cell(self, worksheet, r, c, value):
+        if value is None:
+            return
+        elif isinstance(value, bool):
+            worksheet.write_boolean(r, c, value)
+        elif isinstance(value, (int, float)):
+            worksheet.write_number(r, c, value)
+        elif isinstance(value, str):
+            date = self.parse_date(value)
+            if date is None:
+                worksheet.write_string(r, c, value)
+            else:
+                worksheet.write_datetime(r, c, *date)
+        else:
+            # Nested values (e.g. license, roles) as the CSV writer prints them
+            worksheet.write_string(r, c, str(value))
+
+    def parse_date(self, value):
+        # (datetime, cell format) for date strings, otherwise None
+        date_match = self.date_pattern.match(value)
+        if date_match is None:
+            return
+
+        try:
+            if date_match.group(4) is None:
+                return datetime.datetime(*[int(part) for part in date_match.groups()[:3]]), self.date_format
+            return datetime.datetime(*[int(part) for part in date_match.groups()]), self.datetime_format
+        except ValueError:
+            return
+
+    def close(self):
+        self.workbook.close()
+
+
+class ReportStore(object):
+    # Columns stored in each report table besides the report's own, e.g. the dataset id that a dataset row's 'id' (the version id) hides
+    extra_columns = {'datasets': ['datasetId']}
+
+    # Columns indexed in each report table, besides account
+    indexes = {'dataverses': ['alias'], 'datasets': ['datasetId', 'dataverse'], 'users': ['email']}
+
+    def __init__(self, output_file_path=None, batch_size=1000):
+        self.output_file_path = output_file_path
+        self.batch_size = max(int(batch_size), 1)
+
+        # Account workers may write to the same file, so wait for their batches instead of failing
+        self.conn = sqlite3.connect(output_file_path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS reports (account TEXT, report TEXT, rows INTEGER, created TEXT, PRIMARY KEY (account, report))")
+        self.conn.commit()
+
+    def add_report(self, name=None, account=None, headers=[]):
+        # Replaces the account's rows of the report table with the rows written to the returned table
+        self.create_table(name, headers)
+        self.conn.execute("DELETE FROM " + self.quote(name) + " WHERE account = ?", [account])
+        self.conn.commit()
+        return ReportStoreTable(report_store=self, name=name, account=account, headers=headers)
+
+    def create_table(self, name, headers):
+        # Columns are left untyped so each value keeps the type it has in the report
+        columns = ['account'] + self.get_columns(name, headers)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS " + self.quote(name) + " (" + ", ".join(self.quote(column) for column in columns) + ")")
+
+        # Reports with optional columns (e.g. dataset metrics) may add them to an existing table
+        existing_columns = set(row[1] for row in self.conn.execute("PRAGMA table_info(" + self.quote(name) + ")"))
+        for column in columns:
+            if column not in existing_columns:
+                try:
+                    self.conn.execute("ALTER TABLE " + self.quote(name) + " ADD COLUMN " + self.quote(column))
+                except sqlite3.OperationalError as e:
+                    # Another account worker may have added the column since the table was checked
+                    if 'duplicate column name' not in str(e):
+                        raise
+
+        for column in ['account'] + [column for column in self.indexes.get(name, []) if column in columns]:
+            self.conn.execute("CREATE INDEX IF NOT EXISTS " + self.quote(name + '_' + column) + " ON " + self.quote(name) + " (" + self.quote(column) + ")")
+        self.conn.commit()
+
+    def get_columns(self, name, headers):
+        return headers + [column for column in self.extra_columns.get(name, []) if column not in headers]
+
+    def insert_rows(self, name, account, columns, rows):
+        self.conn.executemany("INSERT INTO " + self.quote(name) + " (" + ", ".join(self.quote(column) for column in ['account'] + columns) + ") VALUES (" + ", ".join(['?'] * (len(columns) + 1)) + ")", rows)
+        self.conn.commit()
+
+    def save_report_count(self, name, account, count):
+        self.conn.execute("INSERT OR REPLACE INTO reports (account, report, rows, created) VALUES (?, ?, ?, ?)", [account, name, count, datetime.datetime.now().isoformat(timespec='seconds')])
+        self.conn.commit()
+
+    def quote(self, name):
+        return '"' + name.replace('"', '""') + '"'
+
+    def close(self):
+        self.conn.close()
+
+
+class ReportStoreTable(object):
+    def __init__(self, report_store=None, name=None, account=None, headers=[]):
+        self.report_store = report_store
+        self.name = name
+        self.account = account
+        self.columns = report_store.get_columns(name, headers)
+
+        # Rows are inserted report_store.batch_size at a time
+        self.rows = []
+        self.row_count = 0
+
+    def write_row(self, row):
+        self.rows.append([self.account] + [self.convert(row.get(column)) for column in self.columns])
+        if len(self.rows) >= self.report_store.batch_size:
+            self.flush()
+
+    def convert(self, value):
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        # Nested values (e.g. license, roles) as the CSV writer prints them
+        return str(value)
+
+    def flush(self):
+        if len(self.rows) == 0:
+            return
+
+        self.report_store.insert_rows(self.name, self.account, self.columns, self.rows)
+        self.row_count += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.report_store.save_report_count(self.name, self.account, self.row_count)
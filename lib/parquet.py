@@ -0,0 +1,119 @@
+import os
+import logging
+import pyarrow
+import pyarrow.parquet
+
+
+class ParquetTable(object):
+    def __init__(self, output_file_path=None, headers=[], compression='zstd', row_group_size=10000):
+        self.output_file_path = output_file_path
+        self.headers = headers
+        self.compression = compression
+        self.row_group_size = max(int(row_group_size), 1)
+
+        # Only the report columns of buffered rows are kept until the row group is written
+        self.rows = []
+        self.schema = None
+        self.writer = None
+        self.row_count = 0
+
+        self.logger = logging.getLogger('dataverse-reports')
+
+    def write_row(self, row):
+        self.rows.append([row.get(header) for header in self.headers])
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.rows) == 0:
+            return
+
+        # Column types are taken from the first row group; a later value that doesn't fit widens its column
+        if self.schema is None:
+            self.schema = pyarrow.schema([(header, self.infer_type([row[c] for row in self.rows])) for c, header in enumerate(self.headers)])
+            self.writer = pyarrow.parquet.ParquetWriter(self.output_file_path, self.schema, compression=self.compression)
+        else:
+            schema = pyarrow.schema([(field.name, self.widen_type(field.type, [row[c] for row in self.rows])) for c, field in enumerate(self.schema)])
+            if not schema.equals(self.schema):
+                self.widen(schema)
+
+        columns = []
+        for c, field in enumerate(self.schema):
+            columns.append(pyarrow.array([self.convert(row[c], field.type) for row in self.rows], type=field.type))
+
+        self.writer.write_table(pyarrow.Table.from_arrays(columns, schema=self.schema))
+        self.row_count += len(self.rows)
+        self.rows = []
+
+    def infer_type(self, values):
+        values = [value for value in values if value is not None]
+        if len(values) == 0:
+            return pyarrow.string()
+        if all(isinstance(value, bool) for value in values):
+            return pyarrow.bool_()
+        if any(isinstance(value, bool) for value in values):
+            return pyarrow.string()
+        if all(isinstance(value, int) for value in values):
+            return pyarrow.int64()
+        if all(isinstance(value, (int, float)) for value in values):
+            return pyarrow.float64()
+        return pyarrow.string()
+
+    def widen_type(self, column_type, values):
+        # Narrowest type that holds both the column's values and the new ones: integers widen to floats, anything else to strings
+        if all(self.fits(value, column_type) for value in values):
+            return column_type
+        if pyarrow.types.is_integer(column_type) and pyarrow.types.is_floating(self.infer_type(values)):
+            return pyarrow.float64()
+        return pyarrow.string()
+
+    def fits(self, value, column_type):
+        if value is None or pyarrow.types.is_string(column_type):
+            return True
+        if pyarrow.types.is_boolean(column_type):
+            return isinstance(value, bool)
+        if isinstance(value, bool):
+            return False
+        if pyarrow.types.is_integer(column_type):
+            return isinstance(value, int)
+        return isinstance(value, (int, float))
+
+    def widen(self, schema):
+        # Rewrite the row groups written so far with the wider column types, then keep writing with them
+        self.logger.info("Widening columns %s of %s.", ', '.join(field.name for field, old_field in zip(schema, self.schema) if not field.type.equals(old_field.type)), self.output_file_path)
+        self.writer.close()
+
+        written_file_path = self.output_file_path + '.tmp'
+        os.replace(self.output_file_path, written_file_path)
+        self.writer = pyarrow.parquet.ParquetWriter(self.output_file_path, schema, compression=self.compression)
+
+        written_file = pyarrow.parquet.ParquetFile(written_file_path)
+        for i in range(written_file.num_row_groups):
+            table = written_file.read_row_group(i)
+            columns = []
+            for column, field in zip(table.columns, schema):
+                columns.append(pyarrow.array([self.convert(value, field.type) for value in column.to_pylist()], type=field.type))
+            self.writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+        os.remove(written_file_path)
+
+        self.schema = schema
+
+    def convert(self, value, column_type):
+        if value is None:
+            return None
+        if pyarrow.types.is_string(column_type):
+            # Nested values (e.g. license, roles) as the CSV writer prints them
+            return value if isinstance(value, str) else str(value)
+        if pyarrow.types.is_floating(column_type):
+            return float(value)
+        return value
+
+    def close(self):
+        self.flush()
+
+        if self.writer is None:
+            # No rows, but the file still has the report's columns
+            self.schema = pyarrow.schema([(header, pyarrow.string()) for header in self.headers])
+            pyarrow.parquet.write_table(self.schema.empty_table(), self.output_file_path, compression=self.compression)
+        else:
+            self.writer.close()
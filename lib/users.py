@@ -0,0 +1,94 @@
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class UserDirectory(object):
+    def __init__(self, dataverse_api=None, workers=4):
+        if dataverse_api is None:
+            print('Dataverse API required to load users.')
+            return
+
+        self.dataverse_api = dataverse_api
+        self.workers = max(int(workers), 1)
+
+        # Loaded on first lookup and shared by every report in the process
+        self.users = None
+        self.users_by_email = {}
+        self.users_by_identifier = {}
+        self.lock = threading.Lock()
+
+        self.logger = logging.getLogger('dataverse-reports')
+
+    def load(self):
+        if self.users is not None:
+            return
+
+        with self.lock:
+            if self.users is not None:
+                return
+
+            users = self.load_all_users_list()
+
+            # Later duplicates win, like the old scan over the whole list
+            users_by_email = {}
+            users_by_identifier = {}
+            for user in users:
+                if 'email' in user:
+                    users_by_email[user['email'].casefold()] = user
+                if 'userIdentifier' in user:
+                    users_by_identifier[user['userIdentifier']] = user
+
+            self.users_by_email = users_by_email
+            self.users_by_identifier = users_by_identifier
+            self.users = users
+            self.logger.info("Indexed %s user emails and %s user identifiers.", str(len(users_by_email)), str(len(users_by_identifier)))
+
+    def load_all_users_list(self):
+        self.logger.info("Retrieving all Dataverse users...")
+
+        # The first page tells how many pages there are
+        users_list_response = self.dataverse_api.get_admin_list_users(page=1)
+        if users_list_response['status'] != 'OK':
+            self.logger.warn("Unable to load users: " + str(users_list_response))
+            return []
+
+        users_list_data = users_list_response['data']
+        users_count = users_list_data['userCount']
+        total_pages = users_list_data['pagination']['pageCount']
+
+        # One slot per page, filled by up to self.workers concurrent requests
+        pages = [None] * max(total_pages, 1)
+        pages[0] = users_list_data['users']
+        if total_pages > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for page, users in zip(range(2, total_pages + 1), executor.map(self.load_users_page, range(2, total_pages + 1))):
+                    pages[page - 1] = users
+
+        all_users = [user for users in pages if users is not None for user in users]
+
+        self.logger.info("Loaded " + str(len(all_users)) + " users.")
+        if len(all_users) != users_count:
+            self.logger.warn("Unable to load all users: " + str(users_count))
+
+        return all_users
+
+    def load_users_page(self, page):
+        users_list_response = self.dataverse_api.get_admin_list_users(page=page)
+        if users_list_response['status'] == 'OK':
+            return users_list_response['data']['users']
+
+        self.logger.warn("Unable to load page %s of users.", str(page))
+
+    def get_users(self):
+        self.load()
+        return self.users
+
+    def find_user_email(self, email):
+        self.load()
+        return self.users_by_email.get(email.casefold(), {})
+
+    def find_user_identifier(self, identifier):
+        self.load()
+        return self.users_by_identifier.get(identifier, {})
@@ -0,0 +1,53 @@
+import json
+import logging
+
+
+class ReportVerifier(object):
+    def __init__(self, golden_file_path=None):
+        self.golden_file_path = golden_file_path
+
+        self.logger = logging.getLogger('dataverse-reports')
+
+    def save_golden_file(self, rows={}, fieldnames=[]):
+        # Store the report columns of each row, keyed by row id, as the expected output
+        golden = {key: self.select_fields(row, fieldnames) for key, row in rows.items()}
+        with open(self.golden_file_path, 'w', encoding='utf-8') as f:
+            json.dump(golden, f, default=str, indent=2, sort_keys=True)
+        self.logger.info("Saved %s golden rows to %s.", str(len(golden)), self.golden_file_path)
+
+    def compare_golden_file(self, rows={}, fieldnames=[]):
+        # Returns a list of (key, fieldname, expected, actual) for every difference from the golden file
+        with open(self.golden_file_path, 'r', encoding='utf-8') as f:
+            golden = json.load(f)
+
+        mismatches = []
+        for key, expected in golden.items():
+            if key not in rows:
+                mismatches.append((key, None, expected, None))
+                continue
+
+            actual = self.select_fields(rows[key], fieldnames)
+            for fieldname in fieldnames:
+                if expected.get(fieldname) != actual.get(fieldname):
+                    mismatches.append((key, fieldname, expected.get(fieldname), actual.get(fieldname)))
+
+        for key in rows:
+            if key not in golden:
+                mismatches.append((key, None, None, self.select_fields(rows[key], fieldnames)))
+
+        for key, fieldname, expected, actual in mismatches:
+            if fieldname is None:
+                self.logger.warning("Row %s differs from the golden file: expected %s, found %s.", key, str(expected), str(actual))
+            else:
+                self.logger.warning("Row %s column %s differs from the golden file: expected %s, found %s.", key, fieldname, str(expected), str(actual))
+
+        if len(mismatches) == 0:
+            self.logger.info("All %s rows match the golden file %s.", str(len(golden)), self.golden_file_path)
+        else:
+            self.logger.error("Found %s differences from the golden file %s.", str(len(mismatches)), self.golden_file_path)
+
+        return mismatches
+
+    def select_fields(self, row, fieldnames):
+        # Round-trip through JSON so rows compare the same way they are stored
+        return json.loads(json.dumps({fieldname: row[fieldname] for fieldname in fieldnames if fieldname in row}, default=str))
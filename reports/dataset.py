@@ -1,8 +1,15 @@
+import os
+import json
+import asyncio
 import logging
 import datetime
 
+from lib.crawler import DataverseCrawler
+from lib.metrics import DatasetMetricsFetcher
+from lib.verify import ReportVerifier
+
 class DatasetReports(object):
-    def __init__(self, dataverse_api=None, dataverse_database=None, config=None):
+    def __init__(self, dataverse_api=None, dataverse_database=None, config=None, crawler=None, metrics_fetcher=None):
         if dataverse_api is None:
             print('Dataverse API required to create dataset reports.')
             return
@@ -15,6 +22,7 @@ class DatasetReports(object):
 
         self.dataverse_api = dataverse_api
         self.dataverse_database = dataverse_database
+        self.crawler = crawler or DataverseCrawler(dataverse_api=dataverse_api)
 
         # Ensure trailing slash on work_dir
         if config['work_dir'][len(config['work_dir'])-1] != '/':
@@ -22,153 +30,500 @@ class DatasetReports(object):
 
         self.config = config
 
+        # Make Data Count metrics are fetched for a whole report at once, under a rate limit
+        self.metrics_fetcher = metrics_fetcher or DatasetMetricsFetcher(dataverse_api=dataverse_api, workers=config.get('dataset_metrics_workers', 10), requests_per_second=config.get('dataset_metrics_requests_per_second', 0))
+
+        # Download counts prefetched for each report
+        self.download_counts = {}
+
+        # Filled in per report when incremental_dataset_reports is enabled
+        self.previous_datasets = {}
+        self.dataset_versions = {}
+
+        # Filled in per report when dataset_metadata_source is 'database'
+        self.database_datasets = {}
+
+        # Open while an incremental report is being built
+        self.state_file = None
+        self.state_count = 0
+
         self.logger = logging.getLogger('dataverse-reports')
 
-    def report_datasets_recursive(self, dataverse_identifier):
+    def report_datasets_recursive(self, dataverse_identifier, nodes=None):
         # List of datasets
-        datasets = []
+        return list(self.iter_datasets(dataverse_identifier, nodes=nodes))
+
+    def iter_datasets(self, dataverse_identifier, nodes=None):
+        # Yield dataset rows in report order, building report_batch_size of them at a time so memory stays bounded
+        total_datasets = 0
 
         self.logger.info("Begin loading datasets for %s.", dataverse_identifier)
-        self.load_datasets_recursive(datasets, dataverse_identifier)
-        self.logger.info("Finished loading %s datasets for %s", str(len(datasets)), dataverse_identifier)
+        if nodes is None:
+            nodes = self.crawler.crawl(dataverse_identifier)
+        dvObjects = list(self.crawler.walk_datasets(nodes[0]))
+        self.load_download_counts(dvObjects)
+        self.load_previous_datasets(dataverse_identifier, dvObjects)
+        self.open_state_file(dataverse_identifier)
+        for batch in self.crawler.batches(dvObjects, batch_size=self.config.get('report_batch_size', 1000)):
+            self.load_database_datasets(batch)
+            results = self.crawler.map(self.load_dataset, batch)
+            self.load_dataset_metrics(batch, results)
+            self.save_previous_datasets(batch, results)
+            for dataset in results:
+                if dataset is not None:
+                    total_datasets += 1
+                    yield dataset
+        self.close_state_file(dataverse_identifier)
+        self.log_dataset_metrics_stats()
+        self.logger.info("Finished loading %s datasets for %s", str(total_datasets), dataverse_identifier)
+
+    async def report_datasets_async(self, dataverse_identifier, crawler, nodes=None):
+        # List of datasets
+        return [dataset async for dataset in self.iter_datasets_async(dataverse_identifier, crawler, nodes=nodes)]
 
-        return datasets
+    async def iter_datasets_async(self, dataverse_identifier, crawler, nodes=None):
+        # Same as iter_datasets, awaiting each batch on the event loop
+        total_datasets = 0
 
-    def load_datasets_recursive(self, datasets={}, dataverse_identifier=None):
-        if dataverse_identifier is None:
-            self.logger.error("Dataverse identifier is required.")
-            return
-
-        self.logger.info("Loading dataverse: %s.", dataverse_identifier)
+        self.logger.info("Begin loading datasets for %s.", dataverse_identifier)
+        if nodes is None:
+            nodes = await crawler.crawl(dataverse_identifier)
+        dvObjects = list(crawler.walk_datasets(nodes[0]))
+        self.load_download_counts(dvObjects)
+        self.load_previous_datasets(dataverse_identifier, dvObjects)
+        self.open_state_file(dataverse_identifier)
+        for batch in crawler.batches(dvObjects, batch_size=self.config.get('report_batch_size', 1000)):
+            self.load_database_datasets(batch)
+            results = await crawler.map(lambda node_dvObject: self.load_dataset_async(node_dvObject, crawler), batch)
+            await self.load_dataset_metrics_async(batch, results, crawler)
+            self.save_previous_datasets(batch, results)
+            for dataset in results:
+                if dataset is not None:
+                    total_datasets += 1
+                    yield dataset
+        self.close_state_file(dataverse_identifier)
+        self.log_dataset_metrics_stats()
+        self.logger.info("Finished loading %s datasets for %s", str(total_datasets), dataverse_identifier)
+
+    def load_dataset(self, node_dvObject):
+        node, dvObject = node_dvObject
+
+        # Reuse last run's row if the dataset hasn't changed, refreshing only the volatile columns
+        dataset = self.get_previous_dataset(dvObject['id'])
+        if dataset is not None:
+            self.logger.info("Dataset %s is unchanged since the last run.", str(dvObject['id']))
+            dataset.update(self.get_volatile_fields(node.identifier, dvObject['id'], dvObject['identifier']))
+            return dataset
+
+        # Build the row from the bulk database extract if one was loaded
+        dataset = self.get_database_dataset(dvObject['id'])
+        if dataset is not None:
+            dataset.update(self.get_volatile_fields(node.identifier, dvObject['id'], dvObject['identifier']))
+            return dataset
+
+        # Add dataset to this dataverse
+        self.logger.info("Adding dataset %s to dataverse %s.", str(dvObject['id']), str(node.identifier))
+        return self.add_dataset(node.identifier, dvObject['id'], dvObject['identifier'])
+
+    async def load_dataset_async(self, node_dvObject, crawler):
+        node, dvObject = node_dvObject
+
+        # Reuse last run's row if the dataset hasn't changed, refreshing only the volatile columns
+        dataset = self.get_previous_dataset(dvObject['id'])
+        if dataset is not None:
+            self.logger.info("Dataset %s is unchanged since the last run.", str(dvObject['id']))
+            dataset.update(await self.get_volatile_fields_async(node.identifier, dvObject['id'], dvObject['identifier'], crawler))
+            return dataset
+
+        # Build the row from the bulk database extract if one was loaded
+        dataset = self.get_database_dataset(dvObject['id'])
+        if dataset is not None:
+            dataset.update(await self.get_volatile_fields_async(node.identifier, dvObject['id'], dvObject['identifier'], crawler))
+            return dataset
+
+        # Add dataset to this dataverse
+        self.logger.info("Adding dataset %s to dataverse %s.", str(dvObject['id']), str(node.identifier))
+        return await self.add_dataset_async(node.identifier, dvObject['id'], dvObject['identifier'], crawler)
+
+    def add_dataset(self, dataverse_identifier, dataset_id, dataset_identifier):
+        # Load dataset
+        self.logger.info("Dataset id: %s", dataset_id)
+        self.logger.info("Dataset identifier: %s", dataset_identifier)
+        dataset = self.fetch_dataset(dataset_id)
+        if dataset is not None:
+            dataset.update(self.get_volatile_fields(dataverse_identifier, dataset_id, dataset_identifier))
+            return dataset
 
-        # Load dataverse
-        dataverse_response = self.dataverse_api.get_dataverse(identifier=dataverse_identifier)
-        response_json = dataverse_response.json()
+    def fetch_dataset(self, dataset_id):
+        # Flattened row of a dataset from the native API, without the volatile columns
+        dataset_response = self.dataverse_api.get_dataset(identifier=dataset_id)
+        response_json = dataset_response.json()
         if 'data' in response_json:
-            dataverse = response_json['data']
-
-            self.logger.info("Dataverse name: %s", dataverse['name'])
-
-            # Retrieve dvObjects for this dataverse
-            dataverse_contents = self.dataverse_api.get_dataverse_contents(identifier=dataverse_identifier)
-            self.logger.info('Total dvObjects in this dataverse: ' + str(len(dataverse_contents)))
-            for dvObject in dataverse_contents:
-                if dvObject['type'] == 'dataset':
-                    # Add dataset to this dataverse
-                    self.logger.info("Adding dataset %s to dataverse %s.", str(dvObject['id']), str(dataverse_identifier))
-                    self.add_dataset(datasets, dataverse_identifier, dvObject['id'], dvObject['identifier'])
-                if dvObject['type'] == 'dataverse':
-                    self.logger.info("Found new dataverse %s.", str(dvObject['id']))
-                    self.load_datasets_recursive(datasets, dvObject['id'])
+            dataset = response_json['data']
+            self.flatten_dataset(dataset)
+            self.add_files(dataset)
+
+            # The file list is summarized into the files columns, so don't keep it in the row
+            dataset.pop('files', None)
+            return dataset
         else:
-            self.logger.warn("Dataverse was empty.")
+            self.logger.warn("Dataset was empty.")
 
-    def add_dataset(self, datasets, dataverse_identifier, dataset_id, dataset_identifier):
-        # Load dataset
+    async def add_dataset_async(self, dataverse_identifier, dataset_id, dataset_identifier, crawler):
+        # Same as add_dataset, but awaits the dataset and its volatile fields concurrently
         self.logger.info("Dataset id: %s", dataset_id)
         self.logger.info("Dataset identifier: %s", dataset_identifier)
-        dataset_response = self.dataverse_api.get_dataset(identifier=dataset_id)
+        dataset_response, volatile_fields = await asyncio.gather(
+            crawler.dataverse_api.get_dataset(identifier=dataset_id),
+            self.get_volatile_fields_async(dataverse_identifier, dataset_id, dataset_identifier, crawler))
+
         response_json = dataset_response.json()
         if 'data' in response_json:
             dataset = response_json['data']
+            self.flatten_dataset(dataset)
+            self.add_files(dataset)
 
-            if 'latestVersion' in dataset:
-                latest_version = dataset['latestVersion']
-                metadata_blocks = latest_version['metadataBlocks']
-
-                # Flatten the latest_version information
-                for key, value in latest_version.items():
-                    if key != 'metadataBlocks':
-                        dataset[key] = value
-
-                    # Flatten the nested citation fields information
-                    citation = metadata_blocks['citation']
-                    fields = citation['fields']
-                    for item in fields:
-                        self.logger.debug("Looking at field: %s.", item['typeName'])
-                        valuesString = self.get_value_recursive('', item)
-                        if valuesString.endswith(' ; '):
-                            valuesString = valuesString[:-len(' ; ')]
-
-                        typeName = item['typeName']
-                        dataset[typeName] = valuesString
-
-                # Remove nested information
-                dataset.pop('latestVersion')
-
-            if (self.config['include_dataset_metrics']):
-                # Calculate previous month
-                last_month = self.get_last_month()
-
-                # Use Make Data Count endpoints to gather views and downloads statistics
-                dataset_metrics_options = ['viewsUnique', 'viewsMonth', 'viewsTotal', 'downloadsUnique', 'downloadsMonth', 'downloadsTotal']
-                for dataset_metrics_option in dataset_metrics_options:
-                    self.logger.debug("Calling endpoint for dataset metric: " + dataset_metrics_option)
-                    if dataset_metrics_option == 'viewsMonth':
-                        dataset_metrics_response = self.dataverse_api.get_dataset_metric(identifier=dataset_id,option='viewsTotal',doi=dataset_identifier,date=last_month)
-                    elif dataset_metrics_option == 'downloadsMonth':
-                        dataset_metrics_response = self.dataverse_api.get_dataset_metric(identifier=dataset_id,option='downloadsTotal',doi=dataset_identifier,date=last_month)
-                    else:
-                        dataset_metrics_response = self.dataverse_api.get_dataset_metric(identifier=dataset_id,option=dataset_metrics_option,doi=dataset_identifier)
-                        
-                    dataset_metrics_json = dataset_metrics_response.json()
-                    if dataset_metrics_json['status'] == 'OK':
-                        if dataset_metrics_option == 'viewsMonth':
-                            if 'viewsTotal' in dataset_metrics_json['data']:
-                                self.logger.info("MDC metric (" + dataset_metrics_option + "): " + str(dataset_metrics_json['data']['viewsTotal']))
-                                dataset[dataset_metrics_option] = dataset_metrics_json['data']['viewsTotal']
-                            else:
-                                self.logger.debug("Unable to find viewsTotal in response.")
-                        elif dataset_metrics_option == 'downloadsMonth':
-                            if 'downloadsTotal' in dataset_metrics_json['data']:
-                                self.logger.info("MDC metric (" + dataset_metrics_option + "): " + str(dataset_metrics_json['data']['downloadsTotal']))
-                                dataset[dataset_metrics_option] = dataset_metrics_json['data']['downloadsTotal']
-                            else:
-                                self.logger.debug("Unable to find downloadsTotal in response.")
-                        elif dataset_metrics_option in dataset_metrics_json['data']:
-                            self.logger.info("MDC metric (" + dataset_metrics_option + "): " + str(dataset_metrics_json['data'][dataset_metrics_option]))
-                            dataset[dataset_metrics_option] = dataset_metrics_json['data'][dataset_metrics_option]
-                        else:
-                            self.logger.error("Unable to find dataset metric in response.")
-                    else:
-                        self.logger.error("API call was unsuccessful.")
-                        self.logger.error(dataset_metrics_json)
-                        dataset[dataset_metrics_option] = 0
-
-            # Use dataverse_database to retrieve cumulative download count of file in this dataset
-            download_count = self.dataverse_database.get_download_count(dataset_id=dataset_id)
-            self.logger.info("Download count for dataset: %s", str(download_count))
-            dataset['downloadCount'] = download_count
-
-            if 'files' in dataset:
-                contentSize = 0
-                count_restricted = 0
-                files = dataset['files']
-                for file in files:
-                    if 'dataFile' in file:
-                        if file['restricted']:
-                            count_restricted += 1
-                        dataFile = file['dataFile']
-                        filesize = int(dataFile['filesize'])
-                        contentSize += filesize
-                self.logger.info('Totel size (bytes) of all files in this dataset: %s', str(contentSize))
-                # Convert to megabytes for reports
-                dataset['contentSize (MB)'] = (contentSize/1048576)
-
-                dataset['totalFiles'] = len(files)
-                dataset['totalRestrictedFiles'] = count_restricted
-
-            # Retrieve dataverse to get alias
-            dataverse_response = self.dataverse_api.get_dataverse(identifier=dataverse_identifier)
-            response_json = dataverse_response.json()
-            dataverse = response_json['data']
-
-            self.logger.info("Adding dataset to dataverse with alias: %s", str(dataverse['alias']))
-            dataset['dataverse'] = dataverse['alias']
-            datasets.append(dataset)
+            # The file list is summarized into the files columns, so don't keep it in the row
+            dataset.pop('files', None)
+            dataset.update(volatile_fields)
+            return dataset
         else:
             self.logger.warn("Dataset was empty.")
 
+    def get_volatile_fields(self, dataverse_identifier, dataset_id, dataset_identifier):
+        # Columns that change without a new dataset version: download count and dataverse alias (metrics are added per report)
+        fields = {}
+
+        # Cumulative download count of files in this dataset, prefetched from dataverse_database
+        download_count = self.get_download_count(dataset_id)
+        self.logger.info("Download count for dataset: %s", str(download_count))
+        fields['downloadCount'] = download_count
+
+        # Retrieve dataverse to get alias
+        dataverse_response = self.dataverse_api.get_dataverse(identifier=dataverse_identifier)
+        response_json = dataverse_response.json()
+        dataverse = response_json['data']
+
+        self.logger.info("Adding dataset to dataverse with alias: %s", str(dataverse['alias']))
+        fields['dataverse'] = dataverse['alias']
+        return fields
+
+    async def get_volatile_fields_async(self, dataverse_identifier, dataset_id, dataset_identifier, crawler):
+        # Same as get_volatile_fields, but awaits the dataverse
+        fields = {}
+
+        download_count = self.get_download_count(dataset_id)
+        self.logger.info("Download count for dataset: %s", str(download_count))
+        fields['downloadCount'] = download_count
+
+        dataverse_response = await crawler.dataverse_api.get_dataverse(identifier=dataverse_identifier)
+        dataverse = dataverse_response.json()['data']
+        self.logger.info("Adding dataset to dataverse with alias: %s", str(dataverse['alias']))
+        fields['dataverse'] = dataverse['alias']
+        return fields
+
+    def load_dataset_metrics(self, dvObjects, datasets):
+        # Use Make Data Count endpoints to gather views and downloads statistics of every dataset concurrently
+        if not self.config['include_dataset_metrics']:
+            return
+        if self.config.get('dataset_metrics_source') == 'database':
+            self.add_database_metrics(dvObjects, datasets)
+            return
+
+        requests, targets = self.get_dataset_metrics_requests(dvObjects, datasets)
+        self.logger.info("Fetching %s MDC metrics for %s datasets.", str(len(requests)), str(len(datasets)))
+        self.add_dataset_metrics(requests, targets, self.metrics_fetcher.fetch(requests))
+
+    async def load_dataset_metrics_async(self, dvObjects, datasets, crawler):
+        if not self.config['include_dataset_metrics']:
+            return
+        if self.config.get('dataset_metrics_source') == 'database':
+            self.add_database_metrics(dvObjects, datasets)
+            return
+
+        requests, targets = self.get_dataset_metrics_requests(dvObjects, datasets)
+        self.logger.info("Fetching %s MDC metrics for %s datasets.", str(len(requests)), str(len(datasets)))
+        self.add_dataset_metrics(requests, targets, await self.metrics_fetcher.fetch_async(crawler.dataverse_api, requests))
+
+    def add_database_metrics(self, dvObjects, datasets):
+        # Same columns as the Make Data Count endpoints, from one aggregate query over the datasetmetrics table
+        dataset_ids = [dvObject['id'] for (node, dvObject), dataset in zip(dvObjects, datasets) if dataset is not None]
+        dataset_metrics = self.dataverse_database.get_dataset_metrics(dataset_ids=dataset_ids, month=self.get_last_month())
+        self.logger.info("Loaded MDC metrics of %s datasets from the database.", str(len(dataset_metrics)))
+
+        for (node, dvObject), dataset in zip(dvObjects, datasets):
+            metrics = dataset_metrics.get(dvObject['id'])
+            if dataset is not None and metrics is not None:
+                for dataset_metrics_option, option, date in self.get_dataset_metrics_calls():
+                    values = metrics['month'] if date is not None else metrics['total']
+                    dataset[dataset_metrics_option] = values[option]
+
+    def get_dataset_metrics_requests(self, dvObjects, datasets):
+        # One (column, dataset_id, doi, option, date) request per metric of each dataset, and the row it belongs to
+        requests = []
+        targets = []
+        dataset_metrics_calls = self.get_dataset_metrics_calls()
+        for (node, dvObject), dataset in zip(dvObjects, datasets):
+            if dataset is not None:
+                for dataset_metrics_option, option, date in dataset_metrics_calls:
+                    requests.append((dataset_metrics_option, dvObject['id'], dvObject['identifier'], option, date))
+                    targets.append(dataset)
+
+        return requests, targets
+
+    def add_dataset_metrics(self, requests, targets, responses):
+        for (dataset_metrics_option, dataset_id, doi, option, date), dataset, dataset_metrics_json in zip(requests, targets, responses):
+            self.add_dataset_metric(dataset, dataset_metrics_option, dataset_metrics_json)
+
+    def log_dataset_metrics_stats(self):
+        if self.config['include_dataset_metrics'] and self.config.get('dataset_metrics_source') != 'database':
+            self.metrics_fetcher.log_stats()
+
+    def load_download_counts(self, dvObjects):
+        # One grouped query for the whole report instead of one per dataset
+        dataset_ids = [dvObject['id'] for node, dvObject in dvObjects]
+        self.download_counts = self.dataverse_database.get_download_counts(dataset_ids=dataset_ids)
+        self.logger.info("Loaded download counts for %s datasets.", str(len(self.download_counts)))
+
+    def get_download_count(self, dataset_id):
+        if dataset_id in self.download_counts:
+            return self.download_counts[dataset_id]
+
+        # Not part of the prefetched report (e.g. add_dataset called directly)
+        return self.dataverse_database.get_download_count(dataset_id=dataset_id)
+
+    def load_previous_datasets(self, dataverse_identifier, dvObjects):
+        # Rows from the last run for datasets whose latest version hasn't changed since
+        self.previous_datasets = {}
+        self.dataset_versions = {}
+        if not self.config.get('incremental_dataset_reports'):
+            return
+
+        dataset_ids = [dvObject['id'] for node, dvObject in dvObjects]
+        self.dataset_versions = self.dataverse_database.get_dataset_versions(dataset_ids=dataset_ids)
+
+        state_file_path = self.get_state_file_path(dataverse_identifier)
+        if not os.path.isfile(state_file_path):
+            self.logger.info("No previous dataset report found for %s.", dataverse_identifier)
+            return
+
+        with open(state_file_path, 'r', encoding='utf-8') as f:
+            previous_state = json.load(f)
+
+        for dataset_id, version in self.dataset_versions.items():
+            previous = previous_state.get(str(dataset_id))
+            if previous is not None and previous['lastUpdateTime'] == version['lastUpdateTime'] and previous['versionState'] == version['versionState']:
+                self.previous_datasets[dataset_id] = previous['row']
+
+        self.logger.info("Reusing %s of %s datasets from the previous report for %s.", str(len(self.previous_datasets)), str(len(dataset_ids)), dataverse_identifier)
+
+    def get_previous_dataset(self, dataset_id):
+        if dataset_id in self.previous_datasets:
+            return dict(self.previous_datasets[dataset_id])
+
+    def open_state_file(self, dataverse_identifier):
+        # Rows are written as they are built, to a temporary file that replaces the state once the report is complete
+        self.state_file = None
+        self.state_count = 0
+        if not self.config.get('incremental_dataset_reports'):
+            return
+
+        self.state_file = open(self.get_state_file_path(dataverse_identifier) + '.tmp', 'w', encoding='utf-8')
+        self.state_file.write('{')
+
+    def save_previous_datasets(self, dvObjects, datasets):
+        if self.state_file is None:
+            return
+
+        # The file list has already been summarized into the files columns, and the volatile columns are refreshed on reuse
+        # Leaving them out means a metric the next run doesn't report stays empty instead of showing this run's value
+        excluded_columns = set(['files', 'downloadCount', 'dataverse'] + [dataset_metrics_option for dataset_metrics_option, option, date in self.get_dataset_metrics_calls()])
+
+        # Key rows by the dvObject id; a row's own 'id' is overwritten by the flattened latestVersion
+        for (node, dvObject), dataset in zip(dvObjects, datasets):
+            version = self.dataset_versions.get(dvObject['id'])
+            if dataset is not None and version is not None:
+                row = {key: value for key, value in dataset.items() if key not in excluded_columns}
+                if self.state_count > 0:
+                    self.state_file.write(', ')
+                self.state_file.write(json.dumps(str(dvObject['id'])) + ': ' + json.dumps({'lastUpdateTime': version['lastUpdateTime'], 'versionState': version['versionState'], 'row': row}, default=str))
+                self.state_count += 1
+
+    def close_state_file(self, dataverse_identifier):
+        if self.state_file is None:
+            return
+
+        self.state_file.write('}')
+        self.state_file.close()
+        self.state_file = None
+
+        state_file_path = self.get_state_file_path(dataverse_identifier)
+        os.replace(state_file_path + '.tmp', state_file_path)
+        self.logger.info("Saved %s dataset rows for the next incremental report to %s.", str(self.state_count), state_file_path)
+
+    def get_state_file_path(self, dataverse_identifier):
+        return self.config['work_dir'] + str(dataverse_identifier) + '-datasets-state.json'
+
+    def load_database_datasets(self, dvObjects):
+        # Citation metadata of every dataset not reused from the last run, from a few set-based queries
+        self.database_datasets = {}
+        if self.config.get('dataset_metadata_source') != 'database':
+            return
+
+        dataset_ids = [dvObject['id'] for node, dvObject in dvObjects if dvObject['id'] not in self.previous_datasets]
+        self.database_datasets = self.dataverse_database.get_dataset_metadata(dataset_ids=dataset_ids)
+        self.logger.info("Loaded metadata of %s datasets from the database.", str(len(self.database_datasets)))
+
+    def get_database_dataset(self, dataset_id):
+        # Each row is built once, so release its extract as it is used
+        dataset = self.database_datasets.pop(dataset_id, None)
+        if dataset is not None:
+            self.build_database_dataset(dataset)
+            return dataset
+
+    def build_database_dataset(self, dataset):
+        # Flatten exactly like an API response, taking the files columns from the extract's aggregates
+        file_summary = dataset.pop('fileSummary')
+        self.flatten_dataset(dataset)
+        self.set_files_columns(dataset, file_summary['contentSize'], file_summary['totalFiles'], file_summary['totalRestrictedFiles'])
+
+    def verify_dataset_metadata(self, dataverse_identifier, fieldnames=[], nodes=None, sample_size=100):
+        # Compare database rows against a golden file of API rows for a sample of the tree's datasets
+        if nodes is None:
+            nodes = self.crawler.crawl(dataverse_identifier)
+        dvObjects = list(self.crawler.walk_datasets(nodes[0]))
+        dataset_ids = [dvObject['id'] for node, dvObject in self.get_sample(dvObjects, sample_size)]
+        self.logger.info("Verifying database metadata of %s of %s datasets for %s.", str(len(dataset_ids)), str(len(dvObjects)), dataverse_identifier)
+
+        verifier = ReportVerifier(golden_file_path=self.config['work_dir'] + str(dataverse_identifier) + '-datasets-golden.json')
+
+        api_rows = {}
+        for dataset_id, dataset in zip(dataset_ids, self.crawler.map(self.fetch_dataset, dataset_ids)):
+            if dataset is not None:
+                api_rows[str(dataset_id)] = dataset
+        verifier.save_golden_file(rows=api_rows, fieldnames=fieldnames)
+
+        database_rows = {}
+        for dataset_id, dataset in self.dataverse_database.get_dataset_metadata(dataset_ids=dataset_ids).items():
+            self.build_database_dataset(dataset)
+            database_rows[str(dataset_id)] = dataset
+
+        return verifier.compare_golden_file(rows=database_rows, fieldnames=fieldnames)
+
+    def verify_dataset_metrics(self, dataverse_identifier, nodes=None, sample_size=100):
+        # Compare MDC metrics from the database against a golden file of API metrics for a sample of the tree's datasets
+        if nodes is None:
+            nodes = self.crawler.crawl(dataverse_identifier)
+        dvObjects = self.get_sample(list(self.crawler.walk_datasets(nodes[0])), sample_size)
+        self.logger.info("Verifying database MDC metrics of %s datasets for %s.", str(len(dvObjects)), dataverse_identifier)
+
+        verifier = ReportVerifier(golden_file_path=self.config['work_dir'] + str(dataverse_identifier) + '-metrics-golden.json')
+        fieldnames = [dataset_metrics_option for dataset_metrics_option, option, date in self.get_dataset_metrics_calls()]
+
+        api_rows = [{} for dvObject in dvObjects]
+        requests, targets = self.get_dataset_metrics_requests(dvObjects, api_rows)
+        self.add_dataset_metrics(requests, targets, self.metrics_fetcher.fetch(requests))
+        self.metrics_fetcher.log_stats()
+        verifier.save_golden_file(rows={str(dvObject['id']): row for (node, dvObject), row in zip(dvObjects, api_rows)}, fieldnames=fieldnames)
+
+        database_rows = [{} for dvObject in dvObjects]
+        self.add_database_metrics(dvObjects, database_rows)
+        return verifier.compare_golden_file(rows={str(dvObject['id']): row for (node, dvObject), row in zip(dvObjects, database_rows)}, fieldnames=fieldnames)
+
+    def get_sample(self, dvObjects, sample_size=100):
+        # Up to sample_size datasets spread evenly over the tree (all of them if sample_size is 0)
+        if sample_size <= 0:
+            return dvObjects
+
+        step = max(len(dvObjects) // sample_size, 1)
+        return dvObjects[::step][:sample_size]
+
+    def flatten_dataset(self, dataset):
+        if 'latestVersion' in dataset:
+            latest_version = dataset['latestVersion']
+
+            # The latest version's id replaces the dataset's, so keep the dataset id in its own column
+            dataset['datasetId'] = dataset.get('id')
+            metadata_blocks = latest_version['metadataBlocks']
+
+            # Flatten the latest_version information
+            for key, value in latest_version.items():
+                if key != 'metadataBlocks':
+                    dataset[key] = value
+
+                # Flatten the nested citation fields information
+                citation = metadata_blocks['citation']
+                fields = citation['fields']
+                for item in fields:
+                    self.logger.debug("Looking at field: %s.", item['typeName'])
+                    valuesString = self.get_value_recursive('', item)
+                    if valuesString.endswith(' ; '):
+                        valuesString = valuesString[:-len(' ; ')]
+
+                    typeName = item['typeName']
+                    dataset[typeName] = valuesString
+
+            # Remove nested information
+            dataset.pop('latestVersion')
+
+    def get_dataset_metrics_calls(self):
+        # Calculate previous month
+        last_month = self.get_last_month()
+
+        # Report column, Make Data Count option and month for each dataset metric
+        return [('viewsUnique', 'viewsUnique', None),
+                ('viewsMonth', 'viewsTotal', last_month),
+                ('viewsTotal', 'viewsTotal', None),
+                ('downloadsUnique', 'downloadsUnique', None),
+                ('downloadsMonth', 'downloadsTotal', last_month),
+                ('downloadsTotal', 'downloadsTotal', None)]
+
+    def add_dataset_metric(self, dataset, dataset_metrics_option, dataset_metrics_json):
+        if dataset_metrics_json['status'] == 'OK':
+            if dataset_metrics_option == 'viewsMonth':
+                if 'viewsTotal' in dataset_metrics_json['data']:
+                    self.logger.info("MDC metric (" + dataset_metrics_option + "): " + str(dataset_metrics_json['data']['viewsTotal']))
+                    dataset[dataset_metrics_option] = dataset_metrics_json['data']['viewsTotal']
+                else:
+                    self.logger.debug("Unable to find viewsTotal in response.")
+            elif dataset_metrics_option == 'downloadsMonth':
+                if 'downloadsTotal' in dataset_metrics_json['data']:
+                    self.logger.info("MDC metric (" + dataset_metrics_option + "): " + str(dataset_metrics_json['data']['downloadsTotal']))
+                    dataset[dataset_metrics_option] = dataset_metrics_json['data']['downloadsTotal']
+                else:
+                    self.logger.debug("Unable to find downloadsTotal in response.")
+            elif dataset_metrics_option in dataset_metrics_json['data']:
+                self.logger.info("MDC metric (" + dataset_metrics_option + "): " + str(dataset_metrics_json['data'][dataset_metrics_option]))
+                dataset[dataset_metrics_option] = dataset_metrics_json['data'][dataset_metrics_option]
+            else:
+                self.logger.error("Unable to find dataset metric in response.")
+        else:
+            self.logger.error("API call was unsuccessful.")
+            self.logger.error(dataset_metrics_json)
+            dataset[dataset_metrics_option] = 0
+
+    def add_files(self, dataset):
+        if 'files' in dataset:
+            contentSize = 0
+            count_restricted = 0
+            files = dataset['files']
+            for file in files:
+                if 'dataFile' in file:
+                    if file['restricted']:
+                        count_restricted += 1
+                    dataFile = file['dataFile']
+                    filesize = int(dataFile['filesize'])
+                    contentSize += filesize
+            self.set_files_columns(dataset, contentSize, len(files), count_restricted)
+
+    def set_files_columns(self, dataset, contentSize, totalFiles, totalRestrictedFiles):
+        self.logger.info('Totel size (bytes) of all files in this dataset: %s', str(contentSize))
+        # Convert to megabytes for reports
+        dataset['contentSize (MB)'] = (contentSize/1048576)
+
+        dataset['totalFiles'] = totalFiles
+        dataset['totalRestrictedFiles'] = totalRestrictedFiles
+
     def get_value_recursive(self, valuesString, field):
         if not field['multiple']:
             if field['typeClass'] == 'primitive':
@@ -1,11 +1,14 @@
 import re
+import asyncio
 import logging
 
-from .user import UserReports
+from lib.crawler import DataverseCrawler
+from lib.users import UserDirectory
+from lib.verify import ReportVerifier
 
 
 class DataverseReports(object):
-    def __init__(self, dataverse_api=None, config=None):
+    def __init__(self, dataverse_api=None, config=None, crawler=None, user_directory=None, dataverse_database=None):
         if dataverse_api is None:
             print('Dataverse API required to create dataverse reports.')
             return
@@ -16,139 +19,253 @@ class DataverseReports(object):
 
         self.dataverse_api = dataverse_api
         self.config = config
+        self.crawler = crawler or DataverseCrawler(dataverse_api=dataverse_api)
         self.dataverse_size_pattern = re.compile('dataverse:\s(.*)\sbyte')
+
+        # Sizes are rolled up from file sizes in the database if dataverse_size_source is 'database', otherwise they come from the storagesize endpoint
+        self.dataverse_database = dataverse_database
+        self.dataverse_sizes = {}
+
+        # Release status of every dataverse in a report, resolved in bulk if release_status_source is 'database'
+        self.release_statuses = {}
         self.logger = logging.getLogger('dataverse-reports')
 
-        # Create UserReports object to retrieve user metadata
-        self.user_reports = UserReports(dataverse_api=dataverse_api, config=config)
+        # Share the process-wide user directory to resolve contacts
+        self.user_directory = user_directory or UserDirectory(dataverse_api=dataverse_api)
 
         # Ensure trailing slash on work_dir
         if config['work_dir'][len(config['work_dir'])-1] != '/':
             config['work_dir'] = config['work_dir'] + '/'
 
-        # Load namespaces for Sword API
-        self.ns = {'atom': 'http://www.w3.org/2005/Atom',
-                    'sword': 'http://purl.org/net/sword/terms/state'}
+    def report_dataverses_recursive(self, dataverse_identifier, nodes=None):
+        # List of dataverses
+        return list(self.iter_dataverses(dataverse_identifier, nodes=nodes))
+
+    def iter_dataverses(self, dataverse_identifier, nodes=None):
+        # Crawl the dataverse tree unless it was already crawled, then load dataverses a batch at a time on the worker pool
+        if nodes is None:
+            nodes = self.crawler.crawl(dataverse_identifier)
+        self.load_dataverse_sizes(nodes)
+        self.load_release_statuses(nodes)
+        for batch in self.crawler.batches(nodes, batch_size=self.config.get('report_batch_size', 1000)):
+            for dataverse in self.crawler.map(self.load_dataverse, batch):
+                if dataverse is not None:
+                    yield dataverse
 
-    def report_dataverses_recursive(self, dataverse_identifier):
+    async def report_dataverses_async(self, dataverse_identifier, crawler, nodes=None):
         # List of dataverses
-        dataverses = []
+        return [dataverse async for dataverse in self.iter_dataverses_async(dataverse_identifier, crawler, nodes=nodes)]
 
-        # Load dataverses
-        self.load_dataverses_recursive(dataverses, dataverse_identifier)
+    async def iter_dataverses_async(self, dataverse_identifier, crawler, nodes=None):
+        # Crawl the dataverse tree unless it was already crawled, then await a batch of dataverses at once
+        if nodes is None:
+            nodes = await crawler.crawl(dataverse_identifier)
+        self.load_dataverse_sizes(nodes)
+        self.load_release_statuses(nodes)
+        for batch in crawler.batches(nodes, batch_size=self.config.get('report_batch_size', 1000)):
+            for dataverse in await crawler.map(lambda node: self.load_dataverse_async(node, crawler), batch):
+                if dataverse is not None:
+                    yield dataverse
 
-        return dataverses
+    def load_dataverse(self, node):
+        # Load dataverse
+        self.logger.info('Adding dataverse to report: %s', node.identifier)
+        if node.dataverse is None:
+            self.logger.warn("Dataverse was empty.")
+            return
+
+        # Add the data (file) size of the dataverse and all its sub-dataverses
+        size_bytes = self.dataverse_sizes.get(node)
+        if size_bytes is None:
+            dataverse_size_response = self.dataverse_api.get_dataverse_size(identifier=node.identifier, includeCached=True)
+            size_bytes = self.get_size_bytes(dataverse_size_response)
+
+        # Fall back to the 'dataverseHasBeenReleased' field from the Sword API
+        released = self.get_release_status(node)
+        if released is None and 'alias' in node.dataverse:
+            released = self.parse_sword_released(self.dataverse_api.sword_get_dataverse_released(node.dataverse['alias']))
 
-    def load_dataverses_recursive(self, dataverses=[], dataverse_identifier=None):
-        if dataverse_identifier is None:
+        return self.build_dataverse(node, size_bytes, released)
+
+    async def load_dataverse_async(self, node, crawler):
+        # Same as load_dataverse, but awaits the storage size and SWORD calls concurrently
+        self.logger.info('Adding dataverse to report: %s', node.identifier)
+        if node.dataverse is None:
+            self.logger.warn("Dataverse was empty.")
             return
 
-        # Add Dataverse to list
-        self.logger.info('Adding dataverse to report: %s', dataverse_identifier)
-        self.load_dataverse(dataverses, dataverse_identifier)
+        size_bytes = self.dataverse_sizes.get(node)
+        released = self.get_release_status(node)
+        calls = []
+        if size_bytes is None:
+            calls.append(crawler.dataverse_api.get_dataverse_size(identifier=node.identifier, includeCached=True))
+        if released is None and 'alias' in node.dataverse:
+            calls.append(crawler.dataverse_api.sword_get_dataverse_released(node.dataverse['alias']))
+        responses = list(await asyncio.gather(*calls))
 
-        # Load child objects
-        dataverse_contents = self.dataverse_api.get_dataverse_contents(identifier=dataverse_identifier)
-        for dvObject in dataverse_contents:
-            if dvObject['type'] == 'dataverse':
-                self.load_dataverses_recursive(dataverses, dvObject['id'])
+        if size_bytes is None:
+            size_bytes = self.get_size_bytes(responses.pop(0))
+        if len(responses) > 0:
+            released = self.parse_sword_released(responses[0])
 
-    def load_dataverse(self, dataverses, dataverse_identifier):
-        # Load dataverse
-        self.logger.info("Dataverse identifier: %s", dataverse_identifier)
-        dataverse_response = self.dataverse_api.get_dataverse(identifier=dataverse_identifier)
-        response_json = dataverse_response.json()
-        if 'data' in response_json:
-            dataverse = response_json['data']            
-
-            self.logger.info("Dataverse name: %s", dataverse['name'])
-
-            # Flatten the nested contact information
-            if 'dataverseContacts' in dataverse:
-                dataverseContacts = dataverse['dataverseContacts']
-                if len(dataverseContacts) > 0:
-                    self.logger.debug("The dataverseContacts list contains " + str(len(dataverseContacts)) + " contacts.")
-                    dataverseContact = dataverseContacts[0]
-                    if 'contactEmail' in dataverseContact:
-                        contactEmail = dataverseContact['contactEmail'].strip()
-                        self.logger.debug("Found email of dataverse contact: %s", str(contactEmail))
-                        user = self.user_reports.find_user_email(contactEmail)
-                        if bool(user):
-                            self.logger.debug("Adding contact information: %s", user)
-                            if 'userIdentifier' in user:
-                                dataverse['contactIdentifier'] = user['userIdentifier']
-                            if 'firstName' in user:
-                                dataverse['contactFirstName'] = user['firstName']
-                            if 'lastName' in user:
-                                dataverse['contactLastName'] = user['lastName']
-                            if 'email' in user:
-                                dataverse['contactEmail'] = user['email']
-                            if 'affiliation' in user:
-                                dataverse['contactAffiliation'] = user['affiliation']
-                            if 'roles' in user:
-                                dataverse['contactRoles'] = user['roles']
-                        else:
-                            self.logger.warn("Unable to find user from dataverseContact email: " + contactEmail)
-                            dataverse['contactEmail'] = contactEmail
+        return self.build_dataverse(node, size_bytes, released)
+
+    def build_dataverse(self, node, size_bytes, released):
+        # Copy so the crawled tree is left untouched
+        dataverse = dict(node.dataverse)
+        self.logger.info("Dataverse name: %s", dataverse['name'])
+
+        # Flatten the nested contact information
+        if 'dataverseContacts' in dataverse:
+            dataverseContacts = dataverse['dataverseContacts']
+            if len(dataverseContacts) > 0:
+                self.logger.debug("The dataverseContacts list contains " + str(len(dataverseContacts)) + " contacts.")
+                dataverseContact = dataverseContacts[0]
+                if 'contactEmail' in dataverseContact:
+                    contactEmail = dataverseContact['contactEmail'].strip()
+                    self.logger.debug("Found email of dataverse contact: %s", str(contactEmail))
+                    user = self.user_directory.find_user_email(contactEmail)
+                    if bool(user):
+                        self.logger.debug("Adding contact information: %s", user)
+                        if 'userIdentifier' in user:
+                            dataverse['contactIdentifier'] = user['userIdentifier']
+                        if 'firstName' in user:
+                            dataverse['contactFirstName'] = user['firstName']
+                        if 'lastName' in user:
+                            dataverse['contactLastName'] = user['lastName']
+                        if 'email' in user:
+                            dataverse['contactEmail'] = user['email']
+                        if 'affiliation' in user:
+                            dataverse['contactAffiliation'] = user['affiliation']
+                        if 'roles' in user:
+                            dataverse['contactRoles'] = user['roles']
                     else:
-                        self.logger.warn("First dataverseContact doesn't have an email.")
+                        self.logger.warn("Unable to find user from dataverseContact email: " + contactEmail)
+                        dataverse['contactEmail'] = contactEmail
                 else:
-                    self.logger.warn("List of dataverseContacts is empty.")
-            elif 'creator' in dataverse:        # Legacy field in older Dataverse versions
-                self.logger.debug("Replacing creator array.")
-                creator = dataverse['creator']
-                if 'identifier' in creator:
-                    dataverse['contactIdentifier'] = creator['identifier']
-                if 'displayName' in creator:
-                    dataverse['contactName'] = creator['displayName']
-                if 'email' in creator:
-                    dataverse['contactEmail'] = creator['email']
-                if 'affiliation' in creator:
-                    dataverse['contactAffiliation'] = creator['affiliation']
-                if 'position' in creator:
-                    dataverse['contactPosition'] = creator['position']
-                dataverse.pop('creator')
+                    self.logger.warn("First dataverseContact doesn't have an email.")
             else:
-                self.logger.warn("Unable to find dataverse contact information.")
-
-            # Add the data (file) size of the dataverse and all its sub-dataverses
-            dataverse_size_response = self.dataverse_api.get_dataverse_size(identifier=dataverse_identifier, includeCached=True)
-            response_size_json = dataverse_size_response.json()
-            if response_size_json['status'] == 'OK' and 'data' in response_size_json:
-                dataverse_size = response_size_json['data']
-                if 'message' in dataverse_size:
-                    size_message = dataverse_size['message']
-                    self.logger.debug("The message element from storagesize endpoint: " + size_message)
-                    size_bytes_match = re.search(self.dataverse_size_pattern, size_message)
-                    if size_bytes_match is not None:
-                        size_bytes_string = size_bytes_match.group(1)
-                        size_bytes = int(size_bytes_string.replace(',',''))
-                        dataverse['contentSize (MB)'] = (size_bytes/1048576)
-                    else:
-                        self.logger.warning("Unable to find the bytes value in the message.")
-                else:
-                    self.logger.warning("No message element in response from storagesize endpoint.")
-
-            # Add the 'dataverseHasBeenReleased' field from the Sword API
-            if 'alias' in dataverse:
-                sword_dataverse = self.dataverse_api.sword_get_dataverse(dataverse['alias'])
-                dataverse_has_been_released = sword_dataverse.find('sword:dataverseHasBeenReleased', self.ns)
-                if dataverse_has_been_released is not None:
-                    if dataverse_has_been_released.text == 'true':
-                        self.logger.debug("Element 'dataverseHasBeenReleased' is true.")
-                        dataverse['released'] = 'Yes'
-                    else:
-                        self.logger.debug("Element 'dataverseHasBeenReleased' is false.")
-                        dataverse['released'] = 'No'
-                else:
-                    self.logger.debug("Element 'dataverseHasBeenReleased' is not present in XML.")
+                self.logger.warn("List of dataverseContacts is empty.")
+        elif 'creator' in dataverse:        # Legacy field in older Dataverse versions
+            self.logger.debug("Replacing creator array.")
+            creator = dataverse['creator']
+            if 'identifier' in creator:
+                dataverse['contactIdentifier'] = creator['identifier']
+            if 'displayName' in creator:
+                dataverse['contactName'] = creator['displayName']
+            if 'email' in creator:
+                dataverse['contactEmail'] = creator['email']
+            if 'affiliation' in creator:
+                dataverse['contactAffiliation'] = creator['affiliation']
+            if 'position' in creator:
+                dataverse['contactPosition'] = creator['position']
+            dataverse.pop('creator')
+        else:
+            self.logger.warn("Unable to find dataverse contact information.")
 
-            # Load datasets
-            #dataverse_contents = self.dataverse_api.get_dataverse_contents(identifier=dataverse_identifier)
-            #for dvObject in dataverse_contents:
-                #if dvObject['type'] == 'dataset':
-                    #self.load_dataset(dataverse, dvObject['id']) 
+        # Add the data (file) size of the dataverse and all its sub-dataverses
+        if size_bytes is not None:
+            dataverse['contentSize (MB)'] = (size_bytes/1048576)
 
-            dataverses.append(dataverse)
+        # Add the release status of the dataverse
+        if released is not None:
+            if released:
+                self.logger.debug("Dataverse has been released.")
+                dataverse['released'] = 'Yes'
+            else:
+                self.logger.debug("Dataverse has not been released.")
+                dataverse['released'] = 'No'
         else:
-            self.logger.warn("Dataverse was empty.")
+            self.logger.debug("Release status of dataverse is unknown.")
+
+        # Load datasets
+        #dataverse_contents = self.dataverse_api.get_dataverse_contents(identifier=dataverse_identifier)
+        #for dvObject in dataverse_contents:
+            #if dvObject['type'] == 'dataset':
+                #self.load_dataset(dataverse, dvObject['id']) 
+
+        return dataverse
+
+    def get_size_bytes(self, dataverse_size_response):
+        # Parse the size in bytes out of the storagesize endpoint's message
+        response_size_json = dataverse_size_response.json()
+        if response_size_json['status'] == 'OK' and 'data' in response_size_json:
+            dataverse_size = response_size_json['data']
+            if 'message' in dataverse_size:
+                size_message = dataverse_size['message']
+                self.logger.debug("The message element from storagesize endpoint: " + size_message)
+                size_bytes_match = re.search(self.dataverse_size_pattern, size_message)
+                if size_bytes_match is not None:
+                    size_bytes_string = size_bytes_match.group(1)
+                    return int(size_bytes_string.replace(',',''))
+                else:
+                    self.logger.warning("Unable to find the bytes value in the message.")
+            else:
+                self.logger.warning("No message element in response from storagesize endpoint.")
+
+    def load_dataverse_sizes(self, nodes):
+        self.dataverse_sizes = {}
+        if self.dataverse_database is None or self.config.get('dataverse_size_source', 'api') != 'database':
+            return
+
+        self.dataverse_sizes = self.get_dataverse_sizes(nodes)
+
+    def get_dataverse_sizes(self, nodes):
+        # Size of every dataverse from one query over its datasets' files, rolled up the tree in one pass: {node: size}
+        dataverse_sizes = {}
+        dataset_ids = [dvObject['id'] for node in nodes for dvObject in node.contents if dvObject['type'] == 'dataset']
+        dataset_sizes = self.dataverse_database.get_dataset_sizes(dataset_ids=dataset_ids)
+
+        # Nodes are in pre-order, so walking them backwards sizes children before their parents
+        for node in reversed(nodes):
+            size_bytes = sum(dataset_sizes.get(dvObject['id'], 0) for dvObject in node.contents if dvObject['type'] == 'dataset')
+            size_bytes += sum(dataverse_sizes.get(child, 0) for child in node.children)
+            dataverse_sizes[node] = size_bytes
+
+        self.logger.info("Rolled up sizes of %s dataverses from %s datasets.", str(len(dataverse_sizes)), str(len(dataset_ids)))
+        return dataverse_sizes
+
+    def load_release_statuses(self, nodes):
+        # Release status of every dataverse from the publication dates in dvobject, in one query
+        self.release_statuses = {}
+        if self.dataverse_database is None or self.config.get('release_status_source', 'api') != 'database':
+            return
+
+        nodes = [node for node in nodes if node.dataverse is not None and 'id' in node.dataverse]
+        statuses = self.dataverse_database.get_release_statuses(dvobject_ids=[node.dataverse['id'] for node in nodes])
+        for node in nodes:
+            if node.dataverse['id'] in statuses:
+                self.release_statuses[node] = statuses[node.dataverse['id']]
+        self.logger.info("Resolved release status of %s dataverses from the database.", str(len(self.release_statuses)))
+
+    def get_release_status(self, node):
+        # True/False, or None if the status must come from the Sword API
+        if node in self.release_statuses:
+            return self.release_statuses[node]
+
+        # Newer Dataverse versions include it in the native API's dataverse JSON
+        if 'isReleased' in node.dataverse:
+            return bool(node.dataverse['isReleased'])
+
+    def parse_sword_released(self, dataverse_has_been_released):
+        if dataverse_has_been_released is None:
+            self.logger.debug("Element 'dataverseHasBeenReleased' is not present in XML.")
+            return
+
+        return dataverse_has_been_released == 'true'
+
+    def verify_dataverse_sizes(self, dataverse_identifier, nodes=None):
+        # Compare rolled up sizes against a golden file of sizes from the storagesize endpoint
+        if nodes is None:
+            nodes = self.crawler.crawl(dataverse_identifier)
+        dataverse_sizes = self.get_dataverse_sizes(nodes)
+        self.logger.info("Verifying rolled up sizes of %s dataverses for %s.", str(len(nodes)), dataverse_identifier)
+
+        verifier = ReportVerifier(golden_file_path=self.config['work_dir'] + str(dataverse_identifier) + '-sizes-golden.json')
+        fieldnames = ['size']
+
+        # Cached auxiliary files are not in the database, so compare against the size without them
+        api_sizes = self.crawler.map(lambda node: self.get_size_bytes(self.dataverse_api.get_dataverse_size(identifier=node.identifier)), nodes)
+        verifier.save_golden_file(rows={str(node.identifier): {'size': size_bytes} for node, size_bytes in zip(nodes, api_sizes)}, fieldnames=fieldnames)
+
+        return verifier.compare_golden_file(rows={str(node.identifier): {'size': dataverse_sizes[node]} for node in nodes}, fieldnames=fieldnames)
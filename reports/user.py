@@ -1,8 +1,11 @@
 import logging
 
+from lib.crawler import DataverseCrawler
+from lib.users import UserDirectory
+
 
 class UserReports(object):
-    def __init__(self, dataverse_api=None, config=None):
+    def __init__(self, dataverse_api=None, config=None, crawler=None, user_directory=None):
         if dataverse_api is None:
             print('Dataverse API required to create user reports.')
             return
@@ -11,6 +14,7 @@ class UserReports(object):
             return
 
         self.dataverse_api = dataverse_api
+        self.crawler = crawler or DataverseCrawler(dataverse_api=dataverse_api)
 
         # Ensure trailing slash on work_dir
         if config['work_dir'][len(config['work_dir'])-1] != '/':
@@ -20,88 +24,46 @@ class UserReports(object):
 
         self.logger = logging.getLogger('dataverse-reports')
 
-        self.all_users = self.load_all_users_list()
-
-    def load_all_users_list(self):
-        # List of all users
-        all_users = []
-
-        self.logger.info("Retrieving all Dataverse users...")
-        current_page = 1
-        users_count = 0
-
-        while True:
-            users_list_response = self.dataverse_api.get_admin_list_users(page=current_page)
-            if users_list_response['status'] == 'OK':
-                users_list_data = users_list_response['data']
-                all_users = all_users + users_list_data['users']
-                users_count = users_list_data['userCount']
-                total_pages = users_list_data['pagination']['pageCount']
-                if current_page == total_pages:
-                    break
-                current_page += 1
-            else:
-                break
-        
-        self.logger.info("Loaded " + str(len(all_users)) + " users.")
-        if len(all_users) != users_count:
-            self.logger.warn("Unable to load all users: " + str(users_count))
-        
-        return all_users
+        # Users are loaded once and indexed by email, so contacts resolve with a lookup
+        self.user_directory = user_directory or UserDirectory(dataverse_api=dataverse_api)
 
     def find_user_email(self, email):
-        user = {}
-
-        email_lower = email.casefold()
-
-        for u in self.all_users:
-            if 'email' in u and email_lower == u['email'].casefold():
-                user = u
+        return self.user_directory.find_user_email(email)
 
-        return user
-
-    def report_users_recursive(self, dataverse_identifier):
+    def report_users_recursive(self, dataverse_identifier, nodes=None):
         # List of users
-        users = []
-
-        self.logger.info("Begin loading users for %s.", dataverse_identifier)
-        self.load_users_recursive(users, dataverse_identifier)
-        self.logger.info("Finished loading %s users for %s", str(len(users)), dataverse_identifier)
+        return list(self.iter_users(dataverse_identifier, nodes=nodes))
 
-        # Get unique list of users
-        users = list({v['id']:v for v in users}.values())
+    def iter_users(self, dataverse_identifier, nodes=None):
+        # Ids of users already yielded, to get a unique list of users
+        user_ids = set()
 
-        return users
-
-    def load_users_recursive(self, users={}, dataverse_identifier=None):
-        if dataverse_identifier is None:
-            self.logger.error("Dataverse identifier is required.")
-            return
-
-        self.logger.info("Loading dataverse: %s.", dataverse_identifier)
-
-        # Add user to list
-        self.logger.info('Adding contact of dataverse to report: %s', dataverse_identifier)
-        self.load_user_dataverse(users, dataverse_identifier)
-
-        # Retrieve dvObjects for this dataverse
-        dataverse_contents = self.dataverse_api.get_dataverse_contents(identifier=dataverse_identifier)
-        self.logger.info('Total dvObjects in this dataverse: ' + str(len(dataverse_contents)))
-        for dvObject in dataverse_contents:
-            if dvObject['type'] == 'dataverse':
-                # Continue down the dataverse tree
-                self.logger.info("Found new dataverse %s.", str(dvObject['id']))
-                self.load_users_recursive(users, dvObject['id'])
-
-    def load_user_dataverse(self, users, dataverse_identifier):
+        self.logger.info("Begin loading users for %s.", dataverse_identifier)
+        if nodes is None:
+            nodes = self.crawler.crawl(dataverse_identifier)
+        for batch in self.crawler.batches(nodes, batch_size=self.config.get('report_batch_size', 1000)):
+            for user in self.crawler.map(self.load_user_dataverse, batch):
+                # Add new user to users list if one was found
+                if user and user['id'] not in user_ids:
+                    user_ids.add(user['id'])
+                    yield user
+        self.logger.info("Finished loading %s users for %s", str(len(user_ids)), dataverse_identifier)
+
+    async def report_users_async(self, dataverse_identifier, crawler, nodes=None):
+        # Contacts come from the crawled dataverses, so only the crawl itself is awaited
+        if nodes is None:
+            nodes = await crawler.crawl(dataverse_identifier)
+
+        return self.report_users_recursive(dataverse_identifier, nodes=nodes)
+
+    def load_user_dataverse(self, node):
         # Vars
         new_user = {}
 
-        # Load dataverse
-        dataverse_response = self.dataverse_api.get_dataverse(identifier=dataverse_identifier)
-        response_json = dataverse_response.json()
-        if 'data' in response_json:
-            dataverse = response_json['data']
+        # Add user to list
+        self.logger.info('Adding contact of dataverse to report: %s', node.identifier)
+        if node.dataverse is not None:
+            dataverse = node.dataverse
             self.logger.info("Dataverse name: %s", dataverse['name'])
 
             # Add contact information
@@ -128,6 +90,4 @@ class UserReports(object):
         else:
             self.logger.warn("Dataverse was empty.")
 
-        # Add new user to users list if one was found
-        if new_user:
-            users.append(new_user)
\ No newline at end of file
+        return new_user
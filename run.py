@@ -1,27 +1,51 @@
 import os
 import sys
+import asyncio
 import yaml
 import logging
+import threading
+import multiprocessing
+import multiprocessing.util
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from optparse import OptionParser
 
 from lib.api import DataverseApi
+from lib.cache import ResponseCache
+from lib.crawler import DataverseCrawler, AsyncDataverseCrawler
 from lib.database import DataverseDatabase
 from lib.output import Output
 from lib.email import Email
+from lib.outbox import Outbox
+from lib.users import UserDirectory
 
 from reports.dataverse import DataverseReports
 from reports.dataset import DatasetReports
 from reports.user import UserReports
 
 
+# Report context of the account worker running in this thread or process
+account_worker = threading.local()
+
+# Report contexts opened by account worker threads, closed by the main process once the pool is done
+account_worker_contexts = []
+
+
 def main():
     parser = OptionParser()
 
     parser.add_option("-c", "--config", dest="config_file", default="config/application.yml", help="Configuration file")
     parser.add_option("-r", "--report(s)", dest="reports", default='all', help="Report type(s) to generate. Options = dataverse, dataset, user, all.")
-    parser.add_option("-g", "--group", dest="grouping", help="Grouping of results. Options = institutions, all")
+    parser.add_option("-g", "--group", dest="grouping", help="Grouping of results. Options = institutions, all, combined")
     parser.add_option("-o", "--output_dir", dest="output_dir", help="Directory for results files.")
     parser.add_option("-e", "--email", action="store_true", dest="email", default=False, help="Email reports to liaisons?")
+    parser.add_option("-w", "--workers", type="int", dest="workers", default=1, help="Number of concurrent API workers used to crawl dataverses.")
+    parser.add_option("-a", "--async", action="store_true", dest="use_async", default=False, help="Crawl dataverses with the asyncio API client instead of worker threads?")
+    parser.add_option("-p", "--account-workers", type="int", dest="account_workers", default=1, help="Number of accounts to generate reports for in parallel.")
+    parser.add_option("--account-pool", dest="account_pool", default='process', help="Pool that generates account reports in parallel. Options = process, thread.")
+    parser.add_option("-m", "--verify-metadata", action="store_true", dest="verify_metadata", default=False, help="Compare dataset metadata from the database against a golden file of API rows instead of creating reports?")
+    parser.add_option("--verify-metrics", action="store_true", dest="verify_metrics", default=False, help="Compare MDC metrics from the database against a golden file of API metrics instead of creating reports?")
+    parser.add_option("--verify-sizes", action="store_true", dest="verify_sizes", default=False, help="Compare dataverse sizes rolled up from the database against the storagesize endpoint instead of creating reports?")
 
     (options, args) = parser.parse_args()
 
@@ -30,14 +54,26 @@ def main():
         parser.print_help()
         parser.error("Must specify report type(s) from the following options: dataverse, dataset, user, or all.")
 
-    if options.grouping != 'all' and options.grouping != 'institutions':
+    if not options.verify_metadata and not options.verify_metrics and not options.verify_sizes and options.grouping != 'all' and options.grouping != 'institutions' and options.grouping != 'combined':
         parser.print_help()
-        parser.error("Must specify report grouping from the following options: all, institutions.")
+        parser.error("Must specify report grouping from the following options: all, institutions, combined.")
 
     if options.output_dir is None:
         parser.print_help()
         parser.error("Must specify an output directory.")
 
+    if options.workers < 1:
+        parser.print_help()
+        parser.error("Number of workers must be at least 1.")
+
+    if options.account_workers < 1:
+        parser.print_help()
+        parser.error("Number of account workers must be at least 1.")
+
+    if options.account_pool != 'process' and options.account_pool != 'thread':
+        parser.print_help()
+        parser.error("Must specify account pool from the following options: process, thread.")
+
     # Load config
     print("Loading configuration from file: %s", options.config_file)
     config = load_config(options.config_file)
@@ -61,18 +97,116 @@ def main():
     # Ensure output_dir exists
     ensure_directory_exists(output_dir, logger)
 
-    # Create Dataverse API object test the connection
-    dataverse_api = DataverseApi(host=config['dataverse_api_host'], token=config['dataverse_api_key'])
-    if dataverse_api.test_connection() is False:
-        logger.error("Cannot create reports because the connection to the Dataverse API failed.")
-        sys.exit(0)
+    # Report columns and the dataset columns compared when verifying the database extracts
+    fieldnames, verified_dataset_fieldnames = create_fieldnames(config=config)
 
-    # Create Dataverse database object and test the connection
-    dataverse_database = DataverseDatabase(host=config['dataverse_db_host'], database=config['dataverse_db_name'], username=config['dataverse_db_username'], password=config['dataverse_db_password'])
-    if dataverse_database.create_connection() is False:
-        logger.error("Cannot create reports because the connection to the Dataverse database failed.")
+    # Configured institutional accounts, in the order their reports are generated
+    accounts = []
+    if 'accounts' in config and config['accounts'] is not None and len(config['accounts']) > 0:
+        accounts = [config['accounts'][key] for key in config['accounts']]
+
+    # Account workers open their own connections, so the main process only needs them when it generates reports itself
+    context = None
+    if len(accounts) == 0 or options.account_workers == 1 or options.verify_metadata or options.verify_metrics or options.verify_sizes:
+        context = create_report_context(config=config, options=options, work_dir=work_dir)
+        if not context:
+            sys.exit(0)
+
+    # Queue emails in an outbox in work_dir for deliver.py instead of sending them during the run if configured
+    outbox = None
+    if options.email and config.get('email_outbox'):
+        outbox = Outbox(path=work_dir + 'dataverse-reports-outbox.sqlite')
+
+    # Create email object
+    email = Email(config=config, outbox=outbox)
+
+    # Verify the database extracts of dataset metadata, metrics or dataverse sizes against the API instead of creating reports
+    if options.verify_metadata or options.verify_metrics or options.verify_sizes:
+        dataverse_identifiers = ['root']
+        if len(accounts) > 0:
+            dataverse_identifiers = [account_info['identifier'] for account_info in accounts]
+
+        total_mismatches = 0
+        for dataverse_identifier in dataverse_identifiers:
+            nodes = context['crawler'].crawl(dataverse_identifier)
+            if options.verify_metadata:
+                mismatches = context['dataset_reports'].verify_dataset_metadata(dataverse_identifier, fieldnames=verified_dataset_fieldnames, nodes=nodes, sample_size=config.get('verify_sample_size', 100))
+                total_mismatches += len(mismatches)
+            if options.verify_metrics:
+                mismatches = context['dataset_reports'].verify_dataset_metrics(dataverse_identifier, nodes=nodes, sample_size=config.get('verify_sample_size', 100))
+                total_mismatches += len(mismatches)
+            if options.verify_sizes:
+                mismatches = context['dataverse_reports'].verify_dataverse_sizes(dataverse_identifier, nodes=nodes)
+                total_mismatches += len(mismatches)
+
+        close_report_context(context)
+        if total_mismatches > 0:
+            logger.error("Database extracts differ from the API in %s places.", str(total_mismatches))
+            sys.exit(1)
+        logger.info("Database extracts match the API.")
         sys.exit(0)
 
+    # Keep a CSV copy of each report in work_dir next to the Excel spreadsheet if configured
+    save_csv = config.get('save_csv_reports', True)
+
+    # Start reports
+    logger.info("Started creating reports...")
+    
+    # Check for any configured accounts
+    if len(accounts) > 0:
+        # Excel report of each account, yielded in account order as they are finished
+        account_reports = create_account_reports(accounts=accounts, options=options, config=config, context=context, work_dir=work_dir, output_dir=output_dir, fieldnames=fieldnames, save_csv=save_csv)
+
+        # Group reports by institution, all together, or both from the same reports
+        if options.grouping == 'all' or options.grouping == 'institutions' or options.grouping == 'combined':
+            # Store list of Excel report(s)
+            excel_reports = []
+
+            for account_info, excel_report_file in account_reports:
+                if not excel_report_file:
+                    continue
+
+                excel_reports.append(excel_report_file)
+                if options.email and options.grouping != 'all':
+                    logger.info("Sending email to institutional liaison with the report.")
+                    email.email_report_institution(report_file_paths=[excel_report_file], account_info=account_info)
+
+            # The admin bundle is the institutions' spreadsheets, so combined runs crawl each account only once
+            if options.email and options.grouping != 'institutions':
+                logger.info("Sending email to super admin with the report.")
+                email.email_report_admin(report_file_paths=excel_reports)
+        else:
+            logger.error("Unrecognized report grouping: %s.", options.grouping)
+    else:
+        # Start generating reports at the root dataverse 
+        logger.info('Generating reports from the root dataverse')
+        # Generate report(s) based on command line option straight into an Excel spreadsheet
+        output_file_path = output_dir +  'dataverse-reports.xlsx'
+        excel_report_file = create_excel_report(context=context, report_type=options.reports, dataverse_identifier='root', file_path_prefix=work_dir, output_file_path=output_file_path, fieldnames=fieldnames, save_csv=save_csv)
+
+        # Store list of Excel report(s)
+        excel_reports = []
+        if excel_report_file:
+            excel_reports.append(excel_report_file)
+
+        if options.email:
+            logger.info("Sending email to super admin with the report.")
+            email.email_report_admin(report_file_paths=excel_reports)
+
+
+    # Close the SMTP session shared by all emails and log send latency
+    email.close()
+    if outbox is not None:
+        logger.info("Queued emails in outbox %s for delivery by deliver.py.", outbox.path)
+        outbox.close()
+
+    # Close crawler workers and API connection pool and log connection reuse
+    if context:
+        close_report_context(context)
+
+    logger.info("Finished processing reports.")
+
+def create_fieldnames(config=None):
     # Dataverse fieldnames for CSV reports
     root_fieldnames = ['alias', 'name', 'id', 'affiliation', 'dataverseType', 'creationDate']
     contact_fieldnames = ['contactIdentifier', 'contactFirstName', 'contactLastName', 'contactEmail', 'contactAffiliation', 'contactRoles']
@@ -91,188 +225,232 @@ def main():
         dataset_metrics_fieldnames = ['viewsUnique', 'viewsMonth', 'viewsTotal','downloadsUnique', 'downloadsMonth', 'downloadsTotal']
     dataset_fieldnames = root_fieldnames + latest_fieldnames + metadata_fieldnames + database_fieldnames + files_fieldnames + dataset_metrics_fieldnames
 
+    # Dataset columns that come from the dataset's metadata rather than volatile sources
+    verified_dataset_fieldnames = root_fieldnames[1:] + latest_fieldnames + metadata_fieldnames + files_fieldnames
+
     # User fieldnames for CSV reports
     user_fieldnames = ['id', 'userIdentifier', 'firstName', 'lastName', 'email', 'affiliation', 'position', 'isSuperuser', 'roles', 'createdTime', 'lastLoginTime']
 
+    fieldnames = {'dataverse': dataverse_fieldnames, 'dataset': dataset_fieldnames, 'user': user_fieldnames}
+
+    return fieldnames, verified_dataset_fieldnames
+
+def create_report_context(config=None, options=None, work_dir=None, dataverse_database=None):
+    # Open the API and database connections and create the report objects that share them
+    # A dataverse_database object can be given in place of the configured database (e.g. by the benchmark)
+    logger = logging.getLogger('dataverse-reports')
+
+    # Create optional on-disk cache of API responses in work_dir
+    response_cache = None
+    if config.get('response_cache'):
+        response_cache = ResponseCache(path=work_dir + 'dataverse-api-cache.sqlite', ttls=config.get('response_cache_ttls') or {})
+
+    # Create Dataverse API object test the connection
+    dataverse_api = DataverseApi(host=config['dataverse_api_host'], token=config['dataverse_api_key'], pool_size=max(config.get('dataverse_api_pool_size', 10), options.workers, config.get('user_list_workers', 4), config.get('dataset_metrics_workers', 10)), connect_timeout=config.get('dataverse_api_connect_timeout', 10), read_timeout=config.get('dataverse_api_read_timeout', 300), cache_size=config.get('dataverse_api_cache_size', 1000), response_cache=response_cache)
+    if dataverse_api.test_connection() is False:
+        logger.error("Cannot create reports because the connection to the Dataverse API failed.")
+        return False
+
+    # Create Dataverse database object and test the connection
+    if dataverse_database is None:
+        dataverse_database = DataverseDatabase(host=config['dataverse_db_host'], database=config['dataverse_db_name'], username=config['dataverse_db_username'], password=config['dataverse_db_password'])
+    if dataverse_database.create_connection() is False:
+        logger.error("Cannot create reports because the connection to the Dataverse database failed.")
+        return False
+
+    # Create crawler shared by all reports to walk the dataverse tree
+    # Resolve the tree from the dvobject table instead of API discovery if configured
+    tree_database = None
+    if config.get('tree_source') == 'database':
+        logger.info("Resolving dataverse trees from the database.")
+        tree_database = dataverse_database
+
+    crawler = DataverseCrawler(dataverse_api=dataverse_api, workers=options.workers, dataverse_database=tree_database)
+
+    # Create asyncio API client and crawler on a dedicated event loop if requested
+    async_dataverse_api = None
+    async_crawler = None
+    loop = None
+    if options.use_async:
+        from lib.async_api import AsyncDataverseApi
+
+        loop = asyncio.new_event_loop()
+        async_dataverse_api = AsyncDataverseApi(host=config['dataverse_api_host'], token=config['dataverse_api_key'], max_requests=config.get('dataverse_api_max_requests', 100), connect_timeout=config.get('dataverse_api_connect_timeout', 10), read_timeout=config.get('dataverse_api_read_timeout', 300), cache_size=config.get('dataverse_api_cache_size', 1000))
+        loop.run_until_complete(async_dataverse_api.open())
+        async_crawler = AsyncDataverseCrawler(dataverse_api=async_dataverse_api, dataverse_database=tree_database)
+
+    # Create user directory shared by the dataverse and user reports; users are downloaded once on first use
+    user_directory = UserDirectory(dataverse_api=dataverse_api, workers=config.get('user_list_workers', 4))
+
     # Create dataverse reports object
-    dataverse_reports = DataverseReports(dataverse_api=dataverse_api, config=config)
+    dataverse_reports = DataverseReports(dataverse_api=dataverse_api, config=config, crawler=crawler, user_directory=user_directory, dataverse_database=dataverse_database)
 
     # Create datasets reports object
-    dataset_reports = DatasetReports(dataverse_api=dataverse_api, dataverse_database=dataverse_database, config=config)
+    dataset_reports = DatasetReports(dataverse_api=dataverse_api, dataverse_database=dataverse_database, config=config, crawler=crawler)
 
     # Create user reports object
-    user_reports = UserReports(dataverse_api=dataverse_api, config=config)
+    user_reports = UserReports(dataverse_api=dataverse_api, config=config, crawler=crawler, user_directory=user_directory)
 
     # Create output object
     output = Output(config=config)
 
-    # Create email object
-    email = Email(config=config)
+    # Create optional queryable store of report rows in work_dir
+    report_store = None
+    if config.get('report_store'):
+        report_store = output.create_report_store(output_file_path=work_dir + 'dataverse-reports.sqlite') or None
+
+    return {'dataverse_api': dataverse_api, 'dataverse_database': dataverse_database, 'crawler': crawler, 'async_dataverse_api': async_dataverse_api, 'async_crawler': async_crawler, 'loop': loop, 'dataverse_reports': dataverse_reports, 'dataset_reports': dataset_reports, 'user_reports': user_reports, 'output': output, 'report_store': report_store}
+
+def close_report_context(context=None):
+    # Close crawler workers and API connection pools and log connection reuse
+    context['crawler'].close()
+    context['dataverse_api'].close()
+    if context['loop'] is not None:
+        context['loop'].run_until_complete(context['async_dataverse_api'].close())
+        context['loop'].close()
+    if context['report_store'] is not None:
+        context['report_store'].close()
+
+def create_account_reports(accounts=[], options=None, config=None, context=None, work_dir=None, output_dir=None, fieldnames={}, save_csv=True):
+    # Yields (account_info, Excel report file) in account order; the file is False if the report could not be saved
+    logger = logging.getLogger('dataverse-reports')
 
-    # Start reports
-    logger.info("Started creating reports...")
-    
-    # Check for any configured accounts
-    if 'accounts' in config and config['accounts'] is not None and len(config['accounts']) > 0:
-        # Group reports by institution or all together
-        if options.grouping == 'all':
-            # Store list of Excel report(s)
-            excel_reports = []
+    if options.account_workers == 1:
+        for account_info in accounts:
+            yield account_info, create_account_report(context=context, account_info=account_info, report_type=options.reports, work_dir=work_dir, output_dir=output_dir, fieldnames=fieldnames, save_csv=save_csv)
+        return
 
-            for key in config['accounts']:
-                account_info = config['accounts'][key]
-                logger.info("Generating reports for %s.",  account_info['name'])
-
-                # Generate CSV report(s) based on command line option
-                csv_reports = []
-
-                if options.reports == 'dataverse':
-                    dv_report = dataverse_reports.report_dataverses_recursive(dataverse_identifier=account_info['identifier'])
-                    dv_report_file = output.save_report_csv_file(output_file_path=work_dir + account_info['identifier'] + '-dataverses.csv', headers=dataverse_fieldnames, data=dv_report)
-                    csv_reports.append(dv_report_file)
-                elif options.reports == 'dataset':
-                    ds_report = dataset_reports.report_datasets_recursive(dataverse_identifier=account_info['identifier'])
-                    # Only save report if there are datasets
-                    if ds_report is not None:
-                        ds_report_file = output.save_report_csv_file(output_file_path=work_dir + account_info['identifier'] + '-datasets.csv', headers=dataset_fieldnames, data=ds_report)
-                        csv_reports.append(ds_report_file)
-                elif options.reports == 'user':
-                    user_report = user_reports.report_users_recursive(dataverse_identifier=account_info['identifier'])
-                    # Only save report if there are users
-                    if user_report is not None:
-                        user_report_file = output.save_report_csv_file(output_file_path=work_dir + account_info['identifier'] + '-users.csv', headers=user_fieldnames, data=user_report)
-                        csv_reports.append(user_report_file)
-                else:   # Default option is all reports
-                    dv_report = dataverse_reports.report_dataverses_recursive(dataverse_identifier=account_info['identifier'])
-                    dv_report_file = output.save_report_csv_file(output_file_path=work_dir + account_info['identifier'] + '-dataverses.csv', headers=dataverse_fieldnames, data=dv_report)
-                    csv_reports.append(dv_report_file)
-
-                    ds_report = dataset_reports.report_datasets_recursive(dataverse_identifier=account_info['identifier'])
-                    ds_report_file = output.save_report_csv_file(output_file_path=work_dir + account_info['identifier'] + '-datasets.csv', headers=dataset_fieldnames, data=ds_report)
-                    csv_reports.append(ds_report_file)
-
-                    user_report = user_reports.report_users_recursive(dataverse_identifier=account_info['identifier'])
-                    user_report_file = output.save_report_csv_file(output_file_path=work_dir + account_info['identifier'] + '-users.csv', headers=user_fieldnames, data=user_report)
-                    csv_reports.append(user_report_file)
-
-                # Combine CSV report(s) to an Excel spreadsheet
-                if len(csv_reports) > 0:
-                    output_file_path = output_dir + account_info['identifier'] + '-dataverse-reports.xlsx'
-                    excel_report_file = output.save_report_excel_file(output_file_path=output_file_path, worksheet_files=csv_reports)
-                    if excel_report_file:
-                        logger.info("Finished saving Excel file to %s.", excel_report_file)
-                        excel_reports.append(excel_report_file)
-                    else:
-                        logger.error("There was an error saving the Excel file.")
-
-            if options.email:
-                logger.info("Sending email to super admin with the report.")
-                email.email_report_admin(report_file_paths=excel_reports)
+    # Account subtrees are independent, so each worker generates whole accounts with its own connections
+    workers = min(options.account_workers, len(accounts))
+    logger.info("Generating reports for %s accounts with %s %s workers.", str(len(accounts)), str(workers), options.account_pool)
 
-        elif options.grouping == 'institutions':
-            for key in config['accounts']:
-                account_info = config['accounts'][key]
-                logger.info("Generating reports for %s.",  account_info['name'])
-
-                # Generate CSV report(s) based on command line option
-                csv_reports = []
-
-                if options.reports == 'dataverse':
-                    dv_report = dataverse_reports.report_dataverses_recursive(dataverse_identifier=account_info['identifier'])
-                    dv_report_file = output.save_report_csv_file(output_file_path=work_dir + account_info['identifier'] + '-dataverses.csv', headers=dataverse_fieldnames, data=dv_report)
-                    csv_reports.append(dv_report_file)
-                elif options.reports == 'dataset':
-                    ds_report = dataset_reports.report_datasets_recursive(dataverse_identifier=account_info['identifier'])
-                    # Only save report if there are datasets
-                    if ds_report is not None:
-                        ds_report_file = output.save_report_csv_file(output_file_path=work_dir + account_info['identifier'] + '-datasets.csv', headers=dataset_fieldnames, data=ds_report)
-                        csv_reports.append(ds_report_file)
-                elif options.reports == 'user':
-                    user_report = user_reports.report_users_recursive(dataverse_identifier=account_info['identifier'])
-                    # Only save report if there are users
-                    if user_report is not None:
-                        user_report_file = output.save_report_csv_file(output_file_path=work_dir + account_info['identifier'] + '-users.csv', headers=user_fieldnames, data=user_report)
-                        csv_reports.append(user_report_file)
-                else:   # Default option is all reports
-                    dv_report = dataverse_reports.report_dataverses_recursive(dataverse_identifier=account_info['identifier'])
-                    dv_report_file = output.save_report_csv_file(output_file_path=work_dir + account_info['identifier'] + '-dataverses.csv', headers=dataverse_fieldnames, data=dv_report)
-                    csv_reports.append(dv_report_file)
-
-                    ds_report = dataset_reports.report_datasets_recursive(dataverse_identifier=account_info['identifier'])
-                    ds_report_file = output.save_report_csv_file(output_file_path=work_dir + account_info['identifier'] + '-datasets.csv', headers=dataset_fieldnames, data=ds_report)
-                    csv_reports.append(ds_report_file)
-
-                    user_report = user_reports.report_users_recursive(dataverse_identifier=account_info['identifier'])
-                    user_report_file = output.save_report_csv_file(output_file_path=work_dir + account_info['identifier'] + '-users.csv', headers=user_fieldnames, data=user_report)
-                    csv_reports.append(user_report_file)
-
-                # Combine CSV report(s) to an Excel spreadsheet
-                if len(csv_reports) > 0:
-                    output_file_path = output_dir + account_info['identifier'] + '-dataverse-reports.xlsx'
-                    excel_report_file = output.save_report_excel_file(output_file_path=output_file_path, worksheet_files=csv_reports)
-                    if excel_report_file:
-                        logger.info("Finished saving Excel file to %s.", excel_report_file)
-                        if options.email:
-                            logger.info("Sending email to institutional liaison with the report.")
-                            email.email_report_institution(report_file_paths=[excel_report_file], account_info=account_info)
-                    else:
-                        logger.error("There was an error saving the Excel file.")
-        else:
-            logger.error("Unrecognized report grouping: %s.", options.grouping)
+    if options.account_pool == 'thread':
+        executor_class = ThreadPoolExecutor
     else:
-        # Start generating reports at the root dataverse 
-        logger.info('Generating reports from the root dataverse')
-        # Generate CSV report(s) based on command line option
-        csv_reports = []
-
-        if options.reports == 'dataverse':
-            dv_report = dataverse_reports.report_dataverses_recursive(dataverse_identifier='root')
-            dv_report_file = output.save_report_csv_file(output_file_path=work_dir + 'dataverses.csv', headers=dataverse_fieldnames, data=dv_report)
-            csv_reports.append(dv_report_file)
-        elif options.reports == 'dataset':
-            ds_report = dataset_reports.report_datasets_recursive(dataverse_identifier='root')
-            # Only save report if there are datasets
-            if ds_report is not None:
-                ds_report_file = output.save_report_csv_file(output_file_path=work_dir + 'datasets.csv', headers=dataset_fieldnames, data=ds_report)
-                csv_reports.append(ds_report_file)
-        elif options.reports == 'user':
-            user_report = user_reports.report_users_recursive(dataverse_identifier='root')
-            # Only save report if there are users
-            if user_report is not None:
-                user_report_file = output.save_report_csv_file(output_file_path=work_dir + 'users.csv', headers=user_fieldnames, data=user_report)
-                csv_reports.append(user_report_file)
-        else:   # Default option is all reports
-            dv_report = dataverse_reports.report_dataverses_recursive(dataverse_identifier='root')
-            dv_report_file = output.save_report_csv_file(output_file_path=work_dir + 'dataverses.csv', headers=dataverse_fieldnames, data=dv_report)
-            csv_reports.append(dv_report_file)
-
-            ds_report = dataset_reports.report_datasets_recursive(dataverse_identifier='root')
-            ds_report_file = output.save_report_csv_file(output_file_path=work_dir + 'datasets.csv', headers=dataset_fieldnames, data=ds_report)
-            csv_reports.append(ds_report_file)
-
-            user_report = user_reports.report_users_recursive(dataverse_identifier='root')
-            user_report_file = output.save_report_csv_file(output_file_path=work_dir + 'users.csv', headers=user_fieldnames, data=user_report)
-            csv_reports.append(user_report_file)
+        executor_class = ProcessPoolExecutor
 
-        # Store list of Excel report(s)
-        excel_reports = []
+    run_account = partial(run_account_worker, report_type=options.reports, work_dir=work_dir, output_dir=output_dir, fieldnames=fieldnames, save_csv=save_csv)
+    with executor_class(max_workers=workers, initializer=init_account_worker, initargs=(config, options, work_dir, executor_class is ProcessPoolExecutor)) as executor:
+        for account_info, excel_report_file in zip(accounts, executor.map(run_account, accounts)):
+            yield account_info, excel_report_file
 
-        # Combine CSV report(s) to an Excel spreadsheet
-        if len(csv_reports) > 0:
-            output_file_path = output_dir +  'dataverse-reports.xlsx'
-            excel_report_file = output.save_report_excel_file(output_file_path=output_file_path, worksheet_files=csv_reports)
-            if excel_report_file:
-                logger.info("Finished saving Excel file to %s.", excel_report_file)
-                excel_reports.append(excel_report_file)
-            else:
-                logger.error("There was an error saving the Excel file.")
+    # Thread workers leave their connections to the main process to close
+    while account_worker_contexts:
+        close_report_context(account_worker_contexts.pop())
 
-        if options.email:
-            logger.info("Sending email to super admin with the report.")
-            email.email_report_admin(report_file_paths=excel_reports)
+def init_account_worker(config=None, options=None, work_dir=None, worker_process=False):
+    # Runs once in each worker thread or process before it is given accounts
+    if not logging.getLogger('dataverse-reports').handlers:
+        # Spawned worker processes do not inherit the main process's logging setup
+        load_logger(config=config)
 
+    account_worker.context = create_report_context(config=config, options=options, work_dir=work_dir)
+    if not account_worker.context:
+        return
 
-    logger.info("Finished processing reports.")
+    if not worker_process:
+        account_worker_contexts.append(account_worker.context)
+    else:
+        # Worker processes close their own connections when the pool shuts them down
+        multiprocessing.util.Finalize(None, close_report_context, args=(account_worker.context,), exitpriority=10)
+
+def run_account_worker(account_info, report_type=None, work_dir=None, output_dir=None, fieldnames={}, save_csv=True):
+    if not account_worker.context:
+        logging.getLogger('dataverse-reports').error("Cannot create reports for %s because the worker has no connection to Dataverse.", account_info['name'])
+        return False
+
+    return create_account_report(context=account_worker.context, account_info=account_info, report_type=report_type, work_dir=work_dir, output_dir=output_dir, fieldnames=fieldnames, save_csv=save_csv)
+
+def create_account_report(context=None, account_info=None, report_type=None, work_dir=None, output_dir=None, fieldnames={}, save_csv=True):
+    logging.getLogger('dataverse-reports').info("Generating reports for %s.",  account_info['name'])
+
+    # Generate report(s) based on command line option straight into an Excel spreadsheet
+    output_file_path = output_dir + account_info['identifier'] + '-dataverse-reports.xlsx'
+    return create_excel_report(context=context, report_type=report_type, dataverse_identifier=account_info['identifier'], file_path_prefix=work_dir + account_info['identifier'] + '-', output_file_path=output_file_path, fieldnames=fieldnames, save_csv=save_csv)
+
+def create_excel_report(context=None, report_type=None, dataverse_identifier=None, file_path_prefix=None, output_file_path=None, fieldnames={}, save_csv=True):
+    # Returns the path of the Excel spreadsheet, or False if it could not be saved
+    logger = logging.getLogger('dataverse-reports')
+
+    output = context['output']
+    workbook = output.create_excel_file(output_file_path=output_file_path)
+    create_csv_reports(report_type=report_type, dataverse_identifier=dataverse_identifier, file_path_prefix=file_path_prefix, crawler=context['crawler'], dataverse_reports=context['dataverse_reports'], dataset_reports=context['dataset_reports'], user_reports=context['user_reports'], output=output, fieldnames=fieldnames, async_crawler=context['async_crawler'], loop=context['loop'], workbook=workbook, save_csv=save_csv, report_store=context['report_store'])
+
+    if not workbook:
+        return False
+
+    excel_report_file = output.close_excel_file(workbook)
+    if excel_report_file:
+        logger.info("Finished saving Excel file to %s.", excel_report_file)
+    else:
+        logger.error("There was an error saving the Excel file.")
+
+    return excel_report_file
+
+def create_csv_reports(report_type=None, dataverse_identifier=None, file_path_prefix=None, crawler=None, dataverse_reports=None, dataset_reports=None, user_reports=None, output=None, fieldnames={}, async_crawler=None, loop=None, workbook=None, save_csv=True, report_store=None):
+    # Generate CSV report(s) based on command line option
+    csv_reports = []
+
+    # Reports are streams of rows that the CSV, Excel, Parquet and report store writers consume as they are built
+    def save_report(name, headers, data):
+        output_file_path = None
+        if save_csv or not workbook:
+            output_file_path = file_path_prefix + name + '.csv'
+        parquet_file_path = None
+        if output.config.get('save_parquet_reports'):
+            parquet_file_path = file_path_prefix + name + '.parquet'
+        report_file = output.save_report_file(output_file_path=output_file_path, headers=headers, data=data, workbook=workbook or None, worksheet_name=name, parquet_file_path=parquet_file_path, report_store=report_store, account=dataverse_identifier)
+        if output_file_path is not None:
+            csv_reports.append(report_file)
+
+    # Use the thread pool crawler unless an asyncio crawler and event loop were given
+    if async_crawler is None:
+        crawl = crawler.crawl
+        report_dataverses = dataverse_reports.iter_dataverses
+        report_datasets = dataset_reports.iter_datasets
+        report_users = user_reports.iter_users
+    else:
+        crawl = lambda dataverse_identifier: loop.run_until_complete(async_crawler.crawl(dataverse_identifier))
+        report_dataverses = lambda dataverse_identifier, nodes=None: iterate_async(loop, dataverse_reports.iter_dataverses_async(dataverse_identifier, async_crawler, nodes=nodes))
+        report_datasets = lambda dataverse_identifier, nodes=None: iterate_async(loop, dataset_reports.iter_datasets_async(dataverse_identifier, async_crawler, nodes=nodes))
+        # Contacts come from the crawled dataverses, so only the crawl itself is awaited
+        report_users = lambda dataverse_identifier, nodes=None: user_reports.iter_users(dataverse_identifier, nodes=nodes or crawl(dataverse_identifier))
+
+    if report_type == 'dataverse':
+        dv_report = report_dataverses(dataverse_identifier=dataverse_identifier)
+        save_report('dataverses', fieldnames['dataverse'], dv_report)
+    elif report_type == 'dataset':
+        ds_report = report_datasets(dataverse_identifier=dataverse_identifier)
+        # Only save report if there are datasets
+        if ds_report is not None:
+            save_report('datasets', fieldnames['dataset'], ds_report)
+    elif report_type == 'user':
+        user_report = report_users(dataverse_identifier=dataverse_identifier)
+        # Only save report if there are users
+        if user_report is not None:
+            save_report('users', fieldnames['user'], user_report)
+    else:   # Default option is all reports
+        # Crawl the tree once and hand the same nodes to every report
+        nodes = crawl(dataverse_identifier)
+
+        dv_report = report_dataverses(dataverse_identifier=dataverse_identifier, nodes=nodes)
+        save_report('dataverses', fieldnames['dataverse'], dv_report)
+
+        ds_report = report_datasets(dataverse_identifier=dataverse_identifier, nodes=nodes)
+        save_report('datasets', fieldnames['dataset'], ds_report)
+
+        user_report = report_users(dataverse_identifier=dataverse_identifier, nodes=nodes)
+        save_report('users', fieldnames['user'], user_report)
+
+    return csv_reports
+
+def iterate_async(loop, async_iterator):
+    # Drive an async generator of rows on the event loop, one row at a time
+    while True:
+        try:
+            yield loop.run_until_complete(async_iterator.__anext__())
+        except StopAsyncIteration:
+            break
 
 def load_config(config_file):
     config = {}
@@ -0,0 +1,99 @@
+import os
+import copy
+import json
+import datetime
+import unittest
+
+from lib.database import DataverseDatabase
+from reports.dataset import DatasetReports
+from run import create_fieldnames
+
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+
+
+def load_golden_file(file_name):
+    with open(os.path.join(GOLDEN_DIR, file_name)) as golden_file:
+        return json.load(golden_file)
+
+
+class RecordedCursor(object):
+    # Replays the recorded rows of each query get_dataset_metadata runs, in the order it runs them
+    def __init__(self, queries):
+        self.queries = queries
+        self.rows = []
+
+    def execute(self, query, params=None):
+        if len(self.queries) == 0:
+            raise AssertionError("Unexpected query: " + query)
+        recorded = self.queries.pop(0)
+        if recorded['query'] not in query:
+            raise AssertionError("Expected query with '" + recorded['query'] + "', got: " + query)
+
+        # Timestamps are recorded as ISO strings, which psycopg2 would return as datetimes
+        self.rows = [tuple(datetime.datetime.fromisoformat(value) if c in recorded.get('timestamps', []) and value is not None else value for c, value in enumerate(row)) for row in recorded['rows']]
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if len(self.rows) > 0 else None
+
+    def close(self):
+        pass
+
+
+class RecordedConnection(object):
+    def __init__(self, queries):
+        self.queries = queries
+
+    def cursor(self):
+        return RecordedCursor(self.queries)
+
+
+class DatasetMetadataTest(unittest.TestCase):
+    def setUp(self):
+        self.api_json = load_golden_file('dataset-api.json')
+        self.queries = load_golden_file('dataset-database-rows.json')
+
+        self.dataverse_database = DataverseDatabase()
+        self.dataverse_database.conn = RecordedConnection(self.queries)
+        self.dataset_reports = DatasetReports(dataverse_api=object(), dataverse_database=self.dataverse_database, config={'work_dir': '/tmp/', 'include_dataset_metrics': False})
+
+    def get_database_dataset(self):
+        datasets = self.dataverse_database.get_dataset_metadata(dataset_ids=[42])
+        self.assertEqual(self.queries, [], "Not every recorded query was run.")
+        self.assertEqual(list(datasets.keys()), [42])
+        return datasets[42]
+
+    def get_api_row(self):
+        # As fetch_dataset builds it from the API response
+        dataset = copy.deepcopy(self.api_json['data'])
+        self.dataset_reports.flatten_dataset(dataset)
+        self.dataset_reports.add_files(dataset)
+        dataset.pop('files', None)
+        return dataset
+
+    def test_citation_fields_match_api(self):
+        dataset = self.get_database_dataset()
+
+        # Fields without values (keyword, a description without a date) are left out, as in the API's JSON
+        self.assertEqual(dataset['latestVersion']['metadataBlocks']['citation']['fields'], self.api_json['data']['latestVersion']['metadataBlocks']['citation']['fields'])
+
+    def test_dataset_row_matches_api(self):
+        dataset = self.get_database_dataset()
+        self.dataset_reports.build_database_dataset(dataset)
+
+        api_row = self.get_api_row()
+        fieldnames, verified_dataset_fieldnames = create_fieldnames(config={'include_dataset_metrics': False})
+        for fieldname in verified_dataset_fieldnames + ['datasetId']:
+            self.assertEqual(dataset.get(fieldname), api_row.get(fieldname), fieldname)
+
+    def test_persistent_url(self):
+        self.assertEqual(self.dataverse_database.get_persistent_url('doi', '10.5072', 'FK2/ABCDEF'), 'https://doi.org/10.5072/FK2/ABCDEF')
+        self.assertEqual(self.dataverse_database.get_persistent_url('hdl', '1902.1', '10001'), 'https://hdl.handle.net/1902.1/10001')
+        self.assertIsNone(self.dataverse_database.get_persistent_url('perma', 'FK2', 'ABCDEF'))
+
+
+if __name__ == '__main__':
+    unittest.main()
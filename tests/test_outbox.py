@@ -0,0 +1,127 @@
+import os
+import email
+import shutil
+import tempfile
+import threading
+import unittest
+import socketserver
+
+from lib.outbox import Outbox, OutboxDelivery
+
+
+class DebuggingSMTPHandler(socketserver.StreamRequestHandler):
+    # Just enough SMTP to accept messages, which are kept on the server; recipients containing 'greylist' are
+    # deferred once and recipients containing 'reject' are refused
+    def handle(self):
+        self.reply('220 localhost debugging SMTP server')
+        to_email = None
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                return
+
+            command = line.split(' ')[0].upper()
+            if command == 'RCPT':
+                to_email = line.split(':', 1)[1].strip('<> ')
+                if 'reject' in to_email:
+                    self.reply('550 No such user')
+                elif 'greylist' in to_email and to_email not in self.server.greylisted:
+                    self.server.greylisted.add(to_email)
+                    self.reply('451 Greylisted, try again later')
+                else:
+                    self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if data_line in (b'.\r\n', b''):
+                        break
+                    lines.append(data_line)
+                self.server.messages.append((to_email, email.message_from_bytes(b''.join(lines))))
+                self.reply('250 Queued')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode())
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), DebuggingSMTPHandler)
+        self.server.daemon_threads = True
+        self.server.messages = []
+        self.server.greylisted = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.work_dir = tempfile.mkdtemp()
+        self.report_file_path = os.path.join(self.work_dir, 'dataverse-reports.xlsx')
+        with open(self.report_file_path, 'wb') as report_file:
+            report_file.write(b'report')
+
+        self.config = {'smtp_host': '127.0.0.1', 'smtp_port': self.server.server_address[1], 'smtp_auth': '', 'smtp_username': '', 'smtp_password': ''}
+        self.outbox = Outbox(path=os.path.join(self.work_dir, 'dataverse-reports-outbox.sqlite'))
+
+    def tearDown(self):
+        self.outbox.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.work_dir)
+
+    def add_message(self, to_email, report_file_paths=None):
+        self.outbox.add_message(report_file_paths=report_file_paths or [self.report_file_path], to_email=to_email, from_email='reports@example.org', subject='Dataverse reports', body='The reports in Excel format are attached.')
+
+    def deliver(self, max_attempts=3):
+        return OutboxDelivery(outbox=self.outbox, config=self.config, workers=2, max_attempts=max_attempts, retry_delay=0.01).deliver()
+
+    def get_statuses(self):
+        return dict(self.outbox.conn.execute("SELECT to_email, status FROM messages").fetchall())
+
+    def test_sends_message_with_report(self):
+        self.add_message('admin@example.org')
+
+        self.assertEqual(self.deliver(), {'sent': 1, 'retried': 0, 'failed': 0})
+        self.assertEqual(len(self.server.messages), 1)
+        to_email, message = self.server.messages[0]
+        self.assertEqual(to_email, 'admin@example.org')
+        attachments = [part for part in message.walk() if part.get_filename() is not None]
+        self.assertEqual([part.get_filename() for part in attachments], ['dataverse-reports.xlsx'])
+        self.assertEqual(attachments[0].get_payload(decode=True), b'report')
+
+    def test_retries_temporary_errors_and_gives_up_on_permanent_ones(self):
+        self.add_message('greylist@example.org')
+        self.add_message('reject@example.org')
+
+        self.assertEqual(self.deliver(), {'sent': 1, 'retried': 1, 'failed': 1})
+        self.assertEqual([to_email for to_email, message in self.server.messages], ['greylist@example.org'])
+        self.assertEqual(self.get_statuses(), {'greylist@example.org': 'sent', 'reject@example.org': 'failed'})
+
+    def test_missing_report_is_not_sent(self):
+        self.add_message('admin@example.org', report_file_paths=[os.path.join(self.work_dir, 'missing.xlsx')])
+
+        self.assertEqual(self.deliver(), {'sent': 0, 'retried': 2, 'failed': 1})
+        self.assertEqual(self.server.messages, [])
+        self.assertEqual(self.get_statuses(), {'admin@example.org': 'failed'})
+        error = self.outbox.conn.execute("SELECT last_error FROM messages").fetchone()[0]
+        self.assertIn('missing.xlsx', error)
+
+    def test_stores_absolute_report_paths(self):
+        cwd = os.getcwd()
+        os.chdir(self.work_dir)
+        try:
+            self.add_message('admin@example.org', report_file_paths=['dataverse-reports.xlsx'])
+        finally:
+            os.chdir(cwd)
+
+        # Delivered from another directory, as deliver.py may be
+        self.assertEqual(self.outbox.claim_messages()[0]['report_file_paths'], [self.report_file_path])
+        self.outbox.conn.execute("UPDATE messages SET status = 'pending'")
+        self.assertEqual(self.deliver(), {'sent': 1, 'retried': 0, 'failed': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()